@@ -0,0 +1,657 @@
+"""コード生成・適応度評価・遺伝的操作のベンチマーク
+
+1. マイクロベンチマーク: generate_code / generate_codes / evaluate_fitness / crossover /
+   mutate / apply_action / extract_state / QTable.update_q_value を固定シード・固定のコード群で
+   計測し、1秒あたりの実行回数とレイテンシのパーセンタイル（p50/p90/p99）を表示する。
+   結果はベースライン（JSON）として保存でき、ベースラインと比べて p50 が閾値を超えて
+   遅くなった項目があれば終了コード1で終了する。
+2. 静的評価の比較: キーワードを1つずつ照合する legacy_count_keywords と count_keywords
+   （1回の走査）をテキストの長さごとに、従来の実装（legacy_static_fitness）と
+   static_fitness、および行動の系列に沿った static_fitness と incremental_static_fitness を
+   比較し、点数が完全に一致することも合わせて確認する。
+3. LLMの負荷試験（--llm-load）: MockLLMServer を起動し、LLMGateway から指定した数の
+   リクエストを並行して送って、スループットとレイテンシのパーセンタイルを表示する。
+   ネットワークやAPIキーは不要（anthropic パッケージは必要）。
+4. 起動時間: 新しいプロセスで main を読み込む時間を計測する。LLMのバックエンドなど
+   必要になるまで読み込まないモジュール（LAZY_MODULES）が読み込まれていないことと、
+   読み込むだけではカレントディレクトリに何も作られないことも確認する。
+
+使い方:
+    python benchmark.py                                  # 全て実行
+    python benchmark.py --save-baseline baseline.json    # 結果をベースラインとして保存
+    python benchmark.py --baseline baseline.json         # ベースラインと比較（25%以上遅くなれば失敗）
+    python benchmark.py --only crossover mutate --skip-static --skip-startup
+    python benchmark.py --only generate_code --skip-static --llm-load 200 --llm-concurrency 8 --llm-error-rate 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from main import (
+    CODE_OBJECT_CACHE,
+    COUNTED_KEYWORDS,
+    FITNESS_CACHE,
+    GENE_FEATURE_CACHE,
+    GENOME_CACHE,
+    Q_ACTIONS,
+    LLMGateway,
+    MockLLMServer,
+    PRESENCE_KEYWORDS,
+    STORY_ELEMENTS,
+    DenseQTable,
+    Individual,
+    QTable,
+    apply_action,
+    configure_execution,
+    count_keywords,
+    crossover,
+    extract_state,
+    generate_code,
+    generate_codes,
+    generate_random_class,
+    generate_random_function,
+    incremental_static_fitness,
+    mutate,
+    import_numpy,
+    static_fitness,
+)
+
+# Q学習の行動空間（q_learning と同じ）
+QL_ACTIONS = list(Q_ACTIONS)
+
+# ベースラインと比べてこの割合以上 p50 が遅くなったら失敗とする
+DEFAULT_THRESHOLD = 0.25
+
+
+def legacy_static_fitness(code):
+    """キーワードを1つずつ照合していた従来の静的評価（比較用の基準実装）"""
+    score = 0
+
+    # コードの複雑さ（関数とクラスの数）
+    num_functions = code.count("def ")
+    num_classes = code.count("class ")
+    score += (num_functions + num_classes * 2) * 5
+
+    # コードの長さ（適度な長さを評価）
+    lines = len([l for l in code.split("\n") if l.strip()])
+    if 20 <= lines <= 50:
+        score += 10
+
+    # 人が読めるテキスト出力の評価
+    human_readable_keywords = [
+        "こんにちは", "ようこそ", "完了", "実行中", "処理", "データ",
+        "結果", "システム", "お疲れ様", "ファイル", "タスク", "アイテム",
+        "Hello", "Welcome", "Complete", "Processing", "Result", "System",
+        "猫", "犬", "太郎", "花子", "物語", "昔々", "メッセージ"
+    ]
+    human_readable_count = sum(1 for keyword in human_readable_keywords if keyword in code)
+    score += human_readable_count * 15
+
+    # print文の数をカウント
+    print_count = code.count("print(")
+    score += min(print_count * 5, 25)
+
+    # テキスト生成操作
+    text_generation_patterns = [
+        '.join(', 'f"', '.append(', ' + "', 'message', 'text', 'sentence', 'story',
+    ]
+    text_gen_count = sum(1 for pattern in text_generation_patterns if pattern in code)
+    score += text_gen_count * 20
+
+    # 物語性の評価
+    story_keywords = [
+        "昔々", "ある", "そして", "しかし", "ついに", "こうして",
+        "物語", "冒険", "旅", "発見", "挑戦", "勇気", "友情",
+        "伝説", "魔法", "英雄", "quest", "hero", "journey"
+    ]
+    story_count = sum(1 for keyword in story_keywords if keyword in code)
+    score += story_count * 25
+
+    # 連続した文の評価
+    lines = code.split("\n")
+    consecutive_prints = 0
+    for i in range(len(lines) - 1):
+        if "print(" in lines[i] and "print(" in lines[i + 1]:
+            consecutive_prints += 1
+    score += consecutive_prints * 30
+
+    # f-stringの追加評価
+    if 'f"' in code or 'f\'' in code:
+        score += 20
+
+    # ストーリー要素の組み合わせ評価
+    story_elements_used = 0
+    for char in STORY_ELEMENTS["characters"]:
+        if char["name"] in code:
+            story_elements_used += 1
+    for loc in STORY_ELEMENTS["locations"]:
+        if loc in code:
+            story_elements_used += 1
+    for obj in STORY_ELEMENTS["objects"]:
+        if obj in code:
+            story_elements_used += 1
+    score += min(story_elements_used * 10, 50)
+
+    return score
+
+
+def legacy_count_keywords(text):
+    """キーワードを1つずつ str.count / in で照合する count_keywords（比較用の基準実装）"""
+    counts = {}
+    for keyword in COUNTED_KEYWORDS:
+        occurrences = text.count(keyword)
+        if occurrences:
+            counts[keyword] = occurrences
+    for keyword in PRESENCE_KEYWORDS:
+        if keyword in text:
+            counts[keyword] = 1
+    return counts
+
+
+def build_corpus(size, extra_genes, seed=0):
+    """固定シードでコード群を生成（extra_genes個の関数・クラスを追加して長いコードも作る）"""
+    random.seed(seed)
+    corpus = []
+    for _ in range(size):
+        code = generate_code()
+        for _ in range(extra_genes):
+            gene = random.choice([generate_random_function, generate_random_class])()
+            code += "\n" + gene
+        corpus.append(code)
+    return corpus
+
+
+def time_per_call(func, corpus, repeat=5):
+    """1回あたりの実行時間（マイクロ秒、repeat回の最小値）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for code in corpus:
+            func(code)
+        best = min(best, time.perf_counter() - start)
+    return best / len(corpus) * 1e6
+
+
+def benchmark_static_fitness():
+    """従来の実装と static_fitness の速度を比較（点数の不一致があればFalse）"""
+    print("静的評価: 従来の実装 vs static_fitness")
+    print(f"{'追加遺伝子':>10} {'平均文字数':>10} {'従来(us)':>10} {'新(us)':>10} {'速度比':>8}")
+
+    all_identical = True
+    for extra_genes in (0, 5, 10, 20, 40):
+        corpus = build_corpus(size=100, extra_genes=extra_genes)
+        mismatches = sum(
+            1 for code in corpus if legacy_static_fitness(code) != static_fitness(code)
+        )
+        if mismatches:
+            all_identical = False
+            print(f"  ⚠️  点数の不一致: {mismatches}件")
+
+        legacy_us = time_per_call(legacy_static_fitness, corpus)
+        new_us = time_per_call(static_fitness, corpus)
+        average_length = sum(len(code) for code in corpus) / len(corpus)
+        print(
+            f"{extra_genes:>10} {average_length:>10.0f} {legacy_us:>10.1f} "
+            f"{new_us:>10.1f} {legacy_us / new_us:>7.2f}x"
+        )
+
+    return all_identical
+
+
+def benchmark_keyword_matching():
+    """キーワードの照合: 1つずつ照合する実装と count_keywords（1回の走査）を長さごとに比較（不一致があればFalse）"""
+    print("キーワードの照合: 1つずつ照合 vs count_keywords")
+    print(f"{'テキスト':>10} {'平均文字数':>10} {'従来(us)':>10} {'新(us)':>10} {'速度比':>8}")
+
+    random.seed(0)
+    genes = [random.choice([generate_random_function, generate_random_class])() for _ in range(300)]
+    programs = build_corpus(size=100, extra_genes=40)
+    cases = [("遺伝子", genes)] + [(f"{size}文字", [code[:size] for code in programs]) for size in (500, 1000, 2000)]
+    cases.append(("コード全体", programs))
+
+    all_identical = True
+    for label, texts in cases:
+        mismatches = sum(1 for text in texts if legacy_count_keywords(text) != count_keywords(text))
+        if mismatches:
+            all_identical = False
+            print(f"  ⚠️  照合結果の不一致: {mismatches}件")
+
+        legacy_us = time_per_call(legacy_count_keywords, texts, repeat=10)
+        new_us = time_per_call(count_keywords, texts, repeat=10)
+        average_length = sum(len(text) for text in texts) / len(texts)
+        print(
+            f"{label:>10} {average_length:>10.0f} {legacy_us:>10.1f} "
+            f"{new_us:>10.1f} {legacy_us / new_us:>7.2f}x"
+        )
+
+    return all_identical
+
+
+def build_action_chain(steps, seed=0):
+    """固定シードで関数・クラスを1つずつ追加・削除していったコードの系列を生成"""
+    random.seed(seed)
+    individual = Individual(generate_code())
+    chain = []
+    for _ in range(steps):
+        action = random.choice(["add_function", "add_class", "remove_function", "modify_operator", "mutate"])
+        individual = apply_action(individual, action)
+        chain.append(individual.code)
+    return chain
+
+
+def benchmark_incremental_fitness():
+    """行動の系列に沿って static_fitness と incremental_static_fitness を比較（不一致があればFalse）"""
+    print("静的評価: static_fitness vs incremental_static_fitness（行動の系列）")
+    print(f"{'ステップ数':>10} {'最終文字数':>10} {'全体(us)':>10} {'差分(us)':>10} {'速度比':>8}")
+
+    all_identical = True
+    for steps in (50, 150, 300):
+        chain = build_action_chain(steps)
+        mismatches = sum(
+            1 for code in chain if static_fitness(code) != incremental_static_fitness(code)
+        )
+        if mismatches:
+            all_identical = False
+            print(f"  ⚠️  点数の不一致: {mismatches}件")
+
+        full_us = time_per_call(static_fitness, chain, repeat=1)
+        # 系列を先頭から1回だけ評価する（各ステップでは直前のコードの遺伝子だけがキャッシュ済み）
+        GENE_FEATURE_CACHE.clear()
+        incremental_us = time_per_call(incremental_static_fitness, chain, repeat=1)
+        print(
+            f"{steps:>10} {len(chain[-1]):>10} {full_us:>10.1f} "
+            f"{incremental_us:>10.1f} {full_us / incremental_us:>7.2f}x"
+        )
+
+    return all_identical
+
+
+# ============================================================
+# マイクロベンチマーク
+# ============================================================
+
+
+def clear_caches():
+    """適応度・ゲノム・コンパイル結果のキャッシュを全てクリア（キャッシュなしの計測用）"""
+    for cache in (FITNESS_CACHE, GENE_FEATURE_CACHE, GENOME_CACHE, CODE_OBJECT_CACHE):
+        cache.clear()
+
+
+def build_individuals(size=50, extra_genes=5, seed=0):
+    """固定シードのコード群から適応度を評価済みの個体群を生成"""
+    individuals = [Individual(code) for code in build_corpus(size, extra_genes, seed)]
+    for individual in individuals:
+        individual.evaluate_fitness()
+    return individuals
+
+
+def setup_generate_code(individuals):
+    return lambda: generate_code()
+
+
+def setup_generate_codes(individuals):
+    # 100個をまとめて生成（1個あたりの時間は計測値を100で割って generate_code と比較する）
+    def run():
+        for _ in generate_codes(100):
+            pass
+
+    return run
+
+
+def setup_evaluate_fitness(individuals):
+    # 毎回キャッシュをクリアするので、実行と静的評価の全体を計測する
+    codes = [individual.code for individual in individuals]
+    position = iter(range(sys.maxsize))
+
+    def prepare():
+        clear_caches()
+
+    def run():
+        Individual(codes[next(position) % len(codes)]).evaluate_fitness()
+
+    return run, prepare
+
+
+def setup_crossover(individuals):
+    return lambda: crossover(random.choice(individuals), random.choice(individuals))
+
+
+def setup_mutate(individuals):
+    return lambda: mutate(Individual(random.choice(individuals).code), mutation_rate=1.0)
+
+
+def setup_apply_action(individuals):
+    return lambda: apply_action(random.choice(individuals), random.choice(QL_ACTIONS))
+
+
+def setup_extract_state(individuals):
+    return lambda: extract_state(random.choice(individuals))
+
+
+def setup_update_q_value(individuals, table_class=QTable):
+    q_table = table_class(QL_ACTIONS)
+    states = [extract_state(individual) for individual in individuals]
+    return lambda: q_table.update_q_value(
+        random.choice(states), random.choice(QL_ACTIONS), random.uniform(-50, 50), random.choice(states)
+    )
+
+
+def setup_update_q_value_dense(individuals):
+    return setup_update_q_value(individuals, DenseQTable)
+
+
+def setup_update_batch_dense(individuals):
+    # 100件の遷移をまとめて更新（1件あたりの時間は計測値を100で割って比較する）
+    q_table = DenseQTable(QL_ACTIONS)
+    states = [extract_state(individual) for individual in individuals]
+    transitions = [
+        (random.choice(states), random.choice(QL_ACTIONS), random.uniform(-50, 50), random.choice(states))
+        for _ in range(100)
+    ]
+    batch = tuple(zip(*transitions))
+    return lambda: q_table.update_batch(*batch)
+
+
+# 名前 -> (準備関数, 計測回数, 1サンプルあたりの呼び出し回数)
+# 準備関数は計測する関数、または (計測する関数, 各サンプルの前に計測外で呼ぶ関数) を返す
+# 1回が速い操作はまとめて呼び出し、計測のオーバーヘッドの影響を抑える
+MICRO_BENCHMARKS = {
+    "generate_code": (setup_generate_code, 300, 1),
+    "generate_codes_x100": (setup_generate_codes, 30, 1),
+    "evaluate_fitness": (setup_evaluate_fitness, 100, 1),
+    "crossover": (setup_crossover, 300, 1),
+    "mutate": (setup_mutate, 300, 1),
+    "apply_action": (setup_apply_action, 300, 1),
+    "extract_state": (setup_extract_state, 300, 20),
+    "update_q_value": (setup_update_q_value, 300, 100),
+}
+if import_numpy() is not None:
+    MICRO_BENCHMARKS["update_q_value_dense"] = (setup_update_q_value_dense, 300, 100)
+    MICRO_BENCHMARKS["update_batch_dense_x100"] = (setup_update_batch_dense, 300, 10)
+
+
+def percentile(sorted_values, fraction):
+    """ソート済みの値のパーセンタイル（最近傍法）"""
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def measure(run, samples, batch, prepare=None, warmup=10, rounds=3):
+    """1回あたりのレイテンシ（マイクロ秒）を samples 個計測して統計を返す
+
+    他のプロセスの影響を抑えるため、rounds 回計測して p50 が最も小さい回の統計を使う。
+    """
+    for _ in range(warmup):
+        if prepare is not None:
+            prepare()
+        run()
+
+    best = None
+    for _ in range(rounds):
+        latencies = []
+        total = 0.0
+        for _ in range(samples):
+            if prepare is not None:
+                prepare()
+            start = time.perf_counter()
+            for _ in range(batch):
+                run()
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            latencies.append(elapsed / batch * 1e6)
+
+        latencies.sort()
+        stats = {
+            "ops_per_sec": samples * batch / total,
+            "p50_us": percentile(latencies, 0.50),
+            "p90_us": percentile(latencies, 0.90),
+            "p99_us": percentile(latencies, 0.99),
+        }
+        if best is None or stats["p50_us"] < best["p50_us"]:
+            best = stats
+    return best
+
+
+def run_micro_benchmarks(names, seed=0):
+    """マイクロベンチマークを実行して 名前 -> 統計 を返す"""
+    configure_execution(output="discard")  # 候補コードの出力で計測が乱れないようにする
+    clear_caches()
+    individuals = build_individuals(seed=seed)
+
+    print("マイクロベンチマーク")
+    print(f"{'項目':<24} {'ops/sec':>12} {'p50(us)':>10} {'p90(us)':>10} {'p99(us)':>10}")
+    results = {}
+    for name in names:
+        setup, samples, batch = MICRO_BENCHMARKS[name]
+        random.seed(seed)  # 項目ごとに同じ乱数列から始める
+        prepared = setup(individuals)
+        run, prepare = prepared if isinstance(prepared, tuple) else (prepared, None)
+        stats = measure(run, samples, batch, prepare)
+        results[name] = stats
+        print(
+            f"{name:<24} {stats['ops_per_sec']:>12.1f} {stats['p50_us']:>10.1f} "
+            f"{stats['p90_us']:>10.1f} {stats['p99_us']:>10.1f}"
+        )
+    return results
+
+
+def save_baseline(path, results, seed):
+    """計測結果をベースラインとしてJSONで保存"""
+    baseline = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    print(f"ベースラインを保存しました: {path}")
+
+
+def compare_with_baseline(path, results, threshold=DEFAULT_THRESHOLD):
+    """ベースラインと比較し、p50 が閾値を超えて遅くなった項目の一覧を返す"""
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    print(f"ベースラインとの比較（{path}、閾値 +{threshold * 100:.0f}%）")
+    print(f"{'項目':<24} {'基準p50(us)':>12} {'現在p50(us)':>12} {'変化':>8}")
+    regressions = []
+    for name, stats in results.items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            print(f"{name:<24} {'-':>12} {stats['p50_us']:>12.1f}   （ベースラインなし）")
+            continue
+        change = stats["p50_us"] / reference["p50_us"] - 1
+        mark = "  ⚠️" if change > threshold else ""
+        print(f"{name:<24} {reference['p50_us']:>12.1f} {stats['p50_us']:>12.1f} {change * 100:>+7.1f}%{mark}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+# ============================================================
+# LLMの負荷試験（モックサーバーに対して LLMGateway を使う）
+# ============================================================
+
+
+def run_llm_load_test(requests, concurrency, latency=0.05, error_rate=0.0, requests_per_minute=None, seed=0):
+    """モックサーバーに requests 件のリクエストを同時実行数 concurrency で送り、結果を表示する"""
+    random.seed(seed)
+    prompts = [generate_code() for _ in range(requests)]
+    server = MockLLMServer(latency=latency, error_rate=error_rate, seed=seed).start()
+    gateway = LLMGateway(
+        api_key="mock",
+        base_url=server.url,
+        max_concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        backoff_base=0.05,
+        use_cache=False,
+    )
+
+    async def timed_completion(prompt):
+        start = time.perf_counter()
+        try:
+            await gateway.complete_async(prompt, helper="load_test")
+            return time.perf_counter() - start
+        except Exception:
+            return None
+
+    async def run_all():
+        try:
+            return await asyncio.gather(*(timed_completion(prompt) for prompt in prompts))
+        finally:
+            await gateway.aclose()
+
+    start = time.perf_counter()
+    results = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    latencies = sorted(result * 1000 for result in results if result is not None)
+    print(
+        f"LLM負荷試験: {requests}件, 同時実行数 {concurrency}, 遅延 {latency * 1000:.0f}ms, "
+        f"エラー率 {error_rate:.0%}"
+    )
+    print(
+        f"  成功: {len(latencies)}/{requests}, エラー応答（再試行）: {server.error_count}, "
+        f"所要時間: {elapsed:.2f}s, スループット: {requests / elapsed:.1f} req/s"
+    )
+    if latencies:
+        print(
+            f"  レイテンシ(ms): p50 {percentile(latencies, 0.5):.1f}, "
+            f"p90 {percentile(latencies, 0.9):.1f}, p99 {percentile(latencies, 0.99):.1f}"
+        )
+    return len(latencies) == requests
+
+
+# ============================================================
+# 起動時間（新しいプロセスでの main の読み込み）
+# ============================================================
+
+# main の読み込み時には読み込まれないはずのモジュール（LLM・非同期API・DenseQTable を使うときに読み込む）
+LAZY_MODULES = ("anthropic", "dotenv", "numpy", "asyncio")
+
+# 子プロセスで実行するスクリプト（main の読み込み時間と、読み込まれた LAZY_MODULES を出力）
+STARTUP_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+def benchmark_startup(runs=10):
+    """新しいプロセスで main を読み込む時間を runs 回計測して表示（問題が無ければ True）
+
+    空の一時ディレクトリをカレントディレクトリにして実行し、読み込んだだけで何も作られないことを確認する。
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(Path(__file__).resolve().parent), env.get("PYTHONPATH")]))
+    import_times, process_times, interpreter_times = [], [], []
+    loaded = set()
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], cwd=cwd, env=env, check=True)
+            interpreter_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT], cwd=cwd, env=env, capture_output=True, text=True, check=True
+            )
+            process_times.append(time.perf_counter() - start)
+            result = json.loads(completed.stdout.splitlines()[-1])
+            import_times.append(result["seconds"])
+            loaded.update(result["loaded"])
+        created = sorted(os.listdir(cwd))
+
+    print("起動時間（新しいプロセスで main を読み込む）")
+    print(
+        f"  import main: 中央値 {statistics.median(import_times) * 1000:.1f}ms, "
+        f"最小 {min(import_times) * 1000:.1f}ms（{runs}回）"
+    )
+    print(
+        f"  プロセス全体: 中央値 {statistics.median(process_times) * 1000:.1f}ms "
+        f"（インタプリタの起動のみ: {statistics.median(interpreter_times) * 1000:.1f}ms）"
+    )
+    if loaded:
+        print(f"  ⚠️  読み込み時に読み込まれたモジュール: {', '.join(sorted(loaded))}")
+    if created:
+        print(f"  ⚠️  読み込み時に作成されたファイル: {', '.join(created)}")
+    if not loaded and not created:
+        print(f"  ✅ {', '.join(LAZY_MODULES)} は読み込まれず、ファイルも作成されませんでした")
+    return not loaded and not created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="コード生成・適応度評価・遺伝的操作のベンチマーク")
+    parser.add_argument(
+        "--only", nargs="+", choices=list(MICRO_BENCHMARKS), help="実行するマイクロベンチマーク"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイル")
+    parser.add_argument("--save-baseline", help="計測結果をベースラインとして保存するJSONファイル")
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD, help="失敗とする p50 の増加率（0.25: 25%%）"
+    )
+    parser.add_argument("--skip-static", action="store_true", help="静的評価の比較を行わない")
+    parser.add_argument("--skip-startup", action="store_true", help="起動時間の計測を行わない")
+    parser.add_argument("--startup-runs", type=int, default=10, help="起動時間の計測回数")
+    parser.add_argument("--llm-load", type=int, default=0, help="LLMの負荷試験で送るリクエスト数（0: 行わない）")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="LLMの負荷試験の同時実行数")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="モックサーバーの応答遅延（秒）")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="モックサーバーがエラーを返す割合")
+    parser.add_argument("--llm-rpm", type=float, default=None, help="LLMの負荷試験のレート制限（1分あたり）")
+    args = parser.parse_args(argv)
+
+    failed = False
+    results = run_micro_benchmarks(args.only or list(MICRO_BENCHMARKS), seed=args.seed)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results, args.seed)
+    if args.baseline:
+        regressions = compare_with_baseline(args.baseline, results, args.threshold)
+        if regressions:
+            print(f"⚠️  性能が低下した項目: {', '.join(regressions)}")
+            failed = True
+
+    if not args.skip_static:
+        print()
+        if not all(
+            [benchmark_keyword_matching(), benchmark_static_fitness(), benchmark_incremental_fitness()]
+        ):
+            failed = True
+
+    if not args.skip_startup:
+        print()
+        if not benchmark_startup(args.startup_runs):
+            failed = True
+
+    if args.llm_load:
+        print()
+        if not run_llm_load_test(
+            args.llm_load,
+            args.llm_concurrency,
+            latency=args.llm_latency,
+            error_rate=args.llm_error_rate,
+            requests_per_minute=args.llm_rpm,
+            seed=args.seed,
+        ):
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,99 @@
+import argparse
+import atexit
 import random
 import string
 import time
 import re
 import os
+import ast
+import sys
 import math
+import json
+import io
+import builtins
+import bisect
+import contextlib
+import functools
+import gzip
+import hashlib
+import itertools
+import keyword
+import marshal
+import mmap
+import queue
+import sqlite3
+import struct
+import subprocess
+import threading
+import traceback
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from anthropic import Anthropic
-from dotenv import load_dotenv
 
-# .envファイルから環境変数を読み込む
-load_dotenv()
+# 任意: DenseQTable で使用（無ければ辞書の QTable を使う）
+# 読み込みに時間がかかるので、import_numpy() で必要になったときに読み込む
+np = None
 
-# 生成されたコードを保存するディレクトリ
+try:
+    import fcntl  # POSIXのみ: Q-tableファイルの排他ロック
+except ImportError:
+    fcntl = None
+
+# 生成されたコードを保存するディレクトリ（最初に保存するときに作成する）
 GENERATED_CODES_DIR = Path("generated_codes")
-GENERATED_CODES_DIR.mkdir(exist_ok=True)
 
 
-def generate_random_identifier(length=8):
+@functools.cache
+def import_numpy():
+    """numpy を読み込んで返す（インストールされていなければ None、読み込みは初回のみ）"""
+    global np
+    try:
+        import numpy
+    except ImportError:
+        return None
+    np = numpy
+    return np
+
+
+@functools.cache
+def load_llm_backend():
+    """LLMのバックエンド（anthropic）を読み込み、.envファイルから環境変数を読み込む（初回のみ）
+
+    anthropic の読み込みには時間がかかるので、モジュールの読み込み時ではなくLLMを使うときに呼ぶ。
+    """
+    import anthropic
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return anthropic
+
+
+# 識別子に使う文字（先頭は英小文字）
+_IDENTIFIER_HEAD_CHARS = string.ascii_lowercase
+_IDENTIFIER_CHARS = string.ascii_lowercase + string.digits + "_"
+
+_VALUE_TYPES = ("int", "str", "bool", "list")
+_BOOL_VALUES = ("True", "False")
+
+
+def generate_random_identifier(length=8, rng=random):
     """ランダムな識別子を生成"""
-    first_char = random.choice(string.ascii_lowercase)
-    rest_chars = "".join(
-        random.choices(string.ascii_lowercase + string.digits + "_", k=length - 1)
-    )
-    return first_char + rest_chars
+    return rng.choice(_IDENTIFIER_HEAD_CHARS) + "".join(rng.choices(_IDENTIFIER_CHARS, k=length - 1))
 
 
-def generate_random_value():
+def generate_random_value(rng=random):
     """ランダムな値を生成"""
-    value_type = random.choice(["int", "str", "bool", "list"])
+    value_type = rng.choice(_VALUE_TYPES)
     if value_type == "int":
-        return random.randint(0, 1000)
+        return rng.randint(0, 1000)
     elif value_type == "str":
-        return f'"{generate_random_identifier(5)}"'
+        return f'"{generate_random_identifier(5, rng)}"'
     elif value_type == "bool":
-        return random.choice(["True", "False"])
+        return rng.choice(_BOOL_VALUES)
     else:
-        return f'[{", ".join(str(random.randint(0, 100)) for _ in range(random.randint(1, 5)))}]'
+        return f'[{", ".join(str(rng.randint(0, 100)) for _ in range(rng.randint(1, 5)))}]'
 
 
 # テキスト生成用のデータ
@@ -91,41 +148,54 @@ STORY_ELEMENTS = {
 }
 
 
-def generate_human_readable_text():
+# 人が読めるテキストのテンプレート（{} には生成時に乱数を埋め込む）
+HUMAN_READABLE_TEMPLATES = (
+    "こんにちは、世界！",
+    "プログラムを実行中です",
+    "処理が完了しました",
+    "データを読み込んでいます",
+    "計算結果: {number}",
+    "ようこそ、{name}さん",
+    "今日は良い天気ですね",
+    "システムは正常に動作しています",
+    "ファイルを保存しました",
+    "エラーはありません",
+    "処理中: {percent}%",
+    "タスクが開始されました",
+    "{count}個のアイテムが見つかりました",
+    "お疲れ様でした！",
+    "次のステップに進みます",
+)
+_HUMAN_READABLE_NAMES = ("太郎", "花子", "ユーザー")
+
+_STORY_ARC_TYPES = ("introduction", "development", "twist", "conclusion")
+
+
+def generate_human_readable_text(rng=random):
     """人が読める意味のあるテキストを生成"""
-    text_templates = [
-        "こんにちは、世界！",
-        "プログラムを実行中です",
-        "処理が完了しました",
-        "データを読み込んでいます",
-        "計算結果: {}".format(random.randint(1, 100)),
-        "ようこそ、{}さん".format(random.choice(["太郎", "花子", "ユーザー"])),
-        "今日は良い天気ですね",
-        "システムは正常に動作しています",
-        "ファイルを保存しました",
-        "エラーはありません",
-        "処理中: {}%".format(random.randint(0, 100)),
-        "タスクが開始されました",
-        "{}個のアイテムが見つかりました".format(random.randint(1, 50)),
-        "お疲れ様でした！",
-        "次のステップに進みます",
-    ]
-    return f'"{random.choice(text_templates)}"'
+    # 埋め込む値は使わないテンプレートでも引く（同じシードから同じコードを生成するため）
+    values = {
+        "number": rng.randint(1, 100),
+        "name": rng.choice(_HUMAN_READABLE_NAMES),
+        "percent": rng.randint(0, 100),
+        "count": rng.randint(1, 50),
+    }
+    return f'"{rng.choice(HUMAN_READABLE_TEMPLATES).format_map(values)}"'
 
 
-def generate_story_text():
+def generate_story_text(rng=random):
     """物語性のあるテキストを生成（単文）"""
     # ランダムにストーリー要素を選択
-    character = random.choice(STORY_ELEMENTS["characters"])
-    location = random.choice(STORY_ELEMENTS["locations"])
-    time = random.choice(STORY_ELEMENTS["times"])
-    event = random.choice(STORY_ELEMENTS["events"])
-    object_item = random.choice(STORY_ELEMENTS["objects"])
-    emotion = random.choice(STORY_ELEMENTS["emotions"])
+    character = rng.choice(STORY_ELEMENTS["characters"])
+    location = rng.choice(STORY_ELEMENTS["locations"])
+    time = rng.choice(STORY_ELEMENTS["times"])
+    event = rng.choice(STORY_ELEMENTS["events"])
+    object_item = rng.choice(STORY_ELEMENTS["objects"])
+    emotion = rng.choice(STORY_ELEMENTS["emotions"])
 
     # 起承転結のどれかを選んで文を生成
-    arc_type = random.choice(["introduction", "development", "twist", "conclusion"])
-    template = random.choice(STORY_ELEMENTS["story_arc"][arc_type])
+    arc_type = rng.choice(_STORY_ARC_TYPES)
+    template = rng.choice(STORY_ELEMENTS["story_arc"][arc_type])
 
     # テンプレートに要素を埋め込む
     story = template.format(
@@ -141,201 +211,217 @@ def generate_story_text():
     return f'"{story}"'
 
 
-def generate_multi_sentence_story():
+def generate_multi_sentence_story(rng=random):
     """複数の文からなる物語を生成"""
     # ストーリーのコンテキストを保持
-    character = random.choice(STORY_ELEMENTS["characters"])
-    location = random.choice(STORY_ELEMENTS["locations"])
-    object_item = random.choice(STORY_ELEMENTS["objects"])
+    character = rng.choice(STORY_ELEMENTS["characters"])
+    location = rng.choice(STORY_ELEMENTS["locations"])
+    object_item = rng.choice(STORY_ELEMENTS["objects"])
+    story_arc = STORY_ELEMENTS["story_arc"]
 
     # 起承転結の順番で文を生成
     sentences = []
 
     # 起
-    intro_template = random.choice(STORY_ELEMENTS["story_arc"]["introduction"])
+    intro_template = rng.choice(story_arc["introduction"])
     sentences.append(intro_template.format(
         character=character["name"],
         trait=character["trait"],
         location=location,
-        time=random.choice(STORY_ELEMENTS["times"])
+        time=rng.choice(STORY_ELEMENTS["times"])
     ))
 
     # 承
-    dev_template = random.choice(STORY_ELEMENTS["story_arc"]["development"])
+    dev_template = rng.choice(story_arc["development"])
     sentences.append(dev_template.format(
         character=character["name"],
         location=location,
         object=object_item,
-        event=random.choice(STORY_ELEMENTS["events"])
+        event=rng.choice(STORY_ELEMENTS["events"])
     ))
 
     # 転（確率的に追加）
-    if random.random() > 0.5:
-        twist_template = random.choice(STORY_ELEMENTS["story_arc"]["twist"])
+    if rng.random() > 0.5:
+        twist_template = rng.choice(story_arc["twist"])
         sentences.append(twist_template.format(
             character=character["name"],
             location=location,
-            event=random.choice(STORY_ELEMENTS["events"]),
-            emotion=random.choice(STORY_ELEMENTS["emotions"])
+            event=rng.choice(STORY_ELEMENTS["events"]),
+            emotion=rng.choice(STORY_ELEMENTS["emotions"])
         ))
 
     # 結
-    conclusion_template = random.choice(STORY_ELEMENTS["story_arc"]["conclusion"])
+    conclusion_template = rng.choice(story_arc["conclusion"])
     sentences.append(conclusion_template.format(
         character=character["name"],
-        emotion=random.choice(STORY_ELEMENTS["emotions"])
+        emotion=rng.choice(STORY_ELEMENTS["emotions"])
     ))
 
     return " ".join(sentences)
 
 
-def generate_text_generation_operation():
+# テキスト生成に特化した操作の表（同じ操作を複数並べて選ばれる確率を上げる）
+# 呼び出しのたびに表を作り直さないよう、モジュールの読み込み時に1回だけ作る
+TEXT_GENERATION_OPERATIONS = (
+    # 物語生成操作（最優先・高確率）
+    lambda rng: f'print({generate_story_text(rng)})',
+    lambda rng: f'print({generate_story_text(rng)})',
+    lambda rng: f'print({generate_story_text(rng)})',
+    lambda rng: f'print({generate_story_text(rng)})',
+
+    # 複数文の物語生成
+    lambda rng: f'story = "{generate_multi_sentence_story(rng)}"; print(story)',
+    lambda rng: f'story = "{generate_multi_sentence_story(rng)}"; print(story)',
+    lambda rng: f'story = "{generate_multi_sentence_story(rng)}"; print(story)',
+
+    # 連続した物語の展開
+    lambda rng: 'print("昔々あるところに"); print("そして冒険が始まった"); print("最後に平和が訪れた")',
+    lambda rng: 'print("物語が始まる"); print("困難に立ち向かう"); print("希望を見つけた")',
+
+    # 物語要素の変数化と組み合わせ
+    lambda rng: f'character = "{rng.choice(STORY_ELEMENTS["characters"])["name"]}"; location = "{rng.choice(STORY_ELEMENTS["locations"])}"; print(f"{{character}}は{{location}}にいる")',
+    lambda rng: f'hero = "{rng.choice(STORY_ELEMENTS["characters"])["name"]}"; quest = "{rng.choice(STORY_ELEMENTS["objects"])}"; print(f"{{hero}}は{{quest}}を求めて旅に出た")',
+
+    # 既存の操作も残す（確率は低め）
+    lambda rng: 'print("生成されたテキスト: " + "".join(["猫", "が", "走る"]))',
+    lambda rng: f'print("{rng.choice(("猫", "犬", "太郎", "花子"))}が{rng.choice(("走る", "歌う", "考える", "笑う"))}")',
+    lambda rng: 'print("昔々あるところに小さな村がありました")',
+)
+
+# ランダムな操作の表（テキスト生成を最優先）
+RANDOM_OPERATIONS = (
+    lambda rng: generate_text_generation_operation(rng),  # テキスト生成操作（最優先）
+    lambda rng: generate_text_generation_operation(rng),  # 確率を上げるため2回
+    lambda rng: generate_text_generation_operation(rng),  # 確率を上げるため3回
+    lambda rng: f"print({generate_human_readable_text(rng)})",  # 人が読めるテキスト
+    lambda rng: f"print({generate_human_readable_text(rng)})",  # 確率を上げるため2回
+    lambda rng: f"print({generate_random_value(rng)})",
+    lambda rng: f"{generate_random_identifier(rng=rng)} = {generate_random_value(rng)}",
+    lambda rng: f"result = {rng.randint(1, 100)} {rng.choice(('+', '-', '*', '//', '%'))} {rng.randint(1, 100)}",
+)
+
+
+def generate_text_generation_operation(rng=random):
     """テキスト生成に特化した操作を生成（物語性重視）"""
-    text_ops = [
-        # 物語生成操作（最優先・高確率）
-        lambda: f'print({generate_story_text()})',
-        lambda: f'print({generate_story_text()})',
-        lambda: f'print({generate_story_text()})',
-        lambda: f'print({generate_story_text()})',
-
-        # 複数文の物語生成
-        lambda: f'story = "{generate_multi_sentence_story()}"; print(story)',
-        lambda: f'story = "{generate_multi_sentence_story()}"; print(story)',
-        lambda: f'story = "{generate_multi_sentence_story()}"; print(story)',
-
-        # 連続した物語の展開
-        lambda: 'print("昔々あるところに"); print("そして冒険が始まった"); print("最後に平和が訪れた")',
-        lambda: 'print("物語が始まる"); print("困難に立ち向かう"); print("希望を見つけた")',
-
-        # 物語要素の変数化と組み合わせ
-        lambda: f'character = "{random.choice(STORY_ELEMENTS["characters"])["name"]}"; location = "{random.choice(STORY_ELEMENTS["locations"])}"; print(f"{{character}}は{{location}}にいる")',
-        lambda: f'hero = "{random.choice(STORY_ELEMENTS["characters"])["name"]}"; quest = "{random.choice(STORY_ELEMENTS["objects"])}"; print(f"{{hero}}は{{quest}}を求めて旅に出た")',
-
-        # 既存の操作も残す（確率は低め）
-        lambda: 'print("生成されたテキスト: " + "".join(["猫", "が", "走る"]))',
-        lambda: f'print("{random.choice(["猫", "犬", "太郎", "花子"])}が{random.choice(["走る", "歌う", "考える", "笑う"])}")',
-        lambda: 'print("昔々あるところに小さな村がありました")',
-    ]
-    return random.choice(text_ops)()
+    return rng.choice(TEXT_GENERATION_OPERATIONS)(rng)
 
 
-def generate_random_operation():
+def generate_random_operation(rng=random):
     """ランダムな操作を生成（テキスト生成を最優先）"""
-    operations = [
-        lambda: generate_text_generation_operation(),  # テキスト生成操作（最優先）
-        lambda: generate_text_generation_operation(),  # 確率を上げるため2回
-        lambda: generate_text_generation_operation(),  # 確率を上げるため3回
-        lambda: f"print({generate_human_readable_text()})",  # 人が読めるテキスト
-        lambda: f"print({generate_human_readable_text()})",  # 確率を上げるため2回
-        lambda: f"print({generate_random_value()})",
-        lambda: f"{generate_random_identifier()} = {generate_random_value()}",
-        lambda: f"result = {random.randint(1, 100)} {random.choice(['+', '-', '*', '//', '%'])} {random.randint(1, 100)}",
-    ]
-    return random.choice(operations)()
+    return rng.choice(RANDOM_OPERATIONS)(rng)
 
 
-def generate_random_function():
-    """ランダムな関数を生成"""
-    func_name = generate_random_identifier()
-    num_params = random.randint(0, 3)
-    params = [generate_random_identifier(6) for _ in range(num_params)]
+def _build_random_function(rng):
+    """ランダムな関数を生成して (関数名, 引数の数, ソース) を返す"""
+    func_name = generate_random_identifier(rng=rng)
+    num_params = rng.randint(0, 3)
+    params = [generate_random_identifier(6, rng) for _ in range(num_params)]
 
-    code = f"def {func_name}({', '.join(params)}):\n"
-    code += f'    """偶発的に生成された関数"""\n'
+    lines = [f"def {func_name}({', '.join(params)}):\n", '    """偶発的に生成された関数"""\n']
+    for _ in range(rng.randint(1, 5)):
+        lines.append(f"    {generate_random_operation(rng)}\n")
+    lines.append(f"    return {generate_random_value(rng)}\n")
+    return func_name, num_params, "".join(lines)
 
-    num_statements = random.randint(1, 5)
-    for _ in range(num_statements):
-        code += f"    {generate_random_operation()}\n"
 
-    code += f"    return {generate_random_value()}\n"
-    return code
+def _build_random_class(rng):
+    """ランダムなクラスを生成して (クラス名, ソース) を返す"""
+    class_name = generate_random_identifier(rng=rng).capitalize()
+    lines = [f"class {class_name}:\n", '    """偶発的に生成されたクラス"""\n']
+    for _ in range(rng.randint(1, 3)):
+        lines.append(f"    def {generate_random_identifier(rng=rng)}(self):\n")
+        for _ in range(rng.randint(1, 3)):
+            lines.append(f"        {generate_random_operation(rng)}\n")
+        lines.append(f"        return {generate_random_value(rng)}\n\n")
+    return class_name, "".join(lines)
+
+
+def generate_random_function(rng=random):
+    """ランダムな関数を生成"""
+    return _build_random_function(rng)[2]
 
 
-def generate_random_class():
+def generate_random_class(rng=random):
     """ランダムなクラスを生成"""
-    class_name = generate_random_identifier().capitalize()
-    code = f"class {class_name}:\n"
-    code += f'    """偶発的に生成されたクラス"""\n'
-
-    num_methods = random.randint(1, 3)
-    for _ in range(num_methods):
-        method_name = generate_random_identifier()
-        code += f"    def {method_name}(self):\n"
-        num_statements = random.randint(1, 3)
-        for _ in range(num_statements):
-            code += f"        {generate_random_operation()}\n"
-        code += f"        return {generate_random_value()}\n\n"
+    return _build_random_class(rng)[1]
 
-    return code
+
+_CODE_HEADER = "# 偶発的に生成されたコード\n\n"
+_MAIN_HEADER = (
+    "# メイン処理：生成された関数とクラスを実行\n"
+    'print("=" * 40)\n'
+    'print("プログラムを開始します")\n'
+    'print("=" * 40)\n\n'
+)
+_MAIN_FOOTER = (
+    'print("=" * 40)\n'
+    'print("すべての処理が完了しました！")\n'
+    'print("=" * 40)\n'
+)
 
 
-def generate_code(num_functions=3, num_classes=2):
-    """偶発的なコードを生成"""
-    code = "# 偶発的に生成されたコード\n\n"
+def generate_code(num_functions=3, num_classes=2, rng=random):
+    """偶発的なコードを生成
+
+    rng に random.Random を渡すと、その乱数列だけを使って生成する（省略時は random モジュール）。
+    """
+    parts = [_CODE_HEADER]
 
     # 関数名を記録
     function_names = []
     for _ in range(num_functions):
-        func_name = generate_random_identifier()
-        num_params = random.randint(0, 3)
-        params = [generate_random_identifier(6) for _ in range(num_params)]
-
-        func_code = f"def {func_name}({', '.join(params)}):\n"
-        func_code += f'    """偶発的に生成された関数"""\n'
-        num_statements = random.randint(1, 5)
-        for _ in range(num_statements):
-            func_code += f"    {generate_random_operation()}\n"
-        func_code += f"    return {generate_random_value()}\n"
-
-        code += func_code + "\n\n"
+        func_name, num_params, func_code = _build_random_function(rng)
+        parts.append(func_code)
+        parts.append("\n\n")
         function_names.append((func_name, num_params))
 
     # クラス名を記録
     class_names = []
     for _ in range(num_classes):
-        class_name = generate_random_identifier().capitalize()
-        class_code = f"class {class_name}:\n"
-        class_code += f'    """偶発的に生成されたクラス"""\n'
-
-        num_methods = random.randint(1, 3)
-        for _ in range(num_methods):
-            method_name = generate_random_identifier()
-            class_code += f"    def {method_name}(self):\n"
-            num_statements = random.randint(1, 3)
-            for _ in range(num_statements):
-                class_code += f"        {generate_random_operation()}\n"
-            class_code += f"        return {generate_random_value()}\n\n"
-
-        code += class_code + "\n"
+        class_name, class_code = _build_random_class(rng)
+        parts.append(class_code)
+        parts.append("\n")
         class_names.append(class_name)
 
     # メインコード：関数とクラスを実際に呼び出す
-    code += "# メイン処理：生成された関数とクラスを実行\n"
-    code += 'print("=" * 40)\n'
-    code += 'print("プログラムを開始します")\n'
-    code += 'print("=" * 40)\n\n'
+    parts.append(_MAIN_HEADER)
 
     # 関数を呼び出す
     for func_name, num_params in function_names:
         # パラメータにはデフォルト値を渡す
-        args = ", ".join([str(random.randint(1, 10)) for _ in range(num_params)])
-        code += f'print("関数 {func_name} を実行中...")\n'
-        code += f"result = {func_name}({args})\n"
-        code += f'print(f"結果: {{result}}")\n'
-        code += 'print()\n'
+        args = ", ".join([str(rng.randint(1, 10)) for _ in range(num_params)])
+        parts.append(
+            f'print("関数 {func_name} を実行中...")\n'
+            f"result = {func_name}({args})\n"
+            'print(f"結果: {result}")\n'
+            "print()\n"
+        )
 
     # クラスを呼び出す
     for class_name in class_names:
-        code += f'print("クラス {class_name} をインスタンス化...")\n'
-        code += f"obj = {class_name}()\n"
-        code += 'print("処理完了")\n'
-        code += 'print()\n'
+        parts.append(
+            f'print("クラス {class_name} をインスタンス化...")\n'
+            f"obj = {class_name}()\n"
+            'print("処理完了")\n'
+            "print()\n"
+        )
 
-    code += 'print("=" * 40)\n'
-    code += 'print("すべての処理が完了しました！")\n'
-    code += 'print("=" * 40)\n'
+    parts.append(_MAIN_FOOTER)
+    return "".join(parts)
 
-    return code
+
+def generate_codes(n, seed=None, num_functions=3, num_classes=2, rng=None):
+    """偶発的なコードを n 個、1つずつ生成するジェネレータ
+
+    seed を指定すると専用の random.Random(seed) を使い、同じシードからは常に同じコード列を
+    生成する（random.seed(seed) の後に generate_code() を n 回呼んだ結果とも一致する）。
+    seed も rng も省略した場合は random モジュールの乱数列を使うので、--seed で固定した
+    探索の再現性は変わらない。生成したコードは保持しないため、n が大きくてもメモリは一定。
+    """
+    if rng is None:
+        rng = random.Random(seed) if seed is not None else random
+    for _ in range(n):
+        yield generate_code(num_functions, num_classes, rng)
 
 
 def fix_division_by_zero(code):
@@ -379,6 +465,740 @@ def fix_syntax_error(code):
     return "\n".join(fixed_lines)
 
 
+# ============================================================
+# LLMゲートウェイ（クライアントの共有・同時実行数の制限・レート制限・再試行）
+# ============================================================
+
+# LLM呼び出しの設定（configure_llm で変更する）
+LLM_SETTINGS = {
+    "model": "claude-sonnet-4-5-20250929",
+    "max_tokens": 2000,
+    "base_url": None,  # APIの接続先（None: 環境変数 ANTHROPIC_BASE_URL または既定の接続先、モックサーバーのURLも指定可）
+    "max_concurrency": 4,  # 同時に送るリクエストの上限
+    "requests_per_minute": None,  # レート制限（1分あたりのリクエスト数、None: 制限しない）
+    "max_retries": 4,  # 一時的なエラー（429・5xx・接続エラー）の再試行回数
+    "backoff_base": 0.5,  # 再試行の待ち時間の基準（秒、試行ごとに2倍）
+    "backoff_max": 20.0,  # 再試行の待ち時間の上限（秒）
+    "timeout": 120.0,  # 1リクエストのタイムアウト（秒）
+    "use_cache": True,  # 応答をディスクにキャッシュし、同じリクエストでは再利用する（False: 常にAPIを呼ぶ）
+    "cache_dir": Path(".llm_cache"),  # 応答キャッシュのディレクトリ
+    "cache_max_bytes": 64 * 1024 * 1024,  # 応答キャッシュの合計サイズの上限（バイト）
+    "cache_ttl": 30 * 24 * 3600.0,  # 応答キャッシュの有効期間（秒、None: 期限なし）
+    "stream": False,  # コードの改善で応答をストリーミングで受け取り、使えないコードなら途中で打ち切る
+}
+
+# 再試行するHTTPステータス（タイムアウト・競合・レート制限・サーバーエラー）
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+
+
+class TokenBucket:
+    """トークンバケットによるレート制限（スレッドとイベントループのどちらからでも使える）
+
+    rate 個/秒 でトークンが補充され、最大 capacity 個まで貯まる（その分だけ連続して送れる）。
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """トークンを1つ予約し、使えるようになるまでの待ち時間（秒）を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        """トークンが使えるまで待つ"""
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """トークンが使えるまで待つ（イベントループを止めない）"""
+        import asyncio
+
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def _is_retryable_llm_error(error):
+    """再試行すべき一時的なエラーか（HTTPステータス、または接続・タイムアウトのエラー）"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in (
+        "APIConnectionError",
+        "APITimeoutError",
+    )
+
+
+def _retry_after(error):
+    """エラーのレスポンスに Retry-After ヘッダーがあればその秒数を返す"""
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LLMResponseCache:
+    """LLMの応答をディスクに保存するキャッシュ（リクエストのハッシュ -> 応答のテキスト）
+
+    キーはモデル・プロンプト・パラメータ（リクエスト全体）のSHA-256で、1件を1つのJSONファイルに保存する。
+    ttl 秒より古い応答は使わずに削除し、合計サイズが max_bytes を超えたら最後に使われた時刻
+    （ファイルの更新時刻）が古いものから削除する。書き込みは一時ファイルからの置き換えで行うので、
+    複数のプロセスで同じディレクトリを共有できる。
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # 秒（None なら期限なし）
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._size = None  # ディレクトリの合計サイズ（初回の put で数える）
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(request):
+        """リクエスト（モデル・メッセージ・パラメータ）のハッシュ値"""
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def _path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        """応答のテキストを取得（無いか期限切れなら None、ヒットしたら使用時刻を更新）"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+            self.expired += 1
+            self.misses += 1
+            with contextlib.suppress(OSError):
+                path.unlink()
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        self.hits += 1
+        return entry["text"]
+
+    def put(self, key, text, model=None):
+        """応答を保存（合計サイズが上限を超えたら古いものから削除）"""
+        if self.max_bytes <= 0:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({"created": time.time(), "model": model, "text": text}, ensure_ascii=False)
+        path = self._path(key)
+        temporary_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temporary_path.write_text(data, encoding="utf-8")
+        os.replace(temporary_path, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data.encode("utf-8"))
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """保存されている応答の (パス, サイズ, 最終使用時刻)"""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            with contextlib.suppress(OSError):
+                stat = path.stat()
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        """最後に使われた時刻が古いものから、合計サイズが上限の9割以下になるまで削除"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            with contextlib.suppress(OSError):
+                path.unlink()
+                self._size -= size
+                self.evictions += 1
+
+    def clear(self):
+        """保存されている応答と統計を削除"""
+        if self.directory.exists():
+            for path, _, _ in self._entries():
+                with contextlib.suppress(OSError):
+                    path.unlink()
+        self._size = 0
+        self.hits = self.misses = self.expired = self.evictions = 0
+
+    def hit_rate(self):
+        """ヒット率（0.0-1.0）"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self):
+        """統計情報を表示用の文字列で返す"""
+        entries = self._entries() if self.directory.exists() else []
+        return (
+            f"ヒット {self.hits}, ミス {self.misses}（期限切れ {self.expired}）, "
+            f"ヒット率 {self.hit_rate() * 100:.1f}%, 件数 {len(entries)}, "
+            f"サイズ {sum(size for _, size, _ in entries) / 1024:.1f}KB/{self.max_bytes / 1024:.0f}KB, "
+            f"削除 {self.evictions}"
+        )
+
+
+class LLMGateway:
+    """LLM呼び出しの窓口
+
+    クライアント（接続プール）を遅延生成して全ての呼び出しで共有し、同時実行数を max_concurrency に、
+    送信間隔を requests_per_minute に制限する。一時的なエラーは指数バックオフ（フルジッター）で再試行する。
+    同期の complete() と非同期の complete_async() / complete_many() を提供する。
+    use_cache が有効なら、同じリクエスト（モデル・プロンプト・パラメータ）の応答を LLMResponseCache から返す。
+    """
+
+    def __init__(self, api_key=None, **settings):
+        unknown = set(settings) - set(LLM_SETTINGS)
+        if unknown:
+            raise ValueError(f"不明なLLM設定です: {', '.join(sorted(unknown))}")
+        self.api_key = api_key
+        self.settings = {**LLM_SETTINGS, **settings}
+        rpm = self.settings["requests_per_minute"]
+        self.rate_limiter = TokenBucket(rpm / 60.0, capacity=self.settings["max_concurrency"]) if rpm else None
+        self._client = None
+        self._async_clients = {}  # イベントループ -> (非同期クライアント, セマフォ)
+        self._client_lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.settings["max_concurrency"])
+        # ジッター用の乱数（探索の乱数列を変えないように、グローバルの random とは分ける）
+        self._random = random.Random()
+        self.cache = (
+            LLMResponseCache(
+                self.settings["cache_dir"],
+                max_bytes=self.settings["cache_max_bytes"],
+                ttl=self.settings["cache_ttl"],
+            )
+            if self.settings["use_cache"]
+            else None
+        )
+
+    def _client_options(self):
+        options = {"api_key": self.api_key, "max_retries": 0, "timeout": self.settings["timeout"]}
+        if self.settings["base_url"]:
+            options["base_url"] = self.settings["base_url"]
+        return options
+
+    @property
+    def client(self):
+        """同期クライアント（初回の呼び出しで生成し、以降は接続ごと再利用）"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = load_llm_backend().Anthropic(**self._client_options())
+        return self._client
+
+    def _async_state(self):
+        """実行中のイベントループ用の非同期クライアントとセマフォ（ループごとに1つ生成）"""
+        import asyncio  # 非同期APIを使うときだけ読み込む（読み込みに数十ミリ秒かかる）
+
+        loop = asyncio.get_running_loop()
+        state = self._async_clients.get(loop)
+        if state is None:
+            client = load_llm_backend().AsyncAnthropic(**self._client_options())
+            state = self._async_clients[loop] = (client, asyncio.Semaphore(self.settings["max_concurrency"]))
+        return state
+
+    def _request(self, prompt, max_tokens):
+        return {
+            "model": self.settings["model"],
+            "max_tokens": max_tokens or self.settings["max_tokens"],
+            "messages": [{"role": "user", "content": prompt}],
+        }
+
+    def _backoff(self, attempt, error):
+        """attempt 回目の再試行までの待ち時間（Retry-After があればそれ以上待つ）"""
+        ceiling = min(self.settings["backoff_max"], self.settings["backoff_base"] * 2**attempt)
+        return max(self._random.uniform(0, ceiling), _retry_after(error) or 0.0)
+
+    def _cached(self, request, helper):
+        """キャッシュにある応答（無ければ None）と、保存に使うキー"""
+        if self.cache is None:
+            return None, None
+        # 接続先もキーに含める（モックサーバーの応答を本物のAPIの応答として使わない）
+        key = LLMResponseCache.key({**request, "base_url": self.settings["base_url"]})
+        text = self.cache.get(key)
+        METRICS.increment("llm_cache_hits_total" if text is not None else "llm_cache_misses_total", helper=helper)
+        return text, key
+
+    def complete(self, prompt, max_tokens=None, helper="llm"):
+        """プロンプトを送ってレスポンスのテキストを返す（同期）"""
+        request = self._request(prompt, max_tokens)
+        text, key = self._cached(request, helper)
+        if text is not None:
+            return text
+        text = self._complete(request, helper)
+        if key is not None:
+            self.cache.put(key, text, model=request["model"])
+        return text
+
+    def stream(self, prompt, checker=None, max_tokens=None, helper="llm"):
+        """プロンプトを送り、応答をストリーミングで受け取ってテキストを返す（同期）
+
+        受け取ったテキストを順に checker.feed() に渡し、打ち切る理由が返されたらその時点で接続を閉じて
+        LLMStreamAborted を送出する（残りの生成を待たず、その分のトークンも消費しない）。
+        打ち切った応答はキャッシュしない。
+        """
+        request = self._request(prompt, max_tokens)
+        text, key = self._cached(request, helper)
+        if text is not None:
+            return text
+        text = self._stream(request, checker, helper)
+        if key is not None:
+            self.cache.put(key, text, model=request["model"])
+        return text
+
+    def _stream(self, request, checker, helper):
+        """キャッシュを使わずにストリーミングでAPIを呼ぶ（受信を始める前の一時的なエラーは再試行）"""
+        for attempt in itertools.count():
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            METRICS.increment("llm_requests_total", helper=helper)
+            if checker is not None:
+                checker.reset()
+            chunks = []
+            try:
+                with self._semaphore, METRICS.timer("llm_request_seconds", helper=helper):
+                    with self.client.messages.stream(**request) as stream:
+                        for chunk in stream.text_stream:
+                            chunks.append(chunk)
+                            reason = checker.feed(chunk) if checker is not None else None
+                            if reason:
+                                break
+                        else:
+                            reason = checker.finish() if checker is not None else None
+                if reason:
+                    METRICS.increment("llm_stream_aborts_total", helper=helper)
+                    raise LLMStreamAborted(reason, "".join(chunks))
+                return "".join(chunks)
+            except LLMStreamAborted:
+                raise
+            except Exception as e:
+                if chunks or attempt >= self.settings["max_retries"] or not _is_retryable_llm_error(e):
+                    raise
+                METRICS.increment("llm_retries_total", helper=helper)
+                time.sleep(self._backoff(attempt, e))
+
+    def _complete(self, request, helper):
+        """キャッシュを使わずにAPIを呼ぶ（一時的なエラーは再試行）"""
+        for attempt in itertools.count():
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            METRICS.increment("llm_requests_total", helper=helper)
+            try:
+                with self._semaphore, METRICS.timer("llm_request_seconds", helper=helper):
+                    message = self.client.messages.create(**request)
+                return message.content[0].text
+            except Exception as e:
+                if attempt >= self.settings["max_retries"] or not _is_retryable_llm_error(e):
+                    raise
+                METRICS.increment("llm_retries_total", helper=helper)
+                time.sleep(self._backoff(attempt, e))
+
+    async def complete_async(self, prompt, max_tokens=None, helper="llm"):
+        """プロンプトを送ってレスポンスのテキストを返す（非同期、同時実行数はループごとに制限）"""
+        request = self._request(prompt, max_tokens)
+        text, key = self._cached(request, helper)
+        if text is not None:
+            return text
+        text = await self._complete_async(request, helper)
+        if key is not None:
+            self.cache.put(key, text, model=request["model"])
+        return text
+
+    async def _complete_async(self, request, helper):
+        """キャッシュを使わずにAPIを呼ぶ（非同期）"""
+        import asyncio
+
+        client, semaphore = self._async_state()
+        for attempt in itertools.count():
+            if self.rate_limiter:
+                await self.rate_limiter.acquire_async()
+            METRICS.increment("llm_requests_total", helper=helper)
+            try:
+                async with semaphore:
+                    with METRICS.timer("llm_request_seconds", helper=helper):
+                        message = await client.messages.create(**request)
+                return message.content[0].text
+            except Exception as e:
+                if attempt >= self.settings["max_retries"] or not _is_retryable_llm_error(e):
+                    raise
+                METRICS.increment("llm_retries_total", helper=helper)
+                await asyncio.sleep(self._backoff(attempt, e))
+
+    def complete_many(self, prompts, max_tokens=None, helper="llm"):
+        """複数のプロンプトを並行して送り、同じ順序でテキスト（失敗したものは例外）を返す
+
+        同じプロンプトが複数あれば1回だけ送る。
+        """
+        import asyncio
+
+        unique_prompts = list(dict.fromkeys(prompts))
+
+        async def run_all():
+            tasks = [self.complete_async(prompt, max_tokens, helper) for prompt in unique_prompts]
+            try:
+                return await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                await self.aclose()
+
+        results = dict(zip(unique_prompts, asyncio.run(run_all())))
+        return [results[prompt] for prompt in prompts]
+
+    async def aclose(self):
+        """実行中のイベントループ用の非同期クライアントを閉じる（asyncio.run の終了前に呼ぶ）"""
+        import asyncio
+
+        state = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].close()
+
+
+# 全体で共有するLLMゲートウェイ（get_llm_gateway で遅延生成、configure_llm で作り直す）
+_LLM_GATEWAY = None
+
+
+def configure_llm(**settings):
+    """LLM呼び出しの設定（LLM_SETTINGS）を変更（共有のゲートウェイは次の呼び出しで作り直す）"""
+    global _LLM_GATEWAY
+    unknown = set(settings) - set(LLM_SETTINGS)
+    if unknown:
+        raise ValueError(f"不明なLLM設定です: {', '.join(sorted(unknown))}")
+    LLM_SETTINGS.update(settings)
+    _LLM_GATEWAY = None
+
+
+def print_llm_cache_summary():
+    """このプロセスでLLMを呼び出していれば、応答キャッシュの統計を表示"""
+    if _LLM_GATEWAY is not None and _LLM_GATEWAY.cache is not None:
+        print(f"LLMの応答キャッシュ: {_LLM_GATEWAY.cache.summary()}")
+
+
+def get_llm_gateway():
+    """共有のLLMゲートウェイを返す（APIキーが設定されていなければ None）
+
+    接続先にモックサーバー（base_url）を指定した場合は、APIキーが無くてもダミーのキーで接続する。
+    """
+    global _LLM_GATEWAY
+    if _LLM_GATEWAY is None:
+        load_llm_backend()  # .envファイルの ANTHROPIC_API_KEY もここで読み込まれる
+        api_key = os.environ.get("ANTHROPIC_API_KEY")
+        if not api_key and LLM_SETTINGS["base_url"]:
+            api_key = "mock"
+        if not api_key:
+            return None
+        _LLM_GATEWAY = LLMGateway(api_key=api_key)
+    return _LLM_GATEWAY
+
+
+# ============================================================
+# ストリーミング応答のコード検査（使えない生成を早めに打ち切る）
+# ============================================================
+
+# 直前までの行と合わせて1つの文になる行（この行の手前では文が完結しない）
+_CONTINUATION_PATTERN = re.compile(r"(?:else|elif|except|finally)\b")
+
+# 入力の途中であることを示す構文エラー（続きを受け取れば解消する可能性がある）
+_INCOMPLETE_SYNTAX_MESSAGES = ("was never closed", "unterminated triple-quoted", "unexpected EOF")
+
+
+class LLMStreamAborted(Exception):
+    """ストリーミング中の検査で応答が使えないと判断し、リクエストを打ち切った"""
+
+    def __init__(self, reason, text):
+        super().__init__(reason)
+        self.reason = reason
+        self.text = text  # 打ち切るまでに受け取ったテキスト
+
+
+class StreamingCodeChecker:
+    """LLMの応答を少しずつ受け取りながら ```python ブロックを取り出し、使えないコードを早めに検出する
+
+    feed() に受け取ったテキストを渡すと、行が揃うたびに次を検査し、打ち切る理由（文字列）を返す:
+      - 行頭から始まる新しい文が届いたら、それより前の部分を構文解析する（完結しているはずなので、
+        インデントエラーなどの構文エラーはこの先を受け取っても直らない）
+      - 新しく完結した文に標準ライブラリ以外のインポート（相対インポートを含む）があるか
+      - ブロックが閉じたら全体をコンパイルする
+    問題が無ければ None を返す。
+    """
+
+    def __init__(self, allowed_modules=sys.stdlib_module_names):
+        self.allowed_modules = allowed_modules
+        self.reset()
+
+    def reset(self):
+        """最初から受け取り直す（再試行の前に呼ぶ）"""
+        self._pending = ""
+        self.in_block = False
+        self.block_lines = []
+        self._checked_statements = 0  # インポートを検査済みのトップレベルの文の数
+        self.blocks = []  # 閉じたコードブロック
+
+    def feed(self, text):
+        """受け取ったテキストを追加し、打ち切る理由（無ければ None）を返す"""
+        self._pending += text
+        while "\n" in self._pending:
+            line, self._pending = self._pending.split("\n", 1)
+            reason = self._feed_line(line)
+            if reason:
+                return reason
+        return None
+
+    def finish(self):
+        """応答の終わり（最後の行に改行が無い場合も検査する）"""
+        if not self._pending:
+            return None
+        line, self._pending = self._pending, ""
+        return self._feed_line(line)
+
+    def _feed_line(self, line):
+        stripped = line.strip()
+        if not self.in_block:
+            if stripped.startswith("```python"):
+                self.in_block = True
+                self.block_lines = []
+                self._checked_statements = 0
+            return None
+        if stripped.startswith("```"):
+            self.in_block = False
+            self.blocks.append("\n".join(self.block_lines))
+            return self._check_prefix(self.block_lines, final=True)
+        self.block_lines.append(line)
+        if (
+            len(self.block_lines) > 1
+            and stripped
+            and not line[0].isspace()
+            and not _CONTINUATION_PATTERN.match(line)
+            and not self._previous_line_continues()
+        ):
+            return self._check_prefix(self.block_lines[:-1])
+        return None
+
+    def _previous_line_continues(self):
+        """直前の（空行でない）行が、次の行と合わせて1つの文になるか（デコレータ・行継続）"""
+        for previous in reversed(self.block_lines[:-1]):
+            if previous.strip():
+                return previous.lstrip().startswith("@") or previous.rstrip().endswith("\\")
+        return False
+
+    def _check_prefix(self, lines, final=False):
+        """完結しているはずの部分を構文解析し、新しい文のインポートを検査"""
+        source = "\n".join(lines)
+        try:
+            tree = ast.parse(source)
+        except SyntaxError as e:
+            if not final and not isinstance(e, IndentationError) and any(
+                message in str(e.msg) for message in _INCOMPLETE_SYNTAX_MESSAGES
+            ):
+                return None  # 複数行の括弧や文字列の途中
+            kind = "インデントエラー" if isinstance(e, IndentationError) else "構文エラー"
+            return f"{kind}（行{e.lineno}: {e.msg}）"
+        new_statements = tree.body[self._checked_statements:]
+        self._checked_statements = len(tree.body)
+        for statement in new_statements:
+            for node in ast.walk(statement):
+                if isinstance(node, ast.Import):
+                    modules = [alias.name for alias in node.names]
+                elif isinstance(node, ast.ImportFrom):
+                    modules = [("." * node.level) + (node.module or "")]
+                else:
+                    continue
+                for module in modules:
+                    if module.split(".")[0] not in self.allowed_modules:
+                        return f"標準ライブラリ以外のインポート（{module}）"
+        if final:
+            valid, error_msg = validate_code_syntax(source)
+            if not valid:
+                return f"構文エラー（{error_msg}）"
+        return None
+
+    @property
+    def code(self):
+        """最後に閉じたコードブロック（まだ無ければ受信中のブロック）"""
+        if self.blocks:
+            return self.blocks[-1]
+        return "\n".join(self.block_lines)
+
+
+# ============================================================
+# LLMのモックサーバー（オフラインでの動作確認・負荷試験用）
+# ============================================================
+
+# 応答を指定しない場合にモックサーバーが返す応答（改善・評価のどちらのプロンプトにも使える形式）
+MOCK_LLM_RESPONSE = """## 改善点
+- モックサーバーの固定応答です
+
+## 改善されたコード
+```python
+def tell_story(hero="太郎"):
+    print(f"昔々、ある村に{hero}という少年がいました。")
+    print(f"ある日、{hero}は森で不思議な猫に出会いました。")
+    print("こうして冒険が始まったのです。")
+    return "物語完了"
+
+
+print(tell_story())
+```"""
+
+
+class MockLLMServer:
+    """Anthropic Messages API（POST /v1/messages）の形式で、用意した応答を順番に返すHTTPサーバー
+
+    responses の応答を順に（最後まで行ったら先頭から）返す。latency 秒の遅延と、error_rate の割合で
+    ステータス 529（過負荷）を返すことで、同時実行数の制限や再試行の動作を確認できる。
+    "stream": true のリクエストには、応答を chunk_size 文字ずつ chunk_delay 秒おきにイベントストリームで返す。
+    LLM_SETTINGS の base_url に url を指定して使う。
+    """
+
+    def __init__(self, responses=None, latency=0.0, error_rate=0.0, seed=None, chunk_size=16, chunk_delay=0.0):
+        self.responses = list(responses) if responses else [MOCK_LLM_RESPONSE]
+        self.latency = latency
+        self.chunk_size = chunk_size  # ストリーミングで1回に送る文字数
+        self.chunk_delay = chunk_delay  # ストリーミングで1回送るごとの遅延（秒、生成速度の再現）
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.error_count = 0
+        self.disconnect_count = 0  # ストリーミングの途中でクライアントが切断した回数
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @staticmethod
+    def load_responses(path):
+        """応答ファイルを読み込む（1行1つのJSON: 文字列、または "text" キーを持つオブジェクト）"""
+        responses = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    responses.append(record["text"] if isinstance(record, dict) else record)
+        return responses
+
+    def _next(self):
+        """次の応答（エラーを返す場合は None）と通し番号"""
+        with self._lock:
+            number = self.request_count
+            self.request_count += 1
+            if self._random.random() < self.error_rate:
+                self.error_count += 1
+                return None, number
+            return self.responses[number % len(self.responses)], number
+
+    def start(self, port=0, host="127.0.0.1"):
+        """バックグラウンドのスレッドでサーバーを起動（port=0 なら空いているポートを使う）"""
+        import http.server
+
+        mock = self
+
+        class MockHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 接続を再利用できるようにする
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.split("?")[0] != "/v1/messages":
+                    self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                    return
+                if mock.latency:
+                    time.sleep(mock.latency)
+                text, number = mock._next()
+                if text is None:
+                    self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+                    return
+                prompt = "".join(
+                    message["content"] if isinstance(message["content"], str) else json.dumps(message["content"])
+                    for message in request.get("messages", [])
+                )
+                message = {
+                    "id": f"msg_mock_{number}",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": request.get("model", LLM_SETTINGS["model"]),
+                    "content": [{"type": "text", "text": text}],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": len(prompt), "output_tokens": len(text)},
+                }
+                if request.get("stream"):
+                    self._send_stream(message, text)
+                else:
+                    self._send_json(200, message)
+
+            def _send_stream(self, message, text):
+                """Messages API のイベントストリーム形式で応答を少しずつ送る（途中で切断されたら送信をやめる）"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                events = [("message_start", {"message": {**message, "content": [], "stop_reason": None}})]
+                events.append(("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}}))
+                for start in range(0, len(text), mock.chunk_size):
+                    delta = {"type": "text_delta", "text": text[start:start + mock.chunk_size]}
+                    events.append(("content_block_delta", {"index": 0, "delta": delta}))
+                events.append(("content_block_stop", {"index": 0}))
+                events.append((
+                    "message_delta",
+                    {"delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": message["usage"]},
+                ))
+                events.append(("message_stop", {}))
+                try:
+                    for event, data in events:
+                        payload = json.dumps({"type": event, **data}, ensure_ascii=False)
+                        self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        if event == "content_block_delta" and mock.chunk_delay:
+                            time.sleep(mock.chunk_delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    mock.disconnect_count += 1
+
+            def log_message(self, format, *args):
+                pass  # アクセスログで最適化の出力を乱さない
+
+        self._server = http.server.ThreadingHTTPServer((host, port), MockHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
 def evaluate_code_with_llm(original_code, improved_code):
     """LLMを使って元のコードと改善されたコードを評価"""
     print("\n" + "=" * 60)
@@ -386,13 +1206,11 @@ def evaluate_code_with_llm(original_code, improved_code):
     print("=" * 60)
 
     try:
-        api_key = os.environ.get("ANTHROPIC_API_KEY")
-        if not api_key:
+        gateway = get_llm_gateway()
+        if gateway is None:
             print("警告: ANTHROPIC_API_KEY が設定されていません")
             return None
 
-        client = Anthropic(api_key=api_key)
-
         prompt = f"""以下の2つのPythonコードを比較評価してください。
 
 # 元のコード（ランダム生成）
@@ -429,13 +1247,7 @@ def evaluate_code_with_llm(original_code, improved_code):
 ## 推奨事項
 [このコードが実用的かどうか、さらに改善の余地があるか]"""
 
-        message = client.messages.create(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=2000,
-            messages=[{"role": "user", "content": prompt}],
-        )
-
-        evaluation = message.content[0].text
+        evaluation = gateway.complete(prompt, helper="evaluate")
 
         print("\n" + "=" * 60)
         print("📊 評価結果:")
@@ -446,25 +1258,69 @@ def evaluate_code_with_llm(original_code, improved_code):
         return evaluation
 
     except Exception as e:
+        METRICS.increment("llm_errors_total", helper="evaluate")
         print(f"LLMでの評価中にエラーが発生しました: {e}")
         return None
 
 
-def improve_code_with_llm(code):
-    """LLMを使ってランダムなコードを意味のあるコードに改善"""
+def ensure_main_section(code):
+    """LLMで改善したコードにメイン処理（"# メイン処理"）が無ければ、関数とクラスを呼び出す処理を追加する"""
+    if "# メイン処理" in code:
+        return code
+
+    print("\n⚠️  LLM改善後にメイン処理が欠落していたため、追加します")
+    # 関数とクラスを抽出
+    functions = re.findall(r'def\s+(\w+)\s*\(([^)]*)\)', code)
+    classes = re.findall(r'class\s+(\w+)\s*:', code)
+
+    main_code = '\n\n# メイン処理：生成された関数とクラスを実行\n'
+    main_code += 'print("=" * 40)\n'
+    main_code += 'print("プログラムを開始します")\n'
+    main_code += 'print("=" * 40)\n\n'
+
+    # 関数を呼び出す
+    for func_name, params in functions:
+        param_list = [p.strip() for p in params.split(',') if p.strip()]
+        args = ", ".join(["1" for _ in param_list])  # 簡単なデフォルト値
+        main_code += f'print("関数 {func_name} を実行中...")\n'
+        main_code += f'result = {func_name}({args})\n'
+        main_code += f'print(f"結果: {{result}}")\n'
+        main_code += 'print()\n'
+
+    # クラスを呼び出す
+    for class_name in classes:
+        main_code += f'print("クラス {class_name} をインスタンス化...")\n'
+        main_code += f'obj = {class_name}()\n'
+        main_code += 'print("処理完了")\n'
+        main_code += 'print()\n'
+
+    main_code += 'print("=" * 40)\n'
+    main_code += 'print("すべての処理が完了しました！")\n'
+    main_code += 'print("=" * 40)\n'
+
+    code += main_code
+    return code
+
+
+def improve_code_with_llm(code, stream=None):
+    """LLMを使ってランダムなコードを意味のあるコードに改善
+
+    stream=True（None なら LLM_SETTINGS["stream"]）の場合は応答をストリーミングで受け取り、
+    StreamingCodeChecker が使えないコードと判断した時点で打ち切って元のコードを返す。
+    """
+    if stream is None:
+        stream = LLM_SETTINGS["stream"]
     print("\n" + "=" * 60)
     print("LLMを使ってコードを改善しています...")
     print("=" * 60)
 
     try:
-        api_key = os.environ.get("ANTHROPIC_API_KEY")
-        if not api_key:
+        gateway = get_llm_gateway()
+        if gateway is None:
             print("警告: ANTHROPIC_API_KEY が設定されていません")
             print("元のコードをそのまま返します")
             return code
 
-        client = Anthropic(api_key=api_key)
-
         prompt = f"""以下のランダムに生成されたPythonコードを、物語性のある実用的なコードに改善してください。
 
 元のコード:
@@ -541,13 +1397,16 @@ print("=" * 40)
 [物語生成に特化した改善されたPythonコード（必ず実行可能で、エラーが出ないこと）]
 ```"""
 
-        message = client.messages.create(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=2000,
-            messages=[{"role": "user", "content": prompt}],
-        )
-
-        response_text = message.content[0].text
+        if stream:
+            try:
+                response_text = gateway.stream(prompt, StreamingCodeChecker(), helper="improve")
+            except LLMStreamAborted as e:
+                print(f"\n⚠️  生成中のコードが使えないため、LLMの応答を打ち切りました: {e.reason}")
+                print(f"（受信済み: {len(e.text)}文字）")
+                print("\n元のコードを返します")
+                return code
+        else:
+            response_text = gateway.complete(prompt, helper="improve")
 
         # 改善点とコードを分離
         improvements = ""
@@ -608,6 +1467,7 @@ print("=" * 40)
         # 改善されたコードの構文をチェック
         is_valid, error_msg = validate_code_syntax(improved_code)
         if not is_valid:
+            METRICS.increment("llm_syntax_errors_total")
             print(f"\n⚠️  改善されたコードに構文エラーがあります: {error_msg}")
             print("\n=== デバッグ情報: 抽出されたコードの最初の10行 ===")
             for i, line in enumerate(improved_code.split("\n")[:10], 1):
@@ -625,15 +1485,16 @@ print("=" * 40)
         return improved_code
 
     except Exception as e:
+        METRICS.increment("llm_errors_total", helper="improve")
         print(f"LLMでの改善中にエラーが発生しました: {e}")
         print("元のコードをそのまま返します")
         return code
 
 
 def validate_code_syntax(code):
-    """コードの構文を検証"""
+    """コードの構文を検証（コンパイル結果は CODE_OBJECT_CACHE に残り、実行時に再利用される）"""
     try:
-        compile(code, "<string>", "exec")
+        compile_cached(code)
         return True, None
     except SyntaxError as e:
         return False, f"行{e.lineno}: {e.msg}"
@@ -641,8 +1502,794 @@ def validate_code_syntax(code):
         return False, str(e)
 
 
-def execute_generated_code(code, max_retries=5, show_traceback=True):
-    """生成されたコードを実行（エラー時は修正して再実行）"""
+# ============================================================
+# メトリクス（カウンタ・ヒストグラム・フェーズタイマー）
+# ============================================================
+
+# ヒストグラムのバケットの上限（秒）
+METRIC_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+class _Timer:
+    """with ブロックの経過時間をヒストグラムに記録するタイマー"""
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+# 無効時に返す何もしないタイマー（毎回生成しない）
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class Metrics:
+    """最適化の実行中の計測値（カウンタ・ゲージ・ヒストグラム・フェーズ時間）を集計する
+
+    無効の間は各メソッドが最初の判定だけで戻り、タイマーも時刻を取得しないので、
+    計測箇所が残っていてもほとんどコストがかからない。
+    ラベルはキーワード引数で指定する（例: increment("actions_total", action="mutate")）。
+    summary() でJSON向けの辞書、to_prometheus() でPrometheusのテキスト形式を返す。
+    """
+
+    def __init__(self, enabled=False, buckets=METRIC_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._server = None  # serve() で起動したHTTPサーバー
+        self.reset()
+
+    def reset(self):
+        """計測値をクリア"""
+        self.started_at = time.time()
+        self.counters = {}  # (名前, ラベル) -> 値
+        self.gauges = {}  # (名前, ラベル) -> 値
+        self.histograms = {}  # (名前, ラベル) -> [バケットごとの件数..., 合計, 件数]
+        self.phases = {}  # フェーズ名 -> 累計時間（秒）
+        self._phase_starts = {}  # 実行中のフェーズ名 -> 開始時刻
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def increment(self, name, value=1, **labels):
+        """カウンタを増やす"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """ゲージ（現在値）を設定"""
+        if not self.enabled:
+            return
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """ヒストグラムに値（秒）を記録"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(self.buckets) + 3)
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def timer(self, name, **labels):
+        """with ブロックの経過時間をヒストグラムに記録するタイマー"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        """関数の実行時間をヒストグラムに記録するデコレータ（無効時は判定1回だけで呼び出す）"""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Timer(self, name, labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def begin_phase(self, name):
+        """フェーズの計測を開始"""
+        if not self.enabled:
+            return
+        self._phase_starts[name] = time.perf_counter()
+
+    def end_phase(self, name):
+        """フェーズの計測を終了し、経過時間をフェーズの累計時間に加算"""
+        start = self._phase_starts.pop(name, None)
+        if start is None:
+            return
+        self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def snapshot(self):
+        """他のプロセスへ渡せる計測値のコピー（merge() で合算する）"""
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": {key: list(histogram) for key, histogram in self.histograms.items()},
+            "phases": dict(self.phases),
+        }
+
+    def merge(self, snapshot):
+        """別のプロセスの計測値を合算（ゲージは大きい方を残す）"""
+        if not self.enabled:
+            return
+        for key, value in snapshot["counters"].items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, value in snapshot["gauges"].items():
+            self.gauges[key] = max(self.gauges.get(key, value), value)
+        for key, histogram in snapshot["histograms"].items():
+            current = self.histograms.setdefault(key, [0] * len(histogram))
+            for index, value in enumerate(histogram):
+                current[index] += value
+        for name, seconds in snapshot["phases"].items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @staticmethod
+    def _format_key(name, labels):
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+
+    def summary(self):
+        """計測値をJSONに変換できる辞書で返す"""
+        uptime = time.time() - self.started_at
+        histograms = {}
+        for (name, labels), histogram in self.histograms.copy().items():
+            count, total = histogram[-1], histogram[-2]
+            histograms[self._format_key(name, labels)] = {
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else 0.0,
+                "buckets": dict(zip(map(str, self.buckets + (float("inf"),)), histogram[:-2])),
+            }
+        evaluations = sum(
+            value for (name, _), value in self.counters.copy().items() if name == "evaluations_total"
+        )
+        return {
+            "uptime_seconds": uptime,
+            "evaluations_per_second": evaluations / uptime if uptime > 0 else 0.0,
+            "counters": {self._format_key(*key): value for key, value in self.counters.copy().items()},
+            "gauges": {self._format_key(*key): value for key, value in self.gauges.copy().items()},
+            "histograms": histograms,
+            "phases": dict(self.phases),
+        }
+
+    def write_json(self, path):
+        """計測値のサマリーをJSONファイルに書き出す"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix="jugemu_"):
+        """計測値をPrometheusのテキスト形式で返す"""
+
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = []
+            for key, value in pairs:
+                value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                escaped.append(f'{key}="{value}"')
+            return "{" + ",".join(escaped) + "}"
+
+        lines = []
+        declared = set()
+
+        def declare(name, metric_type):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in sorted(self.counters.copy().items()):
+            declare(prefix + name, "counter")
+            lines.append(f"{prefix}{name}{labels_text(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.copy().items()):
+            declare(prefix + name, "gauge")
+            lines.append(f"{prefix}{name}{labels_text(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.copy().items()):
+            declare(prefix + name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram[:-2]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{prefix}{name}_bucket{labels_text(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{labels_text(labels)} {histogram[-2]}")
+            lines.append(f"{prefix}{name}_count{labels_text(labels)} {histogram[-1]}")
+        declare(prefix + "phase_seconds", "counter")
+        for phase, seconds in sorted(dict(self.phases).items()):
+            lines.append(f"{prefix}phase_seconds{labels_text([('phase', phase)])} {seconds}")
+        declare(prefix + "uptime_seconds", "gauge")
+        lines.append(f"{prefix}uptime_seconds {time.time() - self.started_at}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Prometheusのテキスト形式を /metrics で返すHTTPサーバーをバックグラウンドで起動
+
+        起動したサーバーを返す（port=0 なら空いているポートを使うので server_address で確認する）。
+        stop() で停止する。
+        """
+        import http.server
+
+        if self._server is not None:
+            raise RuntimeError("メトリクスのHTTPサーバーは既に起動しています")
+
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # アクセスログで最適化の出力を乱さない
+
+        server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._server = server
+        return server
+
+    def stop(self):
+        """serve() で起動したHTTPサーバーを停止（起動していなければ何もしない）"""
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+# 全体で共有するメトリクス（enable() するまでは何も記録しない）
+METRICS = Metrics()
+
+
+# ============================================================
+# コード実行バックエンド（同一プロセス / サンドボックス）
+# ============================================================
+
+# 候補コードの実行設定（configure_execution で変更する）
+EXECUTION_SETTINGS = {
+    "backend": "inprocess",  # "inprocess": 同一プロセスでexec / "sandbox": 隔離したサブプロセスで実行
+    "timeout": 5.0,  # 1候補あたりの実行時間の上限（秒、壁時計時間）
+    "cpu_limit": 5,  # CPU時間の上限（秒、RLIMIT_CPU）
+    "memory_limit": 512 * 1024 * 1024,  # メモリ（アドレス空間）の上限（バイト、RLIMIT_AS）
+    "output_limit": 64 * 1024,  # 取得する出力の上限（文字数）
+    "sandbox_max_tasks": 500,  # サンドボックスの常駐ワーカー1つで実行する候補の数（超えたら起動し直す）
+    # 適応度評価中の候補コードの出力の扱い
+    # "passthrough": そのまま端末に出力 / "capture": output_limit までメモリに取り込む（端末には出さない）
+    # "discard": 標準出力・標準エラー出力とも破棄する
+    # passthrough / capture では、取り込んだ出力を ExecutionResult.stdout / stderr から参照できる
+    "output": "passthrough",
+    # 適応度キャッシュのキー
+    # "exact": コード文字列のハッシュ / "structural": 識別子の名前とコメントを無視した構造ハッシュ
+    "cache_key": "exact",
+}
+
+# サンドボックスの常駐ワーカーで実行するスクリプト
+# 引数: CPU時間の上限（秒、1候補あたり）、メモリの上限（バイト）、1ワーカーで実行する候補の数の上限
+# 起動直後に自分でリソース制限を設定してから、候補を1つずつ受け取って実行する
+# 要求: JSONの1行（output_limit / shared / size）+ size バイトの marshal 済みコードオブジェクト
+# 応答: 実行結果のJSONの1行
+_SANDBOX_RUNNER = r"""
+import builtins, io, json, marshal, os, sys, time, traceback
+
+cpu_limit = int(sys.argv[1])
+memory_limit = int(sys.argv[2])
+max_tasks = int(sys.argv[3])
+
+try:
+    import resource
+except ImportError:  # Windowsではrlimitによる制限は行わない
+    resource = None
+
+if resource is not None:
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if cpu_limit:
+        # ハードリミットはワーカーの寿命全体の上限（候補ごとの上限はソフトリミットで設定する）
+        hard = cpu_limit * (max_tasks + 1) + 1
+        current_hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        if current_hard != resource.RLIM_INFINITY:
+            hard = min(hard, current_hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (min(cpu_limit, hard), hard))
+
+# 通信用のパイプを別のファイル記述子に移し、候補が標準入出力を直接使っても通信を壊さないようにする
+requests = os.fdopen(os.dup(0), "rb")
+responses = os.fdopen(os.dup(1), "w", encoding="utf-8")
+devnull = os.open(os.devnull, os.O_RDWR)
+os.dup2(devnull, 0)
+os.dup2(devnull, 1)
+
+
+def set_cpu_limit():
+    # RLIMIT_CPU はプロセスの累積時間に掛かるので、これまでの使用時間 + cpu_limit をソフトリミットにする
+    if resource is None or not cpu_limit:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    soft = int(usage.ru_utime + usage.ru_stime) + 1 + cpu_limit
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+class CappedWriter(io.TextIOBase):
+    def __init__(self, limit):
+        self.parts = []
+        self.size = 0
+        self.limit = limit
+        self.truncated = False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        remaining = self.limit - self.size
+        if remaining > 0:
+            chunk = text[:remaining]
+            self.parts.append(chunk)
+            self.size += len(chunk)
+        if len(text) > max(remaining, 0):
+            self.truncated = True
+        return len(text)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+builtins_namespace = dict(vars(builtins))
+
+for header in requests:
+    request = json.loads(header)
+    payload = requests.read(request["size"])
+    stdout = CappedWriter(request["output_limit"])
+    stderr = CappedWriter(request["output_limit"])
+    # 候補ごとに新しい名前空間と組み込み関数の複製を使い、前の候補の変更を引き継がない
+    namespace = {"__builtins__": dict(builtins_namespace)}
+
+    status, error_type, error_message, error_traceback = "ok", None, None, None
+    set_cpu_limit()
+    sys.stdout, sys.stderr = stdout, stderr
+    start_time = time.time()
+    try:
+        # 親プロセスでコンパイル済みのコードオブジェクトを受け取る（同じPythonなので互換性がある）
+        code = marshal.loads(payload)
+        if request["shared"]:
+            namespace["__name__"] = "__main__"
+            exec(code, namespace)
+        else:
+            exec(code, namespace, {})
+    except BaseException as e:
+        status, error_type, error_message = "error", type(e).__name__, str(e)
+        error_traceback = traceback.format_exc()
+    elapsed = time.time() - start_time
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+    responses.write(
+        json.dumps(
+            {
+                "status": status,
+                "error_type": error_type,
+                "error_message": error_message,
+                "traceback": error_traceback,
+                "elapsed": elapsed,
+                "stdout": stdout.getvalue(),
+                "stderr": stderr.getvalue(),
+                "truncated": stdout.truncated or stderr.truncated,
+            }
+        )
+        + "\n"
+    )
+    responses.flush()
+"""
+
+
+class DiscardedOutput(io.TextIOBase):
+    """書き込まれたテキストを保持せずに捨てる出力先"""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        return len(text)
+
+
+class CapturedOutput(io.TextIOBase):
+    """上限（文字数）までテキストを取り込む出力先（サンドボックスの CappedWriter と同じ切り詰め方）
+
+    echo を指定すると、書き込まれたテキストを上限に関係なくそのまま echo にも書き込む。
+    """
+
+    def __init__(self, limit, echo=None):
+        self.parts = []
+        self.size = 0
+        self.limit = limit
+        self.truncated = False  # 上限を超えて切り詰めたか
+        self.echo = echo
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if self.echo is not None:
+            self.echo.write(text)
+        remaining = self.limit - self.size
+        if remaining > 0:
+            chunk = text[:remaining]
+            self.parts.append(chunk)
+            self.size += len(chunk)
+        if len(text) > max(remaining, 0):
+            self.truncated = True
+        return len(text)
+
+    def flush(self):
+        if self.echo is not None:
+            self.echo.flush()
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class SandboxError(Exception):
+    """サンドボックス内でのコード実行に失敗した"""
+
+
+class SandboxTimeoutError(SandboxError):
+    """サンドボックス内のコードが制限時間内に終了しなかった"""
+
+
+class ExecutionResult:
+    """候補コードを1回実行した結果"""
+
+    def __init__(
+        self,
+        status,
+        error_type=None,
+        error_message=None,
+        elapsed=0.0,
+        stdout="",
+        stderr="",
+        truncated=False,
+        traceback_text=None,
+    ):
+        self.status = status  # "ok" / "error" / "timeout" / "crash"
+        self.error_type = error_type  # 例外クラス名（"ZeroDivisionError"など）
+        self.error_message = error_message
+        self.elapsed = elapsed  # 実行時間（秒）
+        self.stdout = stdout
+        self.stderr = stderr
+        self.truncated = truncated  # 出力が上限を超えて切り詰められたか
+        self.traceback_text = traceback_text
+
+    @property
+    def ok(self):
+        return self.status == "ok"
+
+    def raise_for_error(self):
+        """実行に失敗していた場合、対応する例外を送出"""
+        if self.status == "ok":
+            return
+        if self.status == "timeout":
+            raise SandboxTimeoutError(self.error_message)
+        if self.status == "crash":
+            raise SandboxError(self.error_message)
+
+        # 組み込み例外はそのままの型で送出し、呼び出し側の except 節で処理できるようにする
+        exc_type = getattr(builtins, self.error_type or "", None)
+        if isinstance(exc_type, type) and issubclass(exc_type, Exception):
+            try:
+                raise exc_type(self.error_message)
+            except TypeError:
+                pass
+        raise SandboxError(f"{self.error_type}: {self.error_message}")
+
+
+def configure_execution(**settings):
+    """コード実行の設定（EXECUTION_SETTINGS）を変更"""
+    unknown = set(settings) - set(EXECUTION_SETTINGS)
+    if unknown:
+        raise ValueError(f"不明な実行設定です: {', '.join(sorted(unknown))}")
+    if settings.get("backend", "inprocess") not in ("inprocess", "sandbox"):
+        raise ValueError(f"不明な実行バックエンドです: {settings['backend']}")
+    if settings.get("output", "passthrough") not in ("passthrough", "capture", "discard"):
+        raise ValueError(f"不明な出力モードです: {settings['output']}")
+    if settings.get("cache_key", "exact") not in ("exact", "structural"):
+        raise ValueError(f"不明なキャッシュキーです: {settings['cache_key']}")
+    EXECUTION_SETTINGS.update(settings)
+
+
+class SandboxWorker:
+    """リソース制限付きで候補コードを1つずつ実行する常駐の子プロセス
+
+    候補ごとにインタプリタを起動し直さないので、起動の時間がかからない。
+    リソース制限は子プロセス自身が起動直後に設定する（スレッドのある親で preexec_fn を使わない）。
+    制限時間を超えた場合や子プロセスが異常終了した場合は、呼び出し側が close して作り直す。
+    """
+
+    def __init__(self, cpu_limit, memory_limit, max_tasks):
+        self.limits = (cpu_limit, memory_limit, max_tasks)
+        self.tasks = 0
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-I",  # 環境変数やユーザーのsite-packagesの影響を受けない
+                "-c",
+                _SANDBOX_RUNNER,
+                str(cpu_limit or 0),
+                str(memory_limit or 0),
+                str(max_tasks),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        # 応答を別スレッドで読み、待つ側はキューからタイムアウト付きで受け取る
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read_responses, name="sandbox-reader", daemon=True).start()
+
+    def _read_responses(self):
+        for line in iter(self.process.stdout.readline, b""):
+            self._responses.put(line)
+        self._responses.put(None)  # 子プロセスが終了した
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, payload, output_limit, shared_namespace, timeout):
+        """コンパイル済みのコードを実行して結果の辞書を返す
+
+        制限時間を超えたら subprocess.TimeoutExpired、子プロセスが終了していたら SandboxError を送出する。
+        """
+        self.tasks += 1
+        header = json.dumps({"output_limit": output_limit, "shared": shared_namespace, "size": len(payload)})
+        try:
+            self.process.stdin.write(header.encode("utf-8") + b"\n" + payload)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise SandboxError("子プロセスが終了しています") from None
+        try:
+            line = self._responses.get(timeout=timeout)
+        except queue.Empty:
+            raise subprocess.TimeoutExpired("sandbox", timeout) from None
+        if line is None:
+            self.process.wait()
+            raise SandboxError(f"子プロセスが異常終了しました (終了コード: {self.process.returncode})")
+        return json.loads(line)
+
+    def close(self):
+        """子プロセスを終了する"""
+        if self.alive:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+_SANDBOX_WORKER = None
+_SANDBOX_LOCK = threading.Lock()
+
+
+def _get_sandbox_worker(cpu_limit, memory_limit):
+    """常駐ワーカーを返す（終了していた・設定が変わった・実行数の上限に達した場合は作り直す）"""
+    global _SANDBOX_WORKER
+    limits = (cpu_limit, memory_limit, EXECUTION_SETTINGS["sandbox_max_tasks"])
+    worker = _SANDBOX_WORKER
+    if worker is not None and (not worker.alive or worker.limits != limits or worker.tasks >= limits[2]):
+        worker.close()
+        worker = None
+    if worker is None:
+        worker = _SANDBOX_WORKER = SandboxWorker(*limits)
+    return worker
+
+
+def close_sandbox_worker():
+    """常駐ワーカーを終了する（終了時に自動で呼ばれる）"""
+    global _SANDBOX_WORKER
+    with _SANDBOX_LOCK:
+        if _SANDBOX_WORKER is not None:
+            _SANDBOX_WORKER.close()
+            _SANDBOX_WORKER = None
+
+
+def _reset_sandbox_worker_after_fork():
+    # 子プロセスは親のワーカーとパイプを共有しないよう、必要になったら自分のワーカーを起動する
+    global _SANDBOX_WORKER, _SANDBOX_LOCK
+    _SANDBOX_WORKER = None
+    _SANDBOX_LOCK = threading.Lock()
+
+
+atexit.register(close_sandbox_worker)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_sandbox_worker_after_fork)
+
+
+def run_code_inprocess(code, output=None):
+    """同一プロセス内でコードを実行
+
+    output は "passthrough" / "capture" / "discard"（None の場合は EXECUTION_SETTINGS に従う）。
+    "passthrough" と "capture" では標準出力と標準エラー出力を output_limit まで取り込み、サンドボックスと
+    同じく ExecutionResult.stdout / stderr / truncated に入れる（"passthrough" は端末にもそのまま出力する）。
+    "discard" では両方を破棄するので、実行時間の計測にも端末I/Oの時間が含まれない。
+    """
+    output = EXECUTION_SETTINGS["output"] if output is None else output
+    redirect = contextlib.ExitStack()
+    stdout = stderr = None
+    if output == "discard":
+        sink = DiscardedOutput()
+        redirect.enter_context(contextlib.redirect_stdout(sink))
+        redirect.enter_context(contextlib.redirect_stderr(sink))
+    else:
+        limit = EXECUTION_SETTINGS["output_limit"]
+        echo = output == "passthrough"
+        stdout = CapturedOutput(limit, sys.stdout if echo else None)
+        stderr = CapturedOutput(limit, sys.stderr if echo else None)
+        redirect.enter_context(contextlib.redirect_stdout(stdout))
+        redirect.enter_context(contextlib.redirect_stderr(stderr))
+
+    start_time = time.time()
+    try:
+        with redirect:
+            exec(compile_cached(code), {}, {})
+    except BaseException as e:  # 生成コードが送出したものはSystemExit等も含めて結果として扱う
+        result = ExecutionResult(
+            "error",
+            type(e).__name__,
+            str(e),
+            elapsed=time.time() - start_time,
+            traceback_text=traceback.format_exc(),
+        )
+    else:
+        result = ExecutionResult("ok", elapsed=time.time() - start_time)
+
+    if stdout is not None:
+        result.stdout = stdout.getvalue()
+        result.stderr = stderr.getvalue()
+        result.truncated = stdout.truncated or stderr.truncated
+    return result
+
+
+def run_code_sandboxed(
+    code,
+    timeout=None,
+    cpu_limit=None,
+    memory_limit=None,
+    output_limit=None,
+    shared_namespace=False,
+):
+    """隔離したサブプロセスでコードを実行（時間・CPU・メモリ・出力量を制限）
+
+    無限ループやクラッシュは例外ではなく status が "timeout" / "crash" の結果として返す。
+    shared_namespace=True の場合はグローバルとローカルを共有する通常のスクリプトとして実行する。
+    コンパイルは親プロセスで compile_cached により行い、構文エラーのコードは子プロセスを起動せずに返す。
+    """
+    settings = EXECUTION_SETTINGS
+    timeout = settings["timeout"] if timeout is None else timeout
+    cpu_limit = settings["cpu_limit"] if cpu_limit is None else cpu_limit
+    memory_limit = settings["memory_limit"] if memory_limit is None else memory_limit
+    output_limit = settings["output_limit"] if output_limit is None else output_limit
+
+    start_time = time.time()
+    try:
+        compiled = marshal.dumps(compile_cached(code))
+    except SyntaxError as e:
+        return ExecutionResult(
+            "error", type(e).__name__, str(e), elapsed=time.time() - start_time
+        )
+
+    with _SANDBOX_LOCK:
+        worker = _get_sandbox_worker(cpu_limit, memory_limit)
+        try:
+            payload = worker.run(compiled, output_limit, shared_namespace, timeout)
+        except subprocess.TimeoutExpired:
+            # 無限ループ中のワーカーは再利用できないので終了し、次の候補で起動し直す
+            worker.close()
+            return ExecutionResult(
+                "timeout",
+                error_type="TimeoutError",
+                error_message=f"実行が{timeout}秒以内に終了しませんでした",
+                elapsed=time.time() - start_time,
+            )
+        except SandboxError as e:
+            # 結果を返す前にワーカーが終了した（CPU時間超過・メモリ不足など）
+            worker.close()
+            return ExecutionResult(
+                "crash",
+                error_type="SandboxError",
+                error_message=str(e),
+                elapsed=time.time() - start_time,
+            )
+
+    return ExecutionResult(
+        payload["status"],
+        error_type=payload["error_type"],
+        error_message=payload["error_message"],
+        elapsed=payload["elapsed"],
+        stdout=payload["stdout"],
+        stderr=payload["stderr"],
+        truncated=payload["truncated"],
+        traceback_text=payload["traceback"],
+    )
+
+
+def run_candidate(code):
+    """設定されたバックエンドと出力モードで候補コードを実行"""
+    output = EXECUTION_SETTINGS["output"]
+    if EXECUTION_SETTINGS["backend"] == "sandbox":
+        result = run_code_sandboxed(code, output_limit=0 if output == "discard" else None)
+        if output == "passthrough":
+            print(result.stdout, end="")
+            print(result.stderr, end="", file=sys.stderr)
+        return result
+    return run_code_inprocess(code, output)
+
+
+def execution_score(result):
+    """実行結果を適応度の実行点に変換"""
+    if result.status == "ok":
+        # 実行成功で100点、実行時間が短いほど高得点（最大20点）
+        return 100 + max(0, 20 - int(result.elapsed * 100))
+    if result.status == "timeout":
+        return 0  # 無限ループなど時間内に終わらないコードは実行点なし
+    if result.error_type == "ZeroDivisionError":
+        return 30  # ゼロ除算は修正可能なので部分点
+    if result.error_type in ("SyntaxError", "IndentationError", "TabError"):
+        return 10  # 構文エラーは低得点
+    return 20  # その他のエラー（クラッシュを含む）は少し部分点
+
+
+def _print_error_details(result=None):
+    """エラーの詳細を表示（サンドボックスの実行結果があれば、子プロセスの標準エラー出力とトレースバック）
+
+    result が None の場合は、処理中の例外のトレースバックを表示する。
+    """
+    print("詳細なエラー情報:")
+    if result is None:
+        traceback.print_exc()
+        return
+    if result.stderr:
+        print(result.stderr, end="" if result.stderr.endswith("\n") else "\n")
+    if result.traceback_text:
+        print(result.traceback_text, end="")
+    elif not result.stderr:
+        print(f"{result.error_type}: {result.error_message}")  # 親プロセスでのコンパイルエラーなど
+
+
+def execute_generated_code(code, max_retries=5, show_traceback=True, sandbox=None):
+    """生成されたコードを実行（エラー時は修正して再実行）
+
+    sandbox=True の場合は隔離したサブプロセスで実行する（None の場合は EXECUTION_SETTINGS に従う）。
+    サンドボックスでは、エラー時に子プロセスの標準エラー出力とトレースバックを表示する。
+    制限時間を超えた場合は、修正や再生成では解決しないので、再試行せずに中止する。
+    """
+    if sandbox is None:
+        sandbox = EXECUTION_SETTINGS["backend"] == "sandbox"
+
     print("=" * 60)
     print("生成されたコードを実行します...")
     print("=" * 60)
@@ -671,8 +2318,22 @@ def execute_generated_code(code, max_retries=5, show_traceback=True):
     retry_count = 0
 
     while retry_count < max_retries:
+        result = None  # サンドボックスでの実行結果（同一プロセスでは None）
         try:
-            exec(current_code)
+            if sandbox:
+                result = run_code_sandboxed(current_code, shared_namespace=True)
+                print(result.stdout, end="")
+                if result.truncated:
+                    print("\n...（出力が上限を超えたため省略しました）")
+                if result.status == "timeout":
+                    print(f"\n❌ 制限時間を超えました: {result.error_message}")
+                    print("無限ループの可能性があるため、再試行せずに中止します。")
+                    print("\n問題のコード:")
+                    print(current_code)
+                    return False
+                result.raise_for_error()
+            else:
+                exec(compile_cached(current_code))
             print("\n" + "=" * 60)
             print("✅ 実行完了")
             print("=" * 60)
@@ -681,9 +2342,7 @@ def execute_generated_code(code, max_retries=5, show_traceback=True):
             retry_count += 1
             print(f"\n[エラー {retry_count}/{max_retries}] ゼロ除算エラー: {e}")
             if show_traceback:
-                import traceback
-                print("詳細なエラー情報:")
-                traceback.print_exc()
+                _print_error_details(result)
             print("コードを修正して再実行します...")
             current_code = fix_division_by_zero(current_code)
             print("\n修正後のコード:")
@@ -693,9 +2352,7 @@ def execute_generated_code(code, max_retries=5, show_traceback=True):
             retry_count += 1
             print(f"\n[エラー {retry_count}/{max_retries}] 構文エラー: {e}")
             if show_traceback:
-                import traceback
-                print("詳細なエラー情報:")
-                traceback.print_exc()
+                _print_error_details(result)
             print("コードを修正して再実行します...")
             current_code = fix_syntax_error(current_code)
             print("\n修正後のコード:")
@@ -705,9 +2362,7 @@ def execute_generated_code(code, max_retries=5, show_traceback=True):
             retry_count += 1
             print(f"\n[エラー {retry_count}/{max_retries}] 名前エラー（未定義の変数/関数）: {e}")
             if show_traceback:
-                import traceback
-                print("詳細なエラー情報:")
-                traceback.print_exc()
+                _print_error_details(result)
             print("LLMが生成したコードに未定義の変数や関数が含まれている可能性があります")
             print("\n問題のコード:")
             print(current_code)
@@ -726,9 +2381,7 @@ def execute_generated_code(code, max_retries=5, show_traceback=True):
                 f"\n[エラー {retry_count}/{max_retries}] 実行エラー: {type(e).__name__}: {e}"
             )
             if show_traceback:
-                import traceback
-                print("詳細なエラー情報:")
-                traceback.print_exc()
+                _print_error_details(result)
             print("\n問題のコード:")
             print(current_code)
             if retry_count < max_retries:
@@ -747,278 +2400,1427 @@ def execute_generated_code(code, max_retries=5, show_traceback=True):
     return False
 
 
-class Individual:
-    """遺伝的アルゴリズムの個体（プログラムコード）"""
+# ============================================================
+# 適応度の静的評価（キーワード照合）
+# ============================================================
 
-    def __init__(self, code=None):
-        self.code = code if code else generate_code()
-        self.fitness = 0
+# 人が読めるテキスト出力のキーワード（1つにつき15点）
+HUMAN_READABLE_KEYWORDS = (
+    "こんにちは", "ようこそ", "完了", "実行中", "処理", "データ",
+    "結果", "システム", "お疲れ様", "ファイル", "タスク", "アイテム",
+    "Hello", "Welcome", "Complete", "Processing", "Result", "System",
+    "猫", "犬", "太郎", "花子", "物語", "昔々", "メッセージ"
+)
+
+# テキスト生成操作のパターン（1つにつき20点）
+TEXT_GENERATION_PATTERNS = (
+    '.join(',      # リスト結合
+    'f"',          # f-string（テンプレート文字列）
+    '.append(',    # リストに追加
+    ' + "',        # 文字列結合
+    'message',     # メッセージ変数
+    'text',        # テキスト変数
+    'sentence',    # 文章変数
+    'story',       # ストーリー変数
+)
+
+# 物語性のキーワード（1つにつき25点）
+STORY_KEYWORDS = (
+    "昔々", "ある", "そして", "しかし", "ついに", "こうして",
+    "物語", "冒険", "旅", "発見", "挑戦", "勇気", "友情",
+    "伝説", "魔法", "英雄", "quest", "hero", "journey"
+)
+
+# ストーリー要素（登場人物・場所・アイテム、1つにつき10点、最大50点）
+STORY_ELEMENT_KEYWORDS = (
+    tuple(char["name"] for char in STORY_ELEMENTS["characters"])
+    + tuple(STORY_ELEMENTS["locations"])
+    + tuple(STORY_ELEMENTS["objects"])
+)
+
+
+# 出現回数を数えるキーワード（それ以外のキーワードは出現したかどうかだけを見る）
+COUNTED_KEYWORDS = ("def ", "class ", "print(")
+
+# 出現したかどうかを見るキーワード（複数の評価項目に含まれるものは1回だけ照合する）
+PRESENCE_KEYWORDS = tuple(
+    dict.fromkeys(
+        ('f"', "f'")
+        + HUMAN_READABLE_KEYWORDS
+        + TEXT_GENERATION_PATTERNS
+        + STORY_KEYWORDS
+        + STORY_ELEMENT_KEYWORDS
+    )
+)
+
+# 静的評価で参照する全てのキーワード
+STATIC_KEYWORDS = COUNTED_KEYWORDS + PRESENCE_KEYWORDS
+
+
+def _keyword_pattern(keywords):
+    """キーワードを共通の接頭辞でまとめたトライ木の正規表現（同じ位置では最長のキーワードが一致する）"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # ここで終わるキーワードがある場合、続きは任意（貪欲なので長い方が優先される）
+            body = "(?:" + body + ")?" if len(branches) == 1 else body + "?"
+        return body
+
+    return build(trie)
+
+
+def _may_hide(matched, keyword):
+    """matched の一致が keyword の出現を覆って、走査で keyword が見つからない可能性があるか
+
+    matched が keyword を含む場合と、matched の末尾と keyword の先頭が重なる場合。
+    """
+    if matched == keyword:
+        return False
+    return keyword in matched or any(matched.endswith(keyword[:size]) for size in range(1, len(keyword)))
+
+
+# 走査に使う文字列（先頭の空白はインデントでどこにでも現れ、走査が遅くなるので除いて探す）
+_KEYWORD_SCAN_KEYS = {keyword: keyword.lstrip(" ") for keyword in STATIC_KEYWORDS}
+
+# 全てのキーワードを1回の走査で探す正規表現（モジュール読み込み時に1回だけコンパイル）
+_KEYWORD_PATTERN = re.compile(_keyword_pattern(set(_KEYWORD_SCAN_KEYS.values())))
+
+
+def _keyword_rechecks():
+    """走査の結果だけでは決まらないキーワード -> それを str.count / in で確かめるきっかけになる走査文字列
+
+    空白を除いて探したキーワードは、その走査文字列が一致したとき。別のキーワードの一致に覆われうる
+    キーワードは、覆いうる走査文字列が一致したとき。
+    """
+    rechecks = []
+    for keyword, scan_key in _KEYWORD_SCAN_KEYS.items():
+        triggers = {other for other in _KEYWORD_SCAN_KEYS.values() if _may_hide(other, scan_key)}
+        if scan_key != keyword:
+            triggers.add(scan_key)
+        if triggers:
+            rechecks.append((keyword, frozenset(triggers)))
+    return tuple(rechecks)
+
+
+_KEYWORD_RECHECKS = _keyword_rechecks()
+# いずれかが一致したときだけ _KEYWORD_RECHECKS を確かめる走査文字列
+_RECHECK_TRIGGERS = frozenset().union(*(triggers for _, triggers in _KEYWORD_RECHECKS))
+
+# キーワードとは別の文字列で探した走査文字列（結果からは取り除く）
+_PARTIAL_SCAN_KEYS = tuple(
+    scan_key for keyword, scan_key in _KEYWORD_SCAN_KEYS.items() if scan_key != keyword
+)
+
+
+# 1回の走査で照合するテキストの長さの上限（これより長いと、キーワードごとの str.count / in の方が速い）
+# 正規表現の走査は d, c, p などキーワードの先頭の文字がある位置ごとに分岐を試すので1文字あたりが重く、
+# キーワードごとの検索は呼び出し（80回ほど）の固定費が重い。遺伝子1つ分（数百文字）では走査の方が
+# 1.2〜1.5倍速く、1500文字前後で逆転する（python benchmark.py で確かめられる）。
+KEYWORD_SCAN_MAX_LENGTH = 1200
+
+
+def _count_keywords_each(text):
+    """キーワードを1つずつ str.count / in で照合する（長いテキスト用）"""
+    counts = {}
+    for keyword in COUNTED_KEYWORDS:
+        occurrences = text.count(keyword)
+        if occurrences:
+            counts[keyword] = occurrences
+    for keyword in PRESENCE_KEYWORDS:
+        if keyword in text:
+            counts[keyword] = 1
+    return counts
+
+
+def count_keywords(text):
+    """出現したキーワード -> 出現回数（出現したものだけを含む辞書）
+
+    COUNTED_KEYWORDS は str.count と同じ回数、PRESENCE_KEYWORDS は出現していれば1とする。
+    全てのキーワードをトライ木の正規表現（_KEYWORD_PATTERN）にまとめ、1回の走査で探す。
+    走査では同じ位置で最長の一致だけが残り、一致は重ならないので、別のキーワードの一致に覆われうる
+    キーワード（_KEYWORD_RECHECKS）だけは、覆いうる文字列が一致したときに str.count / in で確かめる。
+    KEYWORD_SCAN_MAX_LENGTH より長いテキストは _count_keywords_each で照合する（結果は同じ）。
+    """
+    if len(text) > KEYWORD_SCAN_MAX_LENGTH:
+        return _count_keywords_each(text)
+    found = _KEYWORD_PATTERN.findall(text)
+    counts = dict.fromkeys(found, 1)
+    for keyword in COUNTED_KEYWORDS:
+        if keyword in counts:
+            counts[keyword] = found.count(keyword)
+    if _RECHECK_TRIGGERS.isdisjoint(counts):
+        return counts
+    rechecked = {}
+    for keyword, triggers in _KEYWORD_RECHECKS:
+        if triggers.isdisjoint(counts) or (keyword in counts and keyword not in COUNTED_KEYWORDS):
+            continue
+        if keyword in COUNTED_KEYWORDS:
+            occurrences = text.count(keyword)
+            if occurrences:
+                rechecked[keyword] = occurrences
+        elif keyword in text:
+            rechecked[keyword] = 1
+    for scan_key in _PARTIAL_SCAN_KEYS:
+        counts.pop(scan_key, None)
+    counts.update(rechecked)
+    return counts
+
+
+def _presence_points():
+    """出現していれば加点されるキーワード -> 点数（複数の評価項目に含まれる場合は合計）"""
+    points = Counter()
+    for keywords, keyword_points in (
+        (HUMAN_READABLE_KEYWORDS, 15),  # 人が読めるテキスト出力
+        (TEXT_GENERATION_PATTERNS, 20),  # テキスト生成操作
+        (STORY_KEYWORDS, 25),  # 物語性
+    ):
+        for keyword in keywords:
+            points[keyword] += keyword_points
+    return points
+
+
+_PRESENCE_POINTS = _presence_points()
+# ストーリー要素 -> 要素数として数える回数
+_STORY_ELEMENT_WEIGHTS = Counter(STORY_ELEMENT_KEYWORDS)
+
+# print( を含む行の直後の行にも print( がある組（1組につき1回一致）
+_CONSECUTIVE_PRINT_PATTERN = re.compile(r"print\([^\n]*\n(?=[^\n]*print\()")
+
+
+def _score_static_features(counts, num_lines, consecutive_prints):
+    """照合結果・空白以外を含む行数・連続したprint文の組数から静的評価の点数を計算"""
+    score = 0
+
+    # コードの複雑さ（関数とクラスの数）
+    score += (counts.get("def ", 0) + counts.get("class ", 0) * 2) * 5
+
+    # コードの長さ（空白以外を含む行数が適度なら10点）
+    if 20 <= num_lines <= 50:
+        score += 10
+
+    # キーワードの評価（出現したキーワードだけを見る）
+    # 人が読めるテキスト: 1つにつき15点 / テキスト生成操作: 20点 / 物語性: 25点
+    # ストーリー要素（登場人物・場所・アイテム）: 1つにつき10点、最大50点
+    story_elements_used = 0
+    for keyword in counts:
+        score += _PRESENCE_POINTS.get(keyword, 0)
+        story_elements_used += _STORY_ELEMENT_WEIGHTS.get(keyword, 0)
+    score += min(story_elements_used * 10, 50)
+
+    # print文の数をカウント（最大25点）
+    score += min(counts.get("print(", 0) * 5, 25)
+
+    # 連続した文の評価（連続したprint文1組につき30点）
+    score += consecutive_prints * 30
+
+    # 変数を使った文の構築（f-stringなど）の追加評価
+    if 'f"' in counts or "f'" in counts:
+        score += 20
+
+    return score
+
+
+def static_fitness(code):
+    """コードを実行せずに得られる部分の適応度（従来の実装と同じ点数になる）
+
+    キーワードは count_keywords で照合し、行の分割は1回だけ行う。
+    """
+    counts = count_keywords(code)
+    num_lines = sum(map(bool, map(str.strip, code.split("\n"))))
+    consecutive_prints = len(_CONSECUTIVE_PRINT_PATTERN.findall(code))
+    return _score_static_features(counts, num_lines, consecutive_prints)
+
+
+def compute_fitness(code):
+    """コードの適応度を計算（個体に依存しないのでワーカープロセスからも呼び出せる）"""
+    # 実行可能性チェック（設定されたバックエンドで実行）+ 静的評価
+    METRICS.increment("evaluations_total")
+    with METRICS.timer("evaluation_seconds"):
+        result = run_candidate(code)
+        METRICS.observe("exec_seconds", result.elapsed)
+        METRICS.increment("executions_total", status=result.status)
+        with METRICS.timer("static_fitness_seconds"):
+            static_score = incremental_static_fitness(code)
+    return execution_score(result) + static_score
 
-    def evaluate_fitness(self):
-        """適応度を評価"""
-        score = 0
 
-        # 実行可能性チェック
-        start_time = time.time()
-        try:
-            exec(self.code, {}, {})
-            score += 100  # 実行成功
-            execution_time = time.time() - start_time
-            # 実行時間が短いほど高得点（最大20点）
-            score += max(0, 20 - int(execution_time * 100))
-        except ZeroDivisionError:
-            score += 30  # ゼロ除算は修正可能なので部分点
-        except SyntaxError:
-            score += 10  # 構文エラーは低得点
-        except:
-            score += 20  # その他のエラーは少し部分点
-
-        # コードの複雑さ（関数とクラスの数）
-        num_functions = self.code.count("def ")
-        num_classes = self.code.count("class ")
-        score += (num_functions + num_classes * 2) * 5
-
-        # コードの長さ（適度な長さを評価）
-        lines = len([l for l in self.code.split("\n") if l.strip()])
-        if 20 <= lines <= 50:
-            score += 10
-
-        # 【新規】人が読めるテキスト出力の評価
-        human_readable_keywords = [
-            "こんにちは", "ようこそ", "完了", "実行中", "処理", "データ",
-            "結果", "システム", "お疲れ様", "ファイル", "タスク", "アイテム",
-            "Hello", "Welcome", "Complete", "Processing", "Result", "System",
-            "猫", "犬", "太郎", "花子", "物語", "昔々", "メッセージ"
-        ]
-        human_readable_count = sum(1 for keyword in human_readable_keywords if keyword in self.code)
-        score += human_readable_count * 15  # 人が読めるテキストがあれば1つにつき15点
-
-        # print文の数をカウント（テキスト出力を促進）
-        print_count = self.code.count("print(")
-        score += min(print_count * 5, 25)  # print文があれば加点（最大25点）
-
-        # 【重要】テキスト生成操作を高く評価
-        text_generation_patterns = [
-            '.join(',      # リスト結合
-            'f"',          # f-string（テンプレート文字列）
-            '.append(',    # リストに追加
-            ' + "',        # 文字列結合
-            'message',     # メッセージ変数
-            'text',        # テキスト変数
-            'sentence',    # 文章変数
-            'story',       # ストーリー変数
-        ]
-        text_gen_count = sum(1 for pattern in text_generation_patterns if pattern in self.code)
-        score += text_gen_count * 20  # テキスト生成パターンがあれば1つにつき20点
-
-        # 【新規】物語性の評価
-        story_keywords = [
-            "昔々", "ある", "そして", "しかし", "ついに", "こうして",
-            "物語", "冒険", "旅", "発見", "挑戦", "勇気", "友情",
-            "伝説", "魔法", "英雄", "quest", "hero", "journey"
-        ]
-        story_count = sum(1 for keyword in story_keywords if keyword in self.code)
-        score += story_count * 25  # 物語キーワードがあれば1つにつき25点
-
-        # 連続した文の評価（複数のprint文が近くにあるか）
-        lines = self.code.split("\n")
-        consecutive_prints = 0
-        for i in range(len(lines) - 1):
-            if "print(" in lines[i] and "print(" in lines[i + 1]:
-                consecutive_prints += 1
-        score += consecutive_prints * 30  # 連続したprint文は物語性が高い（1組につき30点）
-
-        # 変数を使った文の構築（f-stringなど）の追加評価
-        if 'f"' in self.code or 'f\'' in self.code:
-            score += 20  # 動的な文生成を評価
-
-        # ストーリー要素の組み合わせ評価
-        story_elements_used = 0
-        # charactersからチェック
-        for char in STORY_ELEMENTS["characters"]:
-            if char["name"] in self.code:
-                story_elements_used += 1
-        # locationsからチェック
-        for loc in STORY_ELEMENTS["locations"]:
-            if loc in self.code:
-                story_elements_used += 1
-        # objectsからチェック
-        for obj in STORY_ELEMENTS["objects"]:
-            if obj in self.code:
-                story_elements_used += 1
-        score += min(story_elements_used * 10, 50)  # 最大50点
-
-        self.fitness = score
-        return score
+# ============================================================
+# 適応度キャッシュ
+# ============================================================
 
-    def extract_functions(self):
-        """コードから関数を抽出"""
-        pattern = r"(def \w+\([^)]*\):(?:\n    .*)*)"
-        return re.findall(pattern, self.code, re.MULTILINE)
 
-    def extract_classes(self):
-        """コードから関数を抽出"""
-        pattern = r"(class \w+:(?:\n    .*)*?)(?=\n(?:def |class |\Z))"
-        return re.findall(pattern, self.code, re.MULTILINE)
+class LRUCache:
+    """容量制限付きのLRUキャッシュ（ヒット数・ミス数を記録）"""
 
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize  # 0以下ならキャッシュしない
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
 
-def selection(population, tournament_size=3):
-    """トーナメント選択で親を選択"""
-    tournament = random.sample(population, tournament_size)
-    return max(tournament, key=lambda ind: ind.fitness)
+    def __len__(self):
+        return len(self._data)
 
+    def get(self, key, default=None):
+        """値を取得（ヒットした要素は最近使用したものとして末尾に移動）"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """値を登録（容量を超えたら最も古い要素を削除）"""
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """キャッシュと統計をリセット"""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        """ヒット率（0.0-1.0）"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self):
+        """統計情報を表示用の文字列で返す"""
+        return (
+            f"ヒット {self.hits}, ミス {self.misses}, "
+            f"ヒット率 {self.hit_rate() * 100:.1f}%, 件数 {len(self)}/{self.maxsize}"
+        )
 
-def crossover(parent1, parent2):
-    """交叉：2つの親から子を生成"""
-    child_code = "# 偶発的に生成されたコード（遺伝的交叉）\n\n"
 
-    # 親1と親2から関数とクラスを抽出
-    funcs1 = parent1.extract_functions()
-    funcs2 = parent2.extract_functions()
-    classes1 = parent1.extract_classes()
-    classes2 = parent2.extract_classes()
+def code_hash(code):
+    """コード文字列のハッシュ値（キャッシュのキー）"""
+    return hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest()
 
-    # 関数を混ぜる
-    all_funcs = funcs1 + funcs2
-    if all_funcs:
-        selected_funcs = random.sample(all_funcs, min(3, len(all_funcs)))
-        for func in selected_funcs:
-            child_code += func + "\n\n"
 
-    # クラスを混ぜる
-    all_classes = classes1 + classes2
-    if all_classes:
-        selected_classes = random.sample(all_classes, min(2, len(all_classes)))
-        for cls in selected_classes:
-            child_code += cls + "\n\n"
+# 全最適化手法で共有する適応度キャッシュ（コードのハッシュ -> 適応度）
+FITNESS_CACHE = LRUCache(maxsize=4096)
 
-    # 子が空の場合は新しいコードを生成
-    if len(child_code.strip()) < 50:
-        child_code = generate_code()
 
-    return Individual(child_code)
+# ============================================================
+# 構造ハッシュ（識別子の名前とコメントを無視したコードの同一性）
+# ============================================================
 
+# 名前を付け替えない識別子（キーワードと組み込み関数など）
+_RESERVED_NAMES = frozenset(keyword.kwlist) | frozenset(keyword.softkwlist) | frozenset(dir(builtins))
+
+# 文字列の中の識別子（「関数 xxx を実行中...」のように名前が文字列にも埋め込まれている）
+_WORD_PATTERN = re.compile(r"[^\W\d]\w*")
+
+# 正規化で区別する字句（文字列・コメント・数値・属性名・識別子）
+# tokenize で字句解析するより約4倍速い（1プログラムあたり0.5ms程度）
+_CANONICAL_TOKEN_PATTERN = re.compile(
+    r"(?P<string>(?i:[rbuf]{0,2})"
+    r"(?:'''[\s\S]*?'''|" r'"""[\s\S]*?"""|' r"'(?:\\.|[^'\\\n])*'|" r'"(?:\\.|[^"\\\n])*"))'
+    r"|(?P<comment>#[^\n]*)"
+    r"|(?P<number>\d[\w.]*)"
+    r"|(?P<attribute>\.\s*[^\W\d]\w*)"
+    r"|(?P<name>[^\W\d]\w*)"
+)
+
+
+def canonicalize_code(code):
+    """識別子を出現順に v0, v1, ... に付け替え、コメントと空行を除いた正規形を返す
+
+    名前だけが異なるプログラムは同じ正規形になる。キーワード・組み込み関数・属性名は
+    そのまま残し、文字列の中に現れた付け替え済みの名前も同じ名前に置き換える。
+    """
+    names = {}
+
+    def rename_known(match):
+        word = match.group()
+        return names.get(word, word)
+
+    def replace(match):
+        text = match.group()
+        kind = match.lastgroup
+        if kind == "name":
+            if text in _RESERVED_NAMES:
+                return text
+            if text not in names:
+                names[text] = f"v{len(names)}"
+            return names[text]
+        if kind == "string":
+            return _WORD_PATTERN.sub(rename_known, text)
+        if kind == "comment":
+            return ""
+        return text
+
+    canonical = _CANONICAL_TOKEN_PATTERN.sub(replace, code)
+    return "".join(f"{line.rstrip()}\n" for line in canonical.splitlines() if line.strip())
+
+
+# コードのハッシュ -> 構造ハッシュ（同じコードは字句解析し直さない）
+STRUCTURE_HASH_CACHE = LRUCache(maxsize=4096)
+
+
+def structural_hash(code):
+    """識別子の名前とコメントを無視したコードのハッシュ値（canonicalize_code の正規形のハッシュ）"""
+    key = code_hash(code)
+    digest = STRUCTURE_HASH_CACHE.get(key)
+    if digest is None:
+        digest = code_hash(canonicalize_code(code))
+        STRUCTURE_HASH_CACHE.put(key, digest)
+    return digest
+
+
+def fitness_key(code):
+    """適応度キャッシュのキー（EXECUTION_SETTINGS["cache_key"] で構造ハッシュに切り替える）"""
+    if EXECUTION_SETTINGS["cache_key"] == "structural":
+        return structural_hash(code)
+    return code_hash(code)
+
+
+def deduplicate_population(population):
+    """構造ハッシュが同じ個体（名前だけが異なるプログラム）を除き、最初の個体だけを残す"""
+    seen = set()
+    unique = []
+    for individual in population:
+        digest = structural_hash(individual.code)
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(individual)
+    return unique
 
-def mutate(individual, mutation_rate=0.2):
-    """突然変異：コードをランダムに変更"""
-    if random.random() < mutation_rate:
-        mutation_type = random.choice(["add_function", "add_class", "modify"])
 
-        if mutation_type == "add_function":
-            # 新しい関数を追加
-            individual.code += "\n" + generate_random_function()
-        elif mutation_type == "add_class":
-            # 新しいクラスを追加
-            individual.code += "\n" + generate_random_class()
-        elif mutation_type == "modify":
-            # 既存の関数の一部を置き換え
-            funcs = individual.extract_functions()
-            if funcs:
-                old_func = random.choice(funcs)
-                new_func = generate_random_function()
-                individual.code = individual.code.replace(old_func, new_func, 1)
+# ============================================================
+# コンパイル済みコードのキャッシュ
+# ============================================================
 
+# コードのハッシュ -> コードオブジェクト、または構文エラーの例外
+# validate_code_syntax でのコンパイル結果を実行時に再利用し、構文エラーのコードは即座に失敗させる
+CODE_OBJECT_CACHE = LRUCache(maxsize=1024)
 
-def genetic_algorithm(population_size=10, generations=5, use_llm=False):
-    """遺伝的アルゴリズムでコードを進化"""
-    print("=" * 60)
-    print("遺伝的アルゴリズムを開始します")
-    print(f"個体数: {population_size}, 世代数: {generations}")
-    if use_llm:
-        print("LLM改善: 有効")
-    print("=" * 60)
 
-    # 初期個体群を生成
-    population = [Individual() for _ in range(population_size)]
+def compile_cached(code):
+    """コードをコンパイル（結果をキャッシュし、構文エラーのコードはキャッシュした SyntaxError を送出）"""
+    key = code_hash(code)
+    compiled = CODE_OBJECT_CACHE.get(key)
+    if compiled is None:
+        try:
+            with METRICS.timer("compile_seconds"):
+                compiled = compile(code, "<string>", "exec")
+        except SyntaxError as e:
+            METRICS.increment("syntax_errors_total")
+            compiled = e
+        CODE_OBJECT_CACHE.put(key, compiled)
+    if isinstance(compiled, SyntaxError):
+        raise compiled.with_traceback(None)
+    return compiled
 
-    # 各世代で進化
-    for generation in range(generations):
-        print(f"\n【第{generation + 1}世代】")
 
-        # 適応度を評価
-        for individual in population:
-            individual.evaluate_fitness()
+# ============================================================
+# 遺伝子単位の静的評価（変化した関数・クラスだけを再評価）
+# ============================================================
 
-        # 適応度でソート
-        population.sort(key=lambda ind: ind.fitness, reverse=True)
+# 照合するキーワードはどれも改行を含まないので、行の境界で分割しても出現を見逃さない
+assert not any("\n" in keyword for keyword in STATIC_KEYWORDS)
+
+
+class GeneFeatures:
+    """1つの遺伝子（関数・クラスとそれに続く行）から得られる静的評価の特徴量
+
+    キーワードの出現回数・行数・遺伝子内の連続したprint文は遺伝子ごとに足し合わせられる。
+    遺伝子の境界をまたぐ連続したprint文のために、先頭行と末尾行にprint文があるかも記録する。
+    """
+
+    def __init__(self, source):
+        self.counts = count_keywords(source)
+        self.num_lines = sum(map(bool, map(str.strip, source.split("\n"))))
+        self.consecutive_prints = len(_CONSECUTIVE_PRINT_PATTERN.findall(source))
+        self.first_line_prints = "print(" in source.split("\n", 1)[0]
+        self.last_line_prints = "print(" in source.rsplit("\n", 1)[-1]
+
+
+# 遺伝子のソース -> GeneFeatures（変異で変わらなかった遺伝子は親の評価を使い回す）
+GENE_FEATURE_CACHE = LRUCache(maxsize=16384)
+
+
+def gene_features(source):
+    """遺伝子の特徴量を取得（GENE_FEATURE_CACHE でキャッシュ）"""
+    features = GENE_FEATURE_CACHE.get(source)
+    if features is None:
+        features = GeneFeatures(source)
+        GENE_FEATURE_CACHE.put(source, features)
+    return features
+
+
+def _genome_pieces(genome):
+    """ゲノムの全ての行を、遺伝子のソースと遺伝子の間の行（空行・コメント）に分けて先頭から順に返す
+
+    ; で区切って同じ行に書かれた文のように、前の遺伝子と同じ行から始まる遺伝子は1つにまとめる。
+    返すテキストを改行でつなげると元のコードになる。
+    """
+    lines = genome.lines
+    position = 0  # まだ返していない最初の行
+    pending = None  # 返す前の遺伝子の (開始行, 終了行, ソース)
+    for gene in genome.genes:
+        if pending is not None and gene.start < pending[1]:
+            start, end = pending[0], max(pending[1], gene.end)
+            pending = (start, end, "\n".join(lines[start:end]))
+            continue
+        if pending is not None:
+            yield pending[2]
+            position = pending[1]
+        if gene.start > position:
+            yield "\n".join(lines[position:gene.start])
+        pending = (gene.start, gene.end, gene.source)
+    if pending is not None:
+        yield pending[2]
+        position = pending[1]
+    if position < len(lines):
+        yield "\n".join(lines[position:])
+
+
+def incremental_static_fitness(code):
+    """static_fitness と同じ点数を遺伝子ごとの特徴量の合計から計算
+
+    parse_genome のゲノムの遺伝子（Genome.genes）と遺伝子の間の行ごとに、特徴量を
+    GENE_FEATURE_CACHE から取得して合計する。関数やクラスを1つ追加・削除・置換した子では
+    変化した遺伝子だけが照合され、残りは親の評価で得たキャッシュから取得される。
+    構文エラーでゲノムが得られないコードと、ast と行の数え方が異なる \r を含むコードは
+    static_fitness で評価する。
+    """
+    genome = parse_genome(code)
+    if genome is None or "\r" in code:
+        return static_fitness(code)
+    counts = {}
+    num_lines = 0
+    consecutive_prints = 0
+    previous_last_line_prints = False
+    for source in _genome_pieces(genome):
+        features = gene_features(source)
+        for keyword, occurrences in features.counts.items():
+            counts[keyword] = counts.get(keyword, 0) + occurrences
+        num_lines += features.num_lines
+        consecutive_prints += features.consecutive_prints
+        if previous_last_line_prints and features.first_line_prints:
+            consecutive_prints += 1
+        previous_last_line_prints = features.last_line_prints
+    return _score_static_features(counts, num_lines, consecutive_prints)
 
-        # 統計を表示
-        best_fitness = population[0].fitness
-        avg_fitness = sum(ind.fitness for ind in population) / len(population)
-        print(f"最高適応度: {best_fitness:.2f}")
-        print(f"平均適応度: {avg_fitness:.2f}")
-        print(f"最良個体のコード（最初の5行）:")
-        print("\n".join(population[0].code.split("\n")[:5]))
 
-        # 最終世代でなければ次世代を生成
-        if generation < generations - 1:
-            new_population = []
+# ============================================================
+# 遺伝子の事前生成プール（関数・クラス・プログラムをバックグラウンドで用意）
+# ============================================================
 
-            # エリート保存（上位2個体）
-            new_population.extend(population[:2])
+GENE_POOL_SETTINGS = {
+    "buffer_size": 16,  # 種類ごとに用意しておく数（0: プールを使わず、その場で生成する）
+}
 
-            # 残りを交叉と突然変異で生成
-            while len(new_population) < population_size:
-                parent1 = selection(population)
-                parent2 = selection(population)
-                child = crossover(parent1, parent2)
-                mutate(child)
-                new_population.append(child)
+# 種類 -> 生成関数（乱数生成器を受け取る）
+GENE_POOL_GENERATORS = {
+    "function": generate_random_function,
+    "class": generate_random_class,
+    "program": lambda rng: generate_code(rng=rng),
+}
 
-            population = new_population
 
-    print("\n" + "=" * 60)
-    print("進化完了！最良個体のコード:")
-    print("=" * 60)
-    print(population[0].code)
+def configure_gene_pool(**settings):
+    """遺伝子の事前生成プールの設定を変更（次に開始するプールから反映）"""
+    unknown = set(settings) - set(GENE_POOL_SETTINGS)
+    if unknown:
+        raise ValueError(f"不明な設定: {', '.join(sorted(unknown))}")
+    if settings.get("buffer_size", 0) < 0:
+        raise ValueError("buffer_size は0以上を指定してください")
+    GENE_POOL_SETTINGS.update(settings)
+
+
+class GenePool:
+    """関数・クラス・プログラムをバックグラウンドのスレッドで事前に生成しておくプール
+
+    種類ごとに専用の乱数生成器（シードから決まる）と上限付きのキューを持つ。
+    補充するのは一度でも取り出された種類だけなので、使わない種類を無駄に生成することはない。
+    生成と投入は種類ごとのロックの中で行い、キューが空のときはロックを取って同じ乱数生成器で
+    その場で生成するので、取り出す順番は常に生成した順番と一致する。
+    スレッドの進み具合に関係なく、同じシードからは同じ遺伝子の列が得られる。
+    生成は純粋なPythonでGILを取り合うので、前もって生成できるのはメインスレッドがGILを手放して
+    待っている間（サンドボックスの応答待ちなど）だけで、同一プロセスでの実行では速くならない。
+    start しなければスレッドは動かず、take が毎回その場で生成する（同じシードからは同じ列）。
+    """
+
+    def __init__(self, seed, buffer_size=32, generators=None):
+        self.generators = dict(generators or GENE_POOL_GENERATORS)
+        self.rngs = {kind: random.Random(f"{seed}:{kind}") for kind in self.generators}
+        self.queues = {kind: queue.Queue(maxsize=buffer_size) for kind in self.generators}
+        self.locks = {kind: threading.Lock() for kind in self.generators}
+        self.inline_counts = Counter()
+        self.requested = []  # 取り出された順の種類（補充の対象）
+        self._wanted = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._fill, name="gene-pool", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wanted.set()
+        if self._thread.ident is not None:  # start していなければ待つスレッドは無い
+            self._thread.join()
+
+    def _generate(self, kind):
+        return self.generators[kind](self.rngs[kind])
+
+    def _fill(self):
+        """空きのあるキューを順に補充し、全て満杯なら取り出されるまで待つ"""
+        while not self._stop.is_set():
+            self._wanted.clear()
+            produced = False
+            for kind in list(self.requested):
+                if self._stop.is_set():
+                    return
+                buffer = self.queues[kind]
+                if buffer.full():
+                    continue
+                # 投入するのはこのスレッドだけなので、生成後も空きは残っている
+                with self.locks[kind]:
+                    buffer.put_nowait(self._generate(kind))
+                produced = True
+            if not produced:
+                self._wanted.wait()
+
+    def take(self, kind):
+        """種類 kind の遺伝子を1つ取り出す（用意できていなければその場で生成する）"""
+        buffer = self.queues[kind]
+        try:
+            item = buffer.get_nowait()
+            source = "buffer"
+        except queue.Empty:
+            with self.locks[kind]:
+                try:
+                    item = buffer.get_nowait()
+                    source = "buffer"
+                except queue.Empty:
+                    item = self._generate(kind)
+                    source = "inline"
+                    self.inline_counts[kind] += 1
+                    if kind not in self.requested:
+                        self.requested.append(kind)
+        self._wanted.set()
+        METRICS.increment("gene_pool_takes_total", kind=kind, source=source)
+        return item
+
+
+_GENE_POOL = None
+
+
+def _reset_gene_pool_after_fork():
+    # 子プロセスには補充スレッドが引き継がれないので、親のプールは使わない
+    global _GENE_POOL
+    _GENE_POOL = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_gene_pool_after_fork)
+
+
+@contextlib.contextmanager
+def gene_pool(seed=None, background=True):
+    """遺伝子の事前生成プールを開始し、終了時に止めるコンテキストマネージャ
+
+    seed を省略すると random モジュールから引くので、random.seed で固定した探索は再現できる。
+    background=False の場合は補充スレッドを動かさず、同じ乱数生成器でその場で生成する
+    （プロセスを fork する前にスレッドを起動しないため。取り出す遺伝子の列は変わらない）。
+    既にプールが動いている場合（ハイブリッド最適化の中など）はそれをそのまま使う。
+    """
+    global _GENE_POOL
+    if _GENE_POOL is not None or GENE_POOL_SETTINGS["buffer_size"] <= 0:
+        yield _GENE_POOL
+        return
+    if seed is None:
+        seed = random.getrandbits(64)
+    pool = GenePool(seed, GENE_POOL_SETTINGS["buffer_size"])
+    if background:
+        pool.start()
+    _GENE_POOL = pool
+    try:
+        yield pool
+    finally:
+        _GENE_POOL = None
+        pool.stop()
 
-    # LLMで改善する場合
-    if use_llm:
-        original_code = population[0].code
-        improved_code = improve_code_with_llm(original_code)
-        population[0].code = improved_code
 
-        # 改善されたコードを評価
-        evaluate_code_with_llm(original_code, improved_code)
+def uses_gene_pool(optimizer):
+    """最適化関数の実行中、遺伝子の事前生成プールを動かすデコレータ
 
-    # コードを保存
-    mode_name = "GA+LLM" if use_llm else "GA"
-    save_generated_code(population[0].code, mode_name, population[0].fitness)
+    並列評価のワーカー（workers、キーワード引数）を使う場合は、ワーカーを fork で起動するときに
+    スレッドが動いていないよう、補充スレッドを起動せずにその場で生成する。
+    """
 
-    return population[0]
+    @functools.wraps(optimizer)
+    def wrapper(*args, **kwargs):
+        workers = kwargs.get("workers", 1)
+        with gene_pool(background=workers is not None and workers <= 1):
+            return optimizer(*args, **kwargs)
 
+    return wrapper
 
-def simulated_annealing(
-    initial_temp=100.0, cooling_rate=0.95, min_temp=0.1, use_llm=False
-):
-    """シミュレーテッドアニーリングでコードを最適化"""
-    print("=" * 60)
-    print("シミュレーテッドアニーリングを開始します")
-    print(f"初期温度: {initial_temp}, 冷却率: {cooling_rate}, 最低温度: {min_temp}")
-    if use_llm:
-        print("LLM改善: 有効")
-    print("=" * 60)
 
-    # 初期解を生成
-    current_individual = Individual()
-    current_individual.evaluate_fitness()
-    best_individual = Individual(current_individual.code)
-    best_individual.fitness = current_individual.fitness
+def take_generated(kind):
+    """事前生成プールから関数・クラス・プログラムを取り出す
 
-    temperature = initial_temp
-    iteration = 0
+    プールが動いていなければ、これまでどおり random モジュールでその場で生成する。
+    """
+    if _GENE_POOL is None:
+        return GENE_POOL_GENERATORS[kind](random)
+    return _GENE_POOL.take(kind)
 
-    print(f"\n初期解の適応度: {current_individual.fitness:.2f}")
-    print(f"初期コード（最初の5行）:")
-    print("\n".join(current_individual.code.split("\n")[:5]))
 
-    # 温度が最低温度に達するまで繰り返し
-    while temperature > min_temp:
-        iteration += 1
+# ============================================================
+# 収束判定と早期終了（改善の見込みがない評価を打ち切る）
+# ============================================================
+
+
+class EarlyStopping:
+    """最良適応度の推移と個体群の多様性から、探索を打ち切るかを判定する
+
+    - patience: 最良適応度が min_delta を超えて改善しない回数がこれに達したら停止（None: 判定しない）
+    - min_delta: 改善とみなす最良適応度の増分（これ以下の増加は停滞として数える）
+    - target_fitness: 最良適応度がこれ以上になったら停止（None: 判定しない）
+    - min_diversity: 個体群の構造ハッシュの種類の割合（0.0-1.0）がこれを下回ったら停止（None: 判定しない）
+
+    update は世代・反復・エピソードの終わりに呼び出し、停止すべきなら True を返す。
+    理由は reason（表示用の文字列）と reason_kind（"plateau" / "target" / "diversity"）に残る。
+    条件を何も指定しなければ判定は常に False なので、従来どおり最後まで探索する。
+    """
+
+    def __init__(self, patience=None, min_delta=0.0, target_fitness=None, min_diversity=None):
+        if patience is not None and patience < 1:
+            raise ValueError("patience は1以上を指定してください")
+        if min_delta < 0:
+            raise ValueError("min_delta は0以上を指定してください")
+        if min_diversity is not None and not 0.0 <= min_diversity <= 1.0:
+            raise ValueError("min_diversity は0.0から1.0の範囲で指定してください")
+        self.patience = patience
+        self.min_delta = min_delta
+        self.target_fitness = target_fitness
+        self.min_diversity = min_diversity
+        self.best = -float("inf")
+        self.stale = 0
+        self.updates = 0
+        self.reason = None
+        self.reason_kind = None
+
+    @property
+    def stopped(self):
+        return self.reason is not None
+
+    def _stop(self, kind, reason):
+        self.reason_kind = kind
+        self.reason = reason
+        return True
+
+    def update(self, best_fitness, population=None):
+        """最良適応度（と個体群）を記録し、停止すべきなら True を返す"""
+        if self.stopped:
+            return True
+        self.updates += 1
+        if best_fitness > self.best + self.min_delta:
+            self.best = best_fitness
+            self.stale = 0
+        else:
+            self.stale += 1
+
+        if self.target_fitness is not None and best_fitness >= self.target_fitness:
+            return self._stop("target", f"目標適応度 {self.target_fitness:.2f} に到達")
+        if self.min_diversity is not None and population:
+            # 多様性の判定が必要なときだけ構造ハッシュを計算する
+            diversity = len({structural_hash(individual.code) for individual in population}) / len(population)
+            if diversity < self.min_diversity:
+                return self._stop(
+                    "diversity", f"多様性が低下（構造の種類の割合 {diversity:.2f} < {self.min_diversity:.2f}）"
+                )
+        if self.patience is not None and self.stale >= self.patience:
+            return self._stop(
+                "plateau", f"{self.patience}回続けて最良適応度の改善が {self.min_delta:.2f} 以下"
+            )
+        return False
+
+    def report(self, optimizer, unit):
+        """停止理由を表示し、メトリクスに記録する（最後まで探索した場合は何もしない）"""
+        if not self.stopped:
+            return
+        METRICS.increment("early_stops_total", optimizer=optimizer, reason=self.reason_kind)
+        print(f"⏹  早期終了（{self.updates}{unit}目）: {self.reason}")
+
+
+# ============================================================
+# ゲノム（astで解析したコードの構造）
+# ============================================================
+
+
+class Gene:
+    """ゲノムを構成する1つの遺伝子（トップレベルの関数・クラス・その他の文）"""
+
+    def __init__(self, kind, name, node, start, end, source):
+        self.kind = kind  # "function" / "class" / "main"（メイン処理の文）
+        self.name = name  # 関数名・クラス名（メイン処理の文はNone）
+        self.node = node  # astのノード（行番号は最初に解析したコードでの位置）
+        self.start = start  # 開始行（0始まり、デコレータを含む）
+        self.end = end  # 終了行（この行は含まない）
+        self.source = source
+
+    def moved(self, start):
+        """開始行を start に移した同じ遺伝子"""
+        return Gene(self.kind, self.name, self.node, start, start + self.end - self.start, self.source)
+
+
+class Genome:
+    """コードをastで1回だけ解析し、関数・クラス・メイン処理をソース上の範囲とともに保持する
+
+    構文エラーのあるコードでは SyntaxError を送出する。
+    置き換えや削除は行番号の範囲で行い、新しいコード文字列を返す（自身は変更しない）。
+    新しいコードのゲノムは、変わった部分だけを解析して GENOME_CACHE に登録しておく。
+    """
+
+    def __init__(self, code, genes=None):
+        self.code = code
+        self.lines = code.split("\n")
+        if genes is None:
+            genes = []
+            for node in ast.parse(code).body:
+                start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+                end = node.end_lineno
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    kind, name = "function", node.name
+                elif isinstance(node, ast.ClassDef):
+                    kind, name = "class", node.name
+                else:
+                    kind, name = "main", None
+                source = "\n".join(self.lines[start:end])
+                genes.append(Gene(kind, name, node, start, end, source))
+        self.genes = genes
+
+        self.functions = [gene for gene in self.genes if gene.kind == "function"]
+        self.classes = [gene for gene in self.genes if gene.kind == "class"]
+        self.main = [gene for gene in self.genes if gene.kind == "main"]
+
+    def replace(self, gene, new_source):
+        """遺伝子を新しいソースに置き換えたコードを返す"""
+        new_lines = self.lines[:gene.start] + new_source.split("\n") + self.lines[gene.end:]
+        return self._derive("\n".join(new_lines), gene.start, gene.end, new_source)
+
+    def remove(self, gene):
+        """遺伝子を取り除いたコードを返す"""
+        return self._derive("\n".join(self.lines[:gene.start] + self.lines[gene.end:]), gene.start, gene.end)
+
+    def append(self, new_source):
+        """末尾に新しいソースを追加したコードを返す"""
+        return self._derive(self.code + "\n" + new_source, len(self.lines), len(self.lines), new_source)
+
+    def _derive(self, code, start, end, new_source=None):
+        """start〜end行を new_source に置き換えた code のゲノムを、new_source だけを解析して登録する
+
+        前後の遺伝子は行番号をずらして使い回す。new_source が単独では解析できない場合や、
+        置き換える範囲の境界が遺伝子の途中にある場合は登録せず、必要になったときに code 全体を解析する。
+        """
+        if any(gene.start < boundary < gene.end for gene in self.genes for boundary in (start, end)):
+            return code
+        if new_source is None:
+            new_genes, length = [], 0
+        else:
+            try:
+                new_genes = Genome(new_source).genes
+            except (SyntaxError, ValueError):
+                return code
+            length = new_source.count("\n") + 1
+
+        shift = start + length - end
+        genes = [gene for gene in self.genes if gene.end <= start]
+        genes += [gene.moved(gene.start + start) for gene in new_genes]
+        genes += [gene.moved(gene.start + shift) for gene in self.genes if gene.start >= end]
+        GENOME_CACHE.put(code_hash(code), Genome(code, genes))
+        return code
+
+
+def join_genes(prefix, genes):
+    """prefix（改行で終わる）の後に遺伝子のソースを空行で区切って並べたコードを返す
+
+    遺伝子は解析済みなので、コード全体を解析し直さずにゲノムを登録する。
+    """
+    code = prefix + "".join(gene.source + "\n\n" for gene in genes)
+    prefix_genome = parse_genome(prefix)
+    if prefix_genome is not None:
+        derived = list(prefix_genome.genes)
+        line = prefix.count("\n")
+        for gene in genes:
+            derived.append(gene.moved(line))
+            line += gene.source.count("\n") + 2
+        GENOME_CACHE.put(code_hash(code), Genome(code, derived))
+    return code
+
+
+# 解析済みゲノムのキャッシュ（コードのハッシュ -> Genome、構文エラーならNone）
+# 個体をコピーしても同じコードなら再解析しない
+GENOME_CACHE = LRUCache(maxsize=1024)
+
+
+def parse_genome(code):
+    """コードのゲノムを取得（構文エラーのコードではNone）"""
+    key = code_hash(code)
+    genome = GENOME_CACHE.get(key, False)
+    if genome is False:
+        try:
+            genome = Genome(code)
+        except (SyntaxError, ValueError):  # ValueError: ヌル文字を含むコード
+            genome = None
+        GENOME_CACHE.put(key, genome)
+    return genome
+
+
+class Individual:
+    """遺伝的アルゴリズムの個体（プログラムコード）"""
+
+    def __init__(self, code=None):
+        self.code = code if code else take_generated("program")
+        self.fitness = 0
+
+    @property
+    def code(self):
+        return self._code
+
+    @code.setter
+    def code(self, value):
+        # コードが変わったら解析済みのゲノムは無効になる
+        self._code = value
+        self._genome = None
+
+    @property
+    def genome(self):
+        """コードの構造（構文エラーのコードではNone、コードが変わるまで再解析しない）"""
+        if self._genome is None:
+            self._genome = parse_genome(self._code) or False
+        return self._genome or None
+
+    def evaluate_fitness(self):
+        """適応度を評価（評価済みのコードはキャッシュから返す）"""
+        key = fitness_key(self.code)
+        fitness = FITNESS_CACHE.get(key)
+        if fitness is None:
+            fitness = compute_fitness(self.code)
+            FITNESS_CACHE.put(key, fitness)
+        else:
+            METRICS.increment("fitness_cache_hits_total")
+        self.fitness = fitness
+        return fitness
+
+    def append_gene(self, source):
+        """コードの末尾に遺伝子を追加（解析済みのゲノムがあれば、追加した遺伝子だけを解析する）"""
+        if self.genome is None:
+            self.code += "\n" + source
+        else:
+            self.code = self.genome.append(source)
+
+    def extract_functions(self):
+        """コードからトップレベルの関数を抽出（構文エラーのコードは正規表現で抽出）"""
+        if self.genome is not None:
+            return [gene.source for gene in self.genome.functions]
+        pattern = r"(def \w+\([^)]*\):(?:\n    .*)*)"
+        return re.findall(pattern, self.code, re.MULTILINE)
+
+    def extract_classes(self):
+        """コードからクラスを抽出（構文エラーのコードは正規表現で抽出）"""
+        if self.genome is not None:
+            return [gene.source for gene in self.genome.classes]
+        pattern = r"(class \w+:(?:\n    .*)*?)(?=\n(?:def |class |\Z))"
+        return re.findall(pattern, self.code, re.MULTILINE)
+
+
+class EvaluationPool(ProcessPoolExecutor):
+    """並列評価用のプロセスプール（チャンクの大きさを決めるためにワーカー数を workers に持つ）"""
+
+    def __init__(self, workers, **kwargs):
+        super().__init__(max_workers=workers, **kwargs)
+        self.workers = workers
+
+
+def create_evaluation_pool(workers=1):
+    """並列評価用のプロセスプールを生成（workersが1以下なら逐次評価用にNoneを返す）
+
+    with文で使用する。workers=None の場合はCPUコア数だけワーカーを起動する。
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return contextlib.nullcontext(None)
+    # spawn方式でもワーカーが同じ実行設定を使うように引き継ぐ
+    return EvaluationPool(
+        workers,
+        initializer=EXECUTION_SETTINGS.update,
+        initargs=(dict(EXECUTION_SETTINGS),),
+    )
+
+
+@contextlib.contextmanager
+def seeded_random(seed):
+    """random モジュールを seed で初期化し、終了時に呼び出し前の状態に戻す
+
+    ワーカープロセスに渡す処理を逐次実行（workers が1以下）しても、呼び出し側の乱数列が
+    途中で初期化し直されないようにする（並列実行したときと同じ乱数列になる）。
+    """
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        yield
+    finally:
+        random.setstate(state)
+
+
+def evaluate_population(population, executor=None):
+    """個体群の適応度を一括評価し、結果を各個体に書き戻す
+
+    executor は create_evaluation_pool のプール（ワーカー数からチャンクの大きさを決める）。
+    """
+    # キャッシュ済みのコードは評価を省略し、未評価のコードは重複を除いてまとめて評価する
+    # （構造ハッシュをキーにしている場合は、名前だけが異なるプログラムも1回だけ評価する）
+    keys = [fitness_key(individual.code) for individual in population]
+    results = {}
+    pending = {}
+    for individual, key in zip(population, keys):
+        fitness = FITNESS_CACHE.get(key)
+        if fitness is None:
+            pending.setdefault(key, individual.code)
+        else:
+            results[key] = fitness
+
+    if pending:
+        codes = list(pending.values())
+        if executor is None or len(codes) <= 1:
+            # 逐次評価
+            fitnesses = [compute_fitness(code) for code in codes]
+        else:
+            # プロセスプールで並列評価（プロセス間通信を減らすためチャンク単位で送る）
+            # ワーカー内の計測値は親に戻らないので、評価数と一括評価の時間は親で記録する
+            # ワーカー数を持たない Executor ではチャンクに分けずに送る
+            workers = getattr(executor, "workers", None)
+            chunksize = max(1, len(codes) // (workers * 4)) if workers else 1
+            METRICS.increment("evaluations_total", len(codes))
+            with METRICS.timer("parallel_evaluation_batch_seconds"):
+                fitnesses = list(executor.map(compute_fitness, codes, chunksize=chunksize))
+        for key, fitness in zip(pending, fitnesses):
+            FITNESS_CACHE.put(key, fitness)
+            results[key] = fitness
+
+    METRICS.increment("fitness_cache_hits_total", len(population) - len(pending))
+    for individual, key in zip(population, keys):
+        individual.fitness = results[key]
+    return [individual.fitness for individual in population]
+
+
+def selection(population, tournament_size=3):
+    """トーナメント選択で親を選択"""
+    tournament = random.sample(population, tournament_size)
+    return max(tournament, key=lambda ind: ind.fitness)
+
+
+@METRICS.timed("operator_seconds", operator="crossover")
+def crossover(parent1, parent2):
+    """交叉：2つの親から子を生成"""
+    header = "# 偶発的に生成されたコード（遺伝的交叉）\n\n"
+
+    # 親1と親2から関数とクラスを抽出（両親とも解析済みなら遺伝子のまま混ぜ、子を解析し直さない）
+    genome1, genome2 = parent1.genome, parent2.genome
+    use_genes = genome1 is not None and genome2 is not None
+    if use_genes:
+        all_funcs = genome1.functions + genome2.functions
+        all_classes = genome1.classes + genome2.classes
+    else:
+        all_funcs = parent1.extract_functions() + parent2.extract_functions()
+        all_classes = parent1.extract_classes() + parent2.extract_classes()
+
+    # 関数を混ぜる
+    selected = []
+    if all_funcs:
+        selected += random.sample(all_funcs, min(3, len(all_funcs)))
+
+    # クラスを混ぜる
+    if all_classes:
+        selected += random.sample(all_classes, min(2, len(all_classes)))
+
+    if use_genes:
+        child_code = join_genes(header, selected)
+    else:
+        child_code = header + "".join(source + "\n\n" for source in selected)
+
+    # 子が空の場合は新しいコードを生成
+    if len(child_code.strip()) < 50:
+        child_code = take_generated("program")
+
+    return Individual(child_code)
+
+
+@METRICS.timed("operator_seconds", operator="mutate")
+def mutate(individual, mutation_rate=0.2):
+    """突然変異：コードをランダムに変更"""
+    if random.random() < mutation_rate:
+        mutation_type = random.choice(["add_function", "add_class", "modify"])
+
+        if mutation_type == "add_function":
+            # 新しい関数を追加
+            individual.append_gene(take_generated("function"))
+        elif mutation_type == "add_class":
+            # 新しいクラスを追加
+            individual.append_gene(take_generated("class"))
+        elif mutation_type == "modify":
+            # 既存の関数の一部を置き換え（ゲノム上の範囲で置き換える）
+            genome = individual.genome
+            if genome is not None:
+                if genome.functions:
+                    old_func = random.choice(genome.functions)
+                    new_func = take_generated("function")
+                    individual.code = genome.replace(old_func, new_func)
+            else:
+                funcs = individual.extract_functions()
+                if funcs:
+                    old_func = random.choice(funcs)
+                    new_func = take_generated("function")
+                    individual.code = individual.code.replace(old_func, new_func, 1)
+
+
+def next_generation(population, population_size, mutation_rate=0.2, elite_size=2, tournament_size=3):
+    """適応度の降順にソート済みの個体群から次世代を生成"""
+    # エリート保存（上位elite_size個体、構造ハッシュをキーにしている場合は名前違いの重複を除く）
+    if EXECUTION_SETTINGS["cache_key"] == "structural":
+        new_population = deduplicate_population(population)[:elite_size]
+    else:
+        new_population = population[:elite_size]
+
+    # 残りを交叉と突然変異で生成
+    while len(new_population) < population_size:
+        parent1 = selection(population, tournament_size)
+        parent2 = selection(population, tournament_size)
+        child = crossover(parent1, parent2)
+        mutate(child, mutation_rate)
+        new_population.append(child)
+
+    return new_population
+
+
+@METRICS.timed("optimizer_seconds", optimizer="ga")
+@uses_gene_pool
+def genetic_algorithm(
+    population_size=10,
+    generations=5,
+    use_llm=False,
+    workers=1,
+    mutation_rate=0.2,
+    elite_size=2,
+    tournament_size=3,
+    save=True,
+    patience=None,
+    min_delta=0.0,
+    target_fitness=None,
+    min_diversity=None,
+):
+    """遺伝的アルゴリズムでコードを進化（workers > 1 で適応度をプロセスプールで並列評価）
+
+    save=False の場合は最良個体を保存しない（複数回の独立実行で最良の結果だけを保存する場合）。
+    patience / min_delta / target_fitness / min_diversity は世代単位の早期終了の条件（EarlyStopping を参照）。
+    """
+    print("=" * 60)
+    print("遺伝的アルゴリズムを開始します")
+    print(f"個体数: {population_size}, 世代数: {generations}")
+    if workers != 1:
+        print(f"並列評価ワーカー数: {workers or os.cpu_count()}")
+    if use_llm:
+        print("LLM改善: 有効")
+    print("=" * 60)
+
+    # 初期個体群を生成
+    population = [Individual(code) for code in generate_codes(population_size)]
+    stopping = EarlyStopping(patience, min_delta, target_fitness, min_diversity)
+
+    # 各世代で進化（並列評価用のプールは全世代で使い回す）
+    with create_evaluation_pool(workers) as executor:
+        for generation in range(generations):
+            print(f"\n【第{generation + 1}世代】")
+
+            # 適応度を評価
+            evaluate_population(population, executor)
+
+            # 適応度でソート
+            population.sort(key=lambda ind: ind.fitness, reverse=True)
+
+            # 統計を表示
+            best_fitness = population[0].fitness
+            avg_fitness = sum(ind.fitness for ind in population) / len(population)
+            METRICS.set_gauge("best_fitness", best_fitness, optimizer="ga")
+            METRICS.increment("generations_total", optimizer="ga")
+            print(f"最高適応度: {best_fitness:.2f}")
+            print(f"平均適応度: {avg_fitness:.2f}")
+            print(f"最良個体のコード（最初の5行）:")
+            print("\n".join(population[0].code.split("\n")[:5]))
+
+            # 収束していれば打ち切る（次世代は生成しないので population[0] が最良個体のまま）
+            if stopping.update(best_fitness, population):
+                break
+
+            # 最終世代でなければ次世代を生成
+            if generation < generations - 1:
+                population = next_generation(
+                    population, population_size, mutation_rate, elite_size, tournament_size
+                )
+
+    stopping.report("ga", "世代")
+    print(f"\n適応度キャッシュ: {FITNESS_CACHE.summary()}")
+
+    print("\n" + "=" * 60)
+    print("進化完了！最良個体のコード:")
+    print("=" * 60)
+    print(population[0].code)
+
+    # LLMで改善する場合
+    if use_llm:
+        original_code = population[0].code
+        improved_code = improve_code_with_llm(original_code)
+        population[0].code = improved_code
+
+        # 改善されたコードを評価
+        evaluate_code_with_llm(original_code, improved_code)
+
+    # コードを保存
+    if save:
+        mode_name = "GA+LLM" if use_llm else "GA"
+        save_generated_code(population[0].code, mode_name, population[0].fitness)
+
+    return population[0]
+
+
+# ============================================================
+# 島モデルの遺伝的アルゴリズム（島ごとにプロセスで進化し、上位個体が移住）
+# ============================================================
+
+# 移住のトポロジー
+MIGRATION_TOPOLOGIES = ("ring", "full")
+
+
+def _evolve_island(codes, fitnesses, generations, seed, params, collect_metrics=False):
+    """1つの島の個体群を generations 世代進化させる（ワーカープロセスから呼び出す）
+
+    評価済みの個体（前のエポックの個体や移住者）は適応度をキャッシュに登録して再評価しない。
+    適応度の降順の [(コード, 適応度), ...] と計測値（collect_metrics=False ならNone）を返す。
+    """
+    if collect_metrics:
+        METRICS.reset()
+        METRICS.enable()
+
+    population = []
+    for code, fitness in zip(codes, fitnesses):
+        if fitness is not None:
+            FITNESS_CACHE.put(fitness_key(code), fitness)
+        population.append(Individual(code))
+
+    with seeded_random(seed):
+        for _ in range(generations):
+            evaluate_population(population)
+            population.sort(key=lambda ind: ind.fitness, reverse=True)
+            population = next_generation(population, len(population), **params)
+        evaluate_population(population)
+        population.sort(key=lambda ind: ind.fitness, reverse=True)
+
+    members = [(individual.code, individual.fitness) for individual in population]
+    return members, METRICS.snapshot() if collect_metrics else None
+
+
+def migrate(islands, migration_size=2, topology="ring"):
+    """島の間で上位個体を移住させる（各島は適応度の降順の [(コード, 適応度), ...]）
+
+    ring: 各島の上位 migration_size 個体が隣の島へ移り、移住先の下位の個体と入れ替わる。
+    full: 各島は他の全ての島の上位個体のうち、最も良い migration_size 個体を受け入れる。
+    移住後の各島は再び適応度の降順に並べて返す。
+    """
+    if topology not in MIGRATION_TOPOLOGIES:
+        raise ValueError(f"不明な移住トポロジーです: {topology}")
+    emigrants = [island[:migration_size] for island in islands]
+    migrated = []
+    for index, island in enumerate(islands):
+        if topology == "ring":
+            immigrants = emigrants[index - 1]
+        else:
+            others = [member for other, group in enumerate(emigrants) if other != index for member in group]
+            immigrants = sorted(others, key=lambda member: member[1], reverse=True)[:migration_size]
+        survivors = island[: max(0, len(island) - len(immigrants))]
+        migrated.append(sorted(survivors + immigrants, key=lambda member: member[1], reverse=True))
+    return migrated
+
+
+@METRICS.timed("optimizer_seconds", optimizer="island")
+def island_genetic_algorithm(
+    num_islands=4,
+    island_size=10,
+    epochs=5,
+    migration_interval=3,
+    migration_size=2,
+    topology="ring",
+    workers=None,
+    use_llm=False,
+    mutation_rate=0.2,
+    elite_size=2,
+    tournament_size=3,
+    save=True,
+):
+    """島モデルの遺伝的アルゴリズム
+
+    num_islands 個の島（個体数 island_size）がそれぞれのプロセスで migration_interval 世代ずつ
+    進化し（selection / crossover / mutate は通常のGAと同じ）、その後に上位個体が移住する。
+    これを epochs 回繰り返すので、総世代数は epochs × migration_interval になる。
+    workers はプロセス数（None ならCPUコア数、島の数が上限、1以下なら逐次実行）。
+    """
+    if topology not in MIGRATION_TOPOLOGIES:
+        raise ValueError(f"不明な移住トポロジーです: {topology}")
+    workers = min(workers or os.cpu_count() or 1, num_islands)
+    params = {
+        "mutation_rate": mutation_rate,
+        "elite_size": elite_size,
+        "tournament_size": tournament_size,
+    }
+
+    print("=" * 60)
+    print("島モデルの遺伝的アルゴリズムを開始します")
+    print(f"島の数: {num_islands}, 島ごとの個体数: {island_size}, エポック数: {epochs}")
+    print(
+        f"移住: {migration_interval}世代ごとに上位{migration_size}個体（トポロジー: {topology}）, "
+        f"プロセス数: {workers}"
+    )
+    if use_llm:
+        print("LLM改善: 有効")
+    print("=" * 60)
+
+    # 初期個体群を生成（未評価なので適応度はNone）
+    islands = [
+        [(code, None) for code in generate_codes(island_size)] for _ in range(num_islands)
+    ]
+
+    with create_evaluation_pool(workers) as executor:
+        collect_metrics = METRICS.enabled and executor is not None
+        for epoch in range(epochs):
+            # 各島の乱数シードは親の乱数から決める（--seed で再現できる）
+            seeds = [random.getrandbits(32) for _ in range(num_islands)]
+            arguments = (
+                [[code for code, _ in island] for island in islands],
+                [[fitness for _, fitness in island] for island in islands],
+                [migration_interval] * num_islands,
+                seeds,
+                [params] * num_islands,
+                [collect_metrics] * num_islands,
+            )
+            results = executor.map(_evolve_island, *arguments) if executor else map(_evolve_island, *arguments)
+
+            islands = []
+            for members, snapshot in results:
+                islands.append(members)
+                if snapshot is not None:
+                    METRICS.merge(snapshot)
+
+            generation = (epoch + 1) * migration_interval
+            best_per_island = [island[0][1] for island in islands]
+            print(f"\n【エポック {epoch + 1}/{epochs}】第{generation}世代")
+            print("島ごとの最高適応度: " + ", ".join(f"{fitness:.2f}" for fitness in best_per_island))
+            print(f"全体の最高適応度: {max(best_per_island):.2f}")
+            METRICS.set_gauge("best_fitness", max(best_per_island), optimizer="island")
+            METRICS.increment("generations_total", migration_interval * num_islands, optimizer="island")
+
+            # 最終エポックでなければ移住
+            if epoch < epochs - 1 and num_islands > 1:
+                islands = migrate(islands, migration_size, topology)
+                METRICS.increment("migrations_total")
+
+    best_code, best_fitness = max((island[0] for island in islands), key=lambda member: member[1])
+    best_individual = Individual(best_code)
+    best_individual.fitness = best_fitness
+
+    print(f"\n適応度キャッシュ（親プロセス）: {FITNESS_CACHE.summary()}")
+    print("\n" + "=" * 60)
+    print("進化完了！最良個体のコード:")
+    print("=" * 60)
+    print(best_individual.code)
+
+    # LLMで改善する場合
+    if use_llm:
+        original_code = best_individual.code
+        improved_code = improve_code_with_llm(original_code)
+        best_individual.code = improved_code
+
+        # 改善されたコードを評価
+        evaluate_code_with_llm(original_code, improved_code)
+
+    # コードを保存
+    if save:
+        mode_name = "GA-Island+LLM" if use_llm else "GA-Island"
+        save_generated_code(best_individual.code, mode_name, best_individual.fitness)
+
+    return best_individual
+
+
+@METRICS.timed("optimizer_seconds", optimizer="sa")
+@uses_gene_pool
+def simulated_annealing(
+    initial_temp=100.0,
+    cooling_rate=0.95,
+    min_temp=0.1,
+    use_llm=False,
+    mutation_rate=0.3,
+    save=True,
+    patience=None,
+    min_delta=0.0,
+    target_fitness=None,
+):
+    """シミュレーテッドアニーリングでコードを最適化（save=False の場合は最良解を保存しない）
+
+    patience / min_delta / target_fitness は反復単位の早期終了の条件（EarlyStopping を参照）。
+    """
+    print("=" * 60)
+    print("シミュレーテッドアニーリングを開始します")
+    print(f"初期温度: {initial_temp}, 冷却率: {cooling_rate}, 最低温度: {min_temp}")
+    if use_llm:
+        print("LLM改善: 有効")
+    print("=" * 60)
+
+    # 初期解を生成
+    current_individual = Individual()
+    current_individual.evaluate_fitness()
+    best_individual = Individual(current_individual.code)
+    best_individual.fitness = current_individual.fitness
+
+    temperature = initial_temp
+    iteration = 0
+    stopping = EarlyStopping(patience, min_delta, target_fitness)
+
+    print(f"\n初期解の適応度: {current_individual.fitness:.2f}")
+    print(f"初期コード（最初の5行）:")
+    print("\n".join(current_individual.code.split("\n")[:5]))
+
+    # 温度が最低温度に達するまで繰り返し
+    while temperature > min_temp:
+        iteration += 1
 
         # 新しい解を生成（突然変異）
         new_individual = Individual(current_individual.code)
-        mutate(new_individual, mutation_rate=0.3)  # 突然変異率を少し高めに設定
+        mutate(new_individual, mutation_rate)  # GAより突然変異率を少し高めに設定
         new_individual.evaluate_fitness()
 
         # 適応度の差分を計算
@@ -1042,6 +3844,7 @@ def simulated_annealing(
         if current_individual.fitness > best_individual.fitness:
             best_individual = Individual(current_individual.code)
             best_individual.fitness = current_individual.fitness
+            METRICS.set_gauge("best_fitness", best_individual.fitness, optimizer="sa")
             print(
                 f"\n[反復 {iteration}] 🌟 最良解更新! 適応度: {best_individual.fitness:.2f}, 温度: {temperature:.2f}"
             )
@@ -1059,12 +3862,194 @@ def simulated_annealing(
                     f"最良: {best_individual.fitness:.2f}, 状態: 棄却"
                 )
 
+        if stopping.update(best_individual.fitness):
+            break
+
         # 温度を下げる
         temperature *= cooling_rate
 
+    stopping.report("sa", "反復")
     print("\n" + "=" * 60)
     print(f"最適化完了！総反復回数: {iteration}")
     print(f"最良解の適応度: {best_individual.fitness:.2f}")
+    print(f"適応度キャッシュ: {FITNESS_CACHE.summary()}")
+    print("=" * 60)
+    print("最良解のコード:")
+    print("=" * 60)
+    print(best_individual.code)
+
+    # LLMで改善する場合
+    if use_llm:
+        original_code = best_individual.code
+        improved_code = improve_code_with_llm(original_code)
+        best_individual.code = improved_code
+
+        # 改善されたコードを評価
+        evaluate_code_with_llm(original_code, improved_code)
+
+    # コードを保存
+    if save:
+        mode_name = "SA+LLM" if use_llm else "SA"
+        save_generated_code(best_individual.code, mode_name, best_individual.fitness)
+
+    return best_individual
+
+
+# ============================================================
+# レプリカ交換法（パラレルテンパリング）
+# ============================================================
+
+
+def _run_replica_chain(code, fitness, temperature, steps, seed, mutation_rate, collect_metrics=False):
+    """一定温度でメトロポリス法の連鎖を steps 回進める（ワーカープロセスから呼び出す）
+
+    ((現在のコード, 適応度), (連鎖中の最良コード, 適応度), 受理回数, 計測値) を返す。
+    """
+    if collect_metrics:
+        METRICS.reset()
+        METRICS.enable()
+
+    with seeded_random(seed):
+        current = Individual(code)
+        if fitness is None:
+            current.evaluate_fitness()
+        else:
+            FITNESS_CACHE.put(fitness_key(code), fitness)
+            current.fitness = fitness
+        best = (current.code, current.fitness)
+        accepted = 0
+
+        for _ in range(steps):
+            candidate = Individual(current.code)
+            mutate(candidate, mutation_rate)
+            candidate.evaluate_fitness()
+            delta = candidate.fitness - current.fitness
+            if delta > 0 or random.random() < math.exp(delta / temperature):
+                current = candidate
+                accepted += 1
+                if current.fitness > best[1]:
+                    best = (current.code, current.fitness)
+
+    snapshot = METRICS.snapshot() if collect_metrics else None
+    return (current.code, current.fitness), best, accepted, snapshot
+
+
+def replica_temperatures(num_replicas, min_temp=0.1, max_temp=100.0):
+    """min_temp から max_temp までの等比数列の温度（低温から順に）"""
+    if num_replicas == 1:
+        return [min_temp]
+    ratio = (max_temp / min_temp) ** (1 / (num_replicas - 1))
+    return [min_temp * ratio**index for index in range(num_replicas)]
+
+
+def exchange_replicas(states, temperatures, offset):
+    """隣り合う温度のレプリカの状態をメトロポリス基準で交換（states は [(コード, 適応度), ...]）
+
+    offset 番目から2つずつ組にする（呼び出しごとに0と1を交互に指定すると全ての隣接対が交換の対象になる）。
+    交換後の状態のリストと、(試行回数, 受理回数) を返す。
+    """
+    states = list(states)
+    attempts = accepted = 0
+    for i in range(offset, len(states) - 1, 2):
+        j = i + 1
+        beta_i, beta_j = 1 / temperatures[i], 1 / temperatures[j]
+        # 適応度を最大化するので、エネルギーを -適応度 とした交換確率 min(1, exp((β_i - β_j)(f_j - f_i)))
+        exponent = (beta_i - beta_j) * (states[j][1] - states[i][1])
+        attempts += 1
+        if exponent >= 0 or random.random() < math.exp(exponent):
+            states[i], states[j] = states[j], states[i]
+            accepted += 1
+    return states, (attempts, accepted)
+
+
+@METRICS.timed("optimizer_seconds", optimizer="pt")
+def parallel_tempering(
+    num_replicas=4,
+    min_temp=0.1,
+    max_temp=100.0,
+    exchange_interval=10,
+    rounds=14,
+    mutation_rate=0.3,
+    workers=None,
+    use_llm=False,
+    save=True,
+):
+    """レプリカ交換法: 温度の異なる複数の連鎖を並列に進め、定期的に状態を交換する
+
+    各レプリカは固定温度（min_temp〜max_temp の等比数列）で exchange_interval 回ずつ
+    メトロポリス法の連鎖を進め（突然変異は simulated_annealing と同じ mutate）、その後に隣り合う
+    温度のレプリカの状態をメトロポリス基準で交換する。これを rounds 回繰り返す。
+    高温のレプリカが見つけた局所最適の外の解が低温側へ降りてくるので、局所最適から抜け出しやすい。
+    workers はプロセス数（None ならCPUコア数、レプリカ数が上限、1以下なら逐次実行）。
+    """
+    temperatures = replica_temperatures(num_replicas, min_temp, max_temp)
+    workers = min(workers or os.cpu_count() or 1, num_replicas)
+
+    print("=" * 60)
+    print("レプリカ交換法（パラレルテンパリング）を開始します")
+    print(f"レプリカ数: {num_replicas}, 温度: " + ", ".join(f"{t:.2f}" for t in temperatures))
+    print(f"交換間隔: {exchange_interval}反復, ラウンド数: {rounds}, プロセス数: {workers}")
+    if use_llm:
+        print("LLM改善: 有効")
+    print("=" * 60)
+
+    # 各レプリカの初期状態（未評価なので適応度はNone）
+    states = [(code, None) for code in generate_codes(num_replicas)]
+    best_code, best_fitness = None, -float("inf")
+    swap_attempts = swap_accepted = 0
+
+    with create_evaluation_pool(workers) as executor:
+        collect_metrics = METRICS.enabled and executor is not None
+        for round_index in range(rounds):
+            seeds = [random.getrandbits(32) for _ in range(num_replicas)]
+            arguments = (
+                [code for code, _ in states],
+                [fitness for _, fitness in states],
+                temperatures,
+                [exchange_interval] * num_replicas,
+                seeds,
+                [mutation_rate] * num_replicas,
+                [collect_metrics] * num_replicas,
+            )
+            results = (
+                executor.map(_run_replica_chain, *arguments)
+                if executor
+                else map(_run_replica_chain, *arguments)
+            )
+
+            states = []
+            acceptance = []
+            for state, (chain_best_code, chain_best_fitness), accepted, snapshot in results:
+                states.append(state)
+                acceptance.append(accepted / exchange_interval if exchange_interval else 0.0)
+                if snapshot is not None:
+                    METRICS.merge(snapshot)
+                if chain_best_fitness > best_fitness:
+                    best_code, best_fitness = chain_best_code, chain_best_fitness
+
+            # 隣り合う温度のレプリカで状態を交換（偶数番目の対と奇数番目の対を交互に）
+            states, (attempts, accepted) = exchange_replicas(states, temperatures, round_index % 2)
+            swap_attempts += attempts
+            swap_accepted += accepted
+            METRICS.increment("replica_swaps_total", accepted)
+            METRICS.set_gauge("best_fitness", best_fitness, optimizer="pt")
+
+            replica_fitnesses = ", ".join(f"{fitness:.0f}" for _, fitness in states)
+            acceptance_rates = ", ".join(f"{rate:.2f}" for rate in acceptance)
+            print(
+                f"[ラウンド {round_index + 1}/{rounds}] 最良: {best_fitness:.2f}, "
+                f"各レプリカ: {replica_fitnesses}, 受理率: {acceptance_rates}, 交換: {accepted}/{attempts}"
+            )
+
+    best_individual = Individual(best_code)
+    best_individual.fitness = best_fitness
+
+    print("\n" + "=" * 60)
+    print(f"最適化完了！総反復回数: {rounds * exchange_interval * num_replicas}")
+    print(f"最良解の適応度（全レプリカ）: {best_fitness:.2f}")
+    if swap_attempts:
+        print(f"交換の受理率: {swap_accepted / swap_attempts * 100:.1f}% ({swap_accepted}/{swap_attempts})")
+    print(f"適応度キャッシュ（親プロセス）: {FITNESS_CACHE.summary()}")
     print("=" * 60)
     print("最良解のコード:")
     print("=" * 60)
@@ -1080,8 +4065,9 @@ def simulated_annealing(
         evaluate_code_with_llm(original_code, improved_code)
 
     # コードを保存
-    mode_name = "SA+LLM" if use_llm else "SA"
-    save_generated_code(best_individual.code, mode_name, best_individual.fitness)
+    if save:
+        mode_name = "PT+LLM" if use_llm else "PT"
+        save_generated_code(best_individual.code, mode_name, best_individual.fitness)
 
     return best_individual
 
@@ -1091,6 +4077,21 @@ def simulated_annealing(
 # ============================================================
 
 
+# 状態の各特徴量のカテゴリ数（関数数・クラス数・コード行数・適応度、extract_state を参照）
+STATE_DIMS = (5, 4, 6, 6)
+
+# Q学習の行動空間
+Q_ACTIONS = (
+    "add_function",
+    "remove_function",
+    "add_class",
+    "remove_class",
+    "modify_operator",
+    "mutate",
+    "no_action",
+)
+
+
 def extract_state(individual):
     """個体から状態を抽出（離散化された特徴量）"""
     # 関数数、クラス数、コード行数、適応度を離散化
@@ -1108,28 +4109,41 @@ def extract_state(individual):
     return (func_category, class_category, lines_category, fitness_category)
 
 
+@METRICS.timed("operator_seconds", operator="apply_action")
 def apply_action(individual, action):
     """行動を個体に適用して新しい個体を生成"""
     new_individual = Individual(individual.code)
 
     if action == "add_function":
         # 関数を追加
-        new_individual.code += "\n" + generate_random_function()
+        new_individual.append_gene(take_generated("function"))
     elif action == "remove_function":
         # 関数を削除
-        funcs = new_individual.extract_functions()
-        if funcs:
-            func_to_remove = random.choice(funcs)
-            new_individual.code = new_individual.code.replace(func_to_remove, "", 1)
+        genome = new_individual.genome
+        if genome is not None:
+            if genome.functions:
+                func_to_remove = random.choice(genome.functions)
+                new_individual.code = genome.remove(func_to_remove)
+        else:
+            funcs = new_individual.extract_functions()
+            if funcs:
+                func_to_remove = random.choice(funcs)
+                new_individual.code = new_individual.code.replace(func_to_remove, "", 1)
     elif action == "add_class":
         # クラスを追加
-        new_individual.code += "\n" + generate_random_class()
+        new_individual.append_gene(take_generated("class"))
     elif action == "remove_class":
         # クラスを削除
-        classes = new_individual.extract_classes()
-        if classes:
-            class_to_remove = random.choice(classes)
-            new_individual.code = new_individual.code.replace(class_to_remove, "", 1)
+        genome = new_individual.genome
+        if genome is not None:
+            if genome.classes:
+                class_to_remove = random.choice(genome.classes)
+                new_individual.code = genome.remove(class_to_remove)
+        else:
+            classes = new_individual.extract_classes()
+            if classes:
+                class_to_remove = random.choice(classes)
+                new_individual.code = new_individual.code.replace(class_to_remove, "", 1)
     elif action == "modify_operator":
         # 演算子をランダムに変更
         operators = ["+", "-", "*", "//", "%"]
@@ -1146,9 +4160,11 @@ def apply_action(individual, action):
     # "no_action"の場合は何もしない
 
     # 構文チェック: エラーがあれば元の個体を返す
+    METRICS.increment("actions_total", action=action)
     is_valid, error_msg = validate_code_syntax(new_individual.code)
     if not is_valid:
         # 構文エラーが発生した場合は元の個体を返す
+        METRICS.increment("action_syntax_rejections_total", action=action)
         return Individual(individual.code)
 
     return new_individual
@@ -1159,6 +4175,7 @@ class QTable:
 
     def __init__(self, actions, learning_rate=0.1, discount_factor=0.9):
         self.q_table = {}  # (state, action) -> Q値
+        self.visits = Counter()  # (state, action) -> 更新回数（保存時の統合に使う）
         self.actions = actions
         self.learning_rate = learning_rate  # 学習率 α
         self.discount_factor = discount_factor  # 割引率 γ
@@ -1179,6 +4196,7 @@ class QTable:
             reward + self.discount_factor * max_next_q - current_q
         )
         self.q_table[(state, action)] = new_q
+        self.visits[(state, action)] += 1
 
     def get_best_action(self, state):
         """状態における最良の行動を選択"""
@@ -1197,9 +4215,375 @@ class QTable:
             # 1-εの確率で最良行動を選択
             return self.get_best_action(state)
 
+    def stats(self):
+        """学習済み（更新された）Q値の数と平均値"""
+        if not self.q_table:
+            return 0, 0.0
+        return len(self.q_table), sum(self.q_table.values()) / len(self.q_table)
+
+
+class DenseQTable:
+    """NumPyの配列でQ値を保持するQ-table（QTable と同じインターフェース）
+
+    状態は extract_state の4つ組（各要素は STATE_DIMS の範囲）で、全ての状態と行動の
+    Q値を (状態数, 行動数) = (720, 7) の配列に持つ。状態は4つ組から行番号を計算するだけで
+    辞書の検索やリストの生成が無いので、1プロセスで多数のエージェントを動かしても軽い
+    （1エージェントあたり約40KB）。
+    q_values / best_actions / update_batch で複数の状態・遷移をまとめて扱える。
+    """
+
+    def __init__(self, actions, learning_rate=0.1, discount_factor=0.9, state_dims=STATE_DIMS):
+        if import_numpy() is None:
+            raise ImportError("DenseQTable には numpy が必要です（pip install 'try-jugemu[fast]'）")
+        self.actions = list(actions)
+        self.learning_rate = learning_rate  # 学習率 α
+        self.discount_factor = discount_factor  # 割引率 γ
+        self.state_dims = tuple(state_dims)
+        # 状態の4つ組 -> 行番号 の計算に使う各要素の重み（行優先）
+        self._strides = tuple(
+            math.prod(self.state_dims[index + 1:]) for index in range(len(self.state_dims))
+        )
+        self._action_index = {action: index for index, action in enumerate(self.actions)}
+        num_states = math.prod(self.state_dims)
+        self.values = np.zeros((num_states, len(self.actions)))  # Q値
+        self.visits = np.zeros((num_states, len(self.actions)), dtype=np.int64)  # 更新回数
+        # best_actions で同値の行動からランダムに選ぶための乱数（初回に random のシードから作るので再現でき、
+        # 使わない限り random の乱数列は QTable と同じになる）
+        self._rng = None
+
+    def state_index(self, state):
+        """状態の4つ組 -> 行番号"""
+        return sum(value * stride for value, stride in zip(state, self._strides))
+
+    def state_indices(self, states):
+        """状態の配列（n×4）-> 行番号の配列"""
+        return np.asarray(states, dtype=np.int64).reshape(-1, len(self.state_dims)) @ np.asarray(
+            self._strides, dtype=np.int64
+        )
+
+    # 1件ずつの操作は行動数（7）が小さく、NumPyの集約関数の呼び出しの方が遅いので
+    # 1行を tolist() で取り出して組み込みの max で処理する
+
+    def get_q_value(self, state, action):
+        """Q値を取得（未更新の場合は0）"""
+        return self.values.item(self.state_index(state), self._action_index[action])
+
+    def update_q_value(self, state, action, reward, next_state):
+        """Q値を更新（Q学習の更新式）"""
+        row = self.state_index(state)
+        column = self._action_index[action]
+        current_q = self.values.item(row, column)
+        max_next_q = max(self.values[self.state_index(next_state)].tolist())
+        # Q学習の更新式: Q(s,a) ← Q(s,a) + α[r + γ・max Q(s',a') - Q(s,a)]
+        self.values[row, column] = current_q + self.learning_rate * (
+            reward + self.discount_factor * max_next_q - current_q
+        )
+        self.visits[row, column] += 1
+
+    def get_best_action(self, state):
+        """状態における最良の行動を選択（同値の場合はランダム、乱数の使い方は QTable と同じ）"""
+        q_values = self.values[self.state_index(state)].tolist()
+        max_q = max(q_values)
+        best_actions = [action for action, q in zip(self.actions, q_values) if q == max_q]
+        return random.choice(best_actions)
 
-def q_learning(episodes=50, max_steps=20, use_llm=False):
-    """Q学習でコードを最適化"""
+    def choose_action(self, state, epsilon):
+        """ε-greedy方策で行動を選択"""
+        if random.random() < epsilon:
+            # εの確率でランダム探索
+            return random.choice(self.actions)
+        else:
+            # 1-εの確率で最良行動を選択
+            return self.get_best_action(state)
+
+    def q_values(self, states):
+        """複数の状態のQ値をまとめて取得（状態数×行動数の配列）"""
+        return self.values[self.state_indices(states)]
+
+    def best_actions(self, states):
+        """複数の状態の最良の行動をまとめて選択（同値の場合はランダム）"""
+        if self._rng is None:
+            self._rng = np.random.default_rng(random.getrandbits(64))
+        values = self.q_values(states)
+        is_best = values == values.max(axis=1, keepdims=True)
+        # 最大値の位置にだけ乱数を置き、その最大の位置を選ぶと同値の行動から一様に選ばれる
+        choices = np.argmax(self._rng.random(values.shape) * is_best, axis=1)
+        return [self.actions[index] for index in choices]
+
+    def update_batch(self, states, actions, rewards, next_states):
+        """複数の遷移でQ値をまとめて更新
+
+        全ての遷移は更新前のQ値から計算する（同じ状態・行動の遷移が複数ある場合は差分を合算）。
+        """
+        rows = self.state_indices(states)
+        columns = np.fromiter((self._action_index[action] for action in actions), dtype=np.int64)
+        max_next_q = self.values[self.state_indices(next_states)].max(axis=1)
+        current_q = self.values[rows, columns]
+        deltas = self.learning_rate * (
+            np.asarray(rewards, dtype=float) + self.discount_factor * max_next_q - current_q
+        )
+        np.add.at(self.values, (rows, columns), deltas)
+        np.add.at(self.visits, (rows, columns), 1)
+
+    def stats(self):
+        """学習済み（更新された）Q値の数と平均値"""
+        visited = self.visits > 0
+        count = int(visited.sum())
+        return count, float(self.values[visited].mean()) if count else 0.0
+
+
+# Q-tableの実装の選択肢（"auto": numpy があれば DenseQTable、無ければ QTable）
+Q_TABLE_BACKENDS = ("auto", "dense", "dict")
+
+
+def create_q_table(actions=Q_ACTIONS, learning_rate=0.1, discount_factor=0.9, backend="auto"):
+    """Q-tableを生成
+
+    backend が "dense" なら DenseQTable（numpy が無ければ ImportError）、"dict" なら辞書の QTable、
+    "auto" なら numpy があれば DenseQTable、無ければ QTable を使う。
+    """
+    if backend not in Q_TABLE_BACKENDS:
+        raise ValueError(f"不明なQ-tableの実装です: {backend}")
+    if backend == "dense" or (backend == "auto" and import_numpy() is not None):
+        table_class = DenseQTable
+    else:
+        table_class = QTable
+    return table_class(list(actions), learning_rate=learning_rate, discount_factor=discount_factor)
+
+
+def describe_q_table(q_table):
+    """Q-tableの実装を表示用の文字列で返す"""
+    if isinstance(q_table, DenseQTable):
+        return "DenseQTable（numpy の配列）"
+    if import_numpy() is None:
+        return "QTable（辞書、numpy が無いため）"
+    return "QTable（辞書）"
+
+
+# ============================================================
+# Q-tableの保存・読み込み（実行をまたいだウォームスタート）
+# ============================================================
+
+# Q-tableファイルの先頭の識別子
+# 形式: 識別子(8バイト) + ヘッダー長(4バイト) + ヘッダー(JSON、8バイト境界まで空白で埋める)
+#       + Q値(float64 × 状態数 × 行動数、行優先) + 更新回数(int64 × 同数)、いずれもリトルエンディアン
+Q_TABLE_MAGIC = b"JGQTBL01"
+
+
+def _q_table_arrays(q_table):
+    """Q-tableの全てのQ値と更新回数を、行優先の平らな配列（array('d') / array('q')）で返す"""
+    if isinstance(q_table, DenseQTable):
+        return array("d", q_table.values.ravel().tolist()), array("q", q_table.visits.ravel().tolist())
+    strides = [math.prod(STATE_DIMS[index + 1:]) for index in range(len(STATE_DIMS))]
+    action_index = {action: index for index, action in enumerate(q_table.actions)}
+    size = math.prod(STATE_DIMS) * len(q_table.actions)
+    values = array("d", bytes(8 * size))
+    visits = array("q", bytes(8 * size))
+    for (state, action), value in q_table.q_table.items():
+        offset = sum(v * stride for v, stride in zip(state, strides)) * len(q_table.actions)
+        values[offset + action_index[action]] = value
+        visits[offset + action_index[action]] = q_table.visits[(state, action)]
+    return values, visits
+
+
+def _set_q_table_arrays(q_table, values, visits):
+    """平らな配列のQ値と更新回数を Q-table に設定"""
+    if isinstance(q_table, DenseQTable):
+        # 読み込んだ配列をそのまま使う（_read_q_table_file の numpy の配列ならコピーしない）
+        q_table.values = np.asarray(values, dtype=np.float64).reshape(q_table.values.shape)
+        q_table.visits = np.asarray(visits, dtype=np.int64).reshape(q_table.visits.shape)
+        return
+    q_table.q_table.clear()
+    q_table.visits.clear()
+    num_actions = len(q_table.actions)
+    states = itertools.product(*(range(size) for size in STATE_DIMS))
+    for state_offset, state in enumerate(states):
+        for action_offset, action in enumerate(q_table.actions):
+            index = state_offset * num_actions + action_offset
+            if visits[index]:
+                q_table.q_table[(state, action)] = values[index]
+                q_table.visits[(state, action)] = visits[index]
+
+
+def _read_q_table_file(path, actions):
+    """Q-tableファイルを読み込み (Q値, 更新回数) を返す（numpy があれば numpy の配列に直接読み込む）"""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped[:8] != Q_TABLE_MAGIC:
+                raise ValueError(f"Q-tableファイルではありません: {path}")
+            (header_length,) = struct.unpack_from("<I", mapped, 8)
+            header = json.loads(mapped[12:12 + header_length])
+            if header["actions"] != list(actions) or header["state_dims"] != list(STATE_DIMS):
+                raise ValueError(f"行動空間または状態空間が一致しません: {path}")
+            size = math.prod(STATE_DIMS) * len(actions)
+            offset = 12 + header_length
+            if len(mapped) < offset + 16 * size:
+                raise ValueError(f"Q-tableファイルが途中で切れています: {path}")
+            if import_numpy() is not None:
+                # 表は全体を使うので、メモリマップを経由せずファイルから1回で読み込む
+                values = np.fromfile(f, dtype="<f8", count=size, offset=offset)
+                visits = np.fromfile(f, dtype="<i8", count=size)
+                return values, visits
+            values = array("d", mapped[offset:offset + 8 * size])
+            visits = array("q", mapped[offset + 8 * size:offset + 16 * size])
+            if sys.byteorder != "little":
+                values.byteswap()
+                visits.byteswap()
+            return values, visits
+
+
+def _write_q_table_file(path, actions, values, visits):
+    """Q-tableファイルを一時ファイルに書いてから置き換える（読み込み中のプロセスが壊れたファイルを見ない）"""
+    header = json.dumps({"actions": list(actions), "state_dims": list(STATE_DIMS)}).encode("utf-8")
+    header += b" " * (-(12 + len(header)) % 8)
+    values = array("d", values)
+    visits = array("q", visits)
+    if sys.byteorder != "little":
+        values.byteswap()
+        visits.byteswap()
+    temporary_path = Path(f"{path}.{os.getpid()}.tmp")
+    with open(temporary_path, "wb") as f:
+        f.write(Q_TABLE_MAGIC + struct.pack("<I", len(header)) + header)
+        values.tofile(f)
+        visits.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+@contextlib.contextmanager
+def _q_table_file_lock(path):
+    """Q-tableファイルの排他ロック（fcntl が使えない環境ではロックしない）"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_q_table(path, actions=Q_ACTIONS, learning_rate=0.1, discount_factor=0.9, backend="auto"):
+    """保存されたQ-tableを読み込む（ファイルが無ければ新しいQ-tableを返す）
+
+    読み込んだ時点のQ値と更新回数を覚えておき、save_q_table ではこの実行で学習した差分だけを統合する。
+    backend は create_q_table と同じ。
+    """
+    q_table = create_q_table(actions, learning_rate=learning_rate, discount_factor=discount_factor, backend=backend)
+    if Path(path).exists():
+        with _q_table_file_lock(path):
+            values, visits = _read_q_table_file(path, q_table.actions)
+        _set_q_table_arrays(q_table, values, visits)
+    q_table.loaded_arrays = _q_table_arrays(q_table)
+    return q_table
+
+
+def save_q_table(q_table, path):
+    """Q-tableを保存（既存のファイルには、この実行で学習した差分を更新回数で重み付けして統合）
+
+    ロックを取ってから最新のファイルを読み、読み込み時（load_q_table）からの差分を加える:
+      - この実行で更新されなかったQ値: ファイルの値をそのまま残す
+      - この実行だけが更新したQ値: この実行の値（ファイルが読み込み時から変わっていなければ結果も同じ）
+      - 並行して別の実行も更新したQ値: 両方の値を、読み込み後のそれぞれの更新回数で重み付けした平均
+    更新回数は読み込み後の増分を加算する。書き込みは一時ファイルからの置き換えで行う。
+    """
+    values, visits = _q_table_arrays(q_table)
+    base_values, base_visits = getattr(q_table, "loaded_arrays", None) or (
+        array("d", bytes(8 * len(values))),
+        array("q", bytes(8 * len(values))),
+    )
+    with _q_table_file_lock(path):
+        if Path(path).exists():
+            file_values, file_visits = _read_q_table_file(path, q_table.actions)
+            merged_values = array("d", file_values)
+            merged_visits = array("q", file_visits)
+            for index in range(len(values)):
+                own_visits = visits[index] - base_visits[index]
+                if own_visits <= 0:
+                    continue
+                other_visits = merged_visits[index] - base_visits[index]
+                if other_visits <= 0:
+                    merged_values[index] = values[index]
+                else:
+                    merged_values[index] = (
+                        merged_values[index] * other_visits + values[index] * own_visits
+                    ) / (other_visits + own_visits)
+                merged_visits[index] += own_visits
+        else:
+            merged_values, merged_visits = values, visits
+        _write_q_table_file(path, q_table.actions, merged_values, merged_visits)
+    # 保存した内容を次の保存の基準にする（同じQ-tableを続けて保存しても二重に加算しない）
+    q_table.loaded_arrays = (array("d", merged_values), array("q", merged_visits))
+    return path
+
+
+def prepare_q_table(
+    q_table_path,
+    epsilon_start,
+    warm_epsilon=None,
+    learning_rate=0.1,
+    discount_factor=0.9,
+    backend="auto",
+    epsilon_end=0.0,
+):
+    """Q学習で使う Q-table と初期探索率を用意
+
+    q_table_path が既存のファイルならその Q値 から学習を再開し、warm_epsilon が指定されていれば
+    初期探索率をそれに置き換える（学習済みの Q値 を活かすため、最初から探索し直さない）。
+    warm_epsilon が最終探索率 epsilon_end より小さい場合は ValueError を送出する（探索率は
+    epsilon_end より下がらないので、指定した値では探索されない）。
+    backend は create_q_table と同じで、選ばれた実装を表示する。
+    """
+    if warm_epsilon is not None and warm_epsilon < epsilon_end:
+        raise ValueError(
+            f"warm_epsilon ({warm_epsilon}) は epsilon_end ({epsilon_end}) 以上を指定してください"
+        )
+    if q_table_path is None:
+        q_table = create_q_table(
+            Q_ACTIONS, learning_rate=learning_rate, discount_factor=discount_factor, backend=backend
+        )
+        print(f"Q-table: {describe_q_table(q_table)}")
+        return q_table, epsilon_start
+    warm_start = Path(q_table_path).exists()
+    q_table = load_q_table(
+        q_table_path, Q_ACTIONS, learning_rate=learning_rate, discount_factor=discount_factor, backend=backend
+    )
+    print(f"Q-table: {describe_q_table(q_table)}")
+    if warm_start:
+        if warm_epsilon is not None:
+            epsilon_start = warm_epsilon
+        num_q, avg_q = q_table.stats()
+        print(f"Q-tableを読み込みました: {q_table_path} (学習済みQ値数: {num_q}, 平均Q値: {avg_q:.2f}, 初期探索率ε: {epsilon_start:.3f})")
+    return q_table, epsilon_start
+
+
+@METRICS.timed("optimizer_seconds", optimizer="ql")
+@uses_gene_pool
+def q_learning(
+    episodes=50,
+    max_steps=20,
+    use_llm=False,
+    learning_rate=0.1,
+    discount_factor=0.9,
+    epsilon_start=1.0,
+    epsilon_end=0.1,
+    save=True,
+    q_table_path=None,
+    warm_epsilon=None,
+    q_table_backend="auto",
+    patience=None,
+    min_delta=0.0,
+    target_fitness=None,
+):
+    """Q学習でコードを最適化（save=False の場合は最良個体を保存しない）
+
+    q_table_path を指定すると、そのファイルの Q値 から学習を再開し、終了時に学習結果を統合して保存する
+    （prepare_q_table / save_q_table を参照）。
+    q_table_backend は Q-table の実装（create_q_table を参照、"dense" は numpy が必要）。
+    patience / min_delta / target_fitness はエピソード単位の早期終了の条件（EarlyStopping を参照）。
+    """
     print("=" * 60)
     print("Q学習を開始します")
     print(f"エピソード数: {episodes}, 最大ステップ数: {max_steps}")
@@ -1207,28 +4591,24 @@ def q_learning(episodes=50, max_steps=20, use_llm=False):
         print("LLM改善: 有効")
     print("=" * 60)
 
-    # 行動空間の定義
-    actions = [
-        "add_function",
-        "remove_function",
-        "add_class",
-        "remove_class",
-        "modify_operator",
-        "mutate",
-        "no_action",
-    ]
-
-    # Q-tableの初期化
-    q_table = QTable(actions, learning_rate=0.1, discount_factor=0.9)
+    # Q-tableの初期化（行動空間は Q_ACTIONS、ファイルがあればウォームスタート）
+    q_table, epsilon_start = prepare_q_table(
+        q_table_path,
+        epsilon_start,
+        warm_epsilon,
+        learning_rate=learning_rate,
+        discount_factor=discount_factor,
+        backend=q_table_backend,
+        epsilon_end=epsilon_end,
+    )
 
     # 最良個体を記録
     best_individual = None
     best_fitness = -float("inf")
 
-    # ε-greedy用のパラメータ
-    epsilon_start = 1.0  # 初期探索率
-    epsilon_end = 0.1  # 最終探索率
+    # ε-greedy用のパラメータ（探索率を epsilon_start から epsilon_end まで線形に下げる）
     epsilon_decay = (epsilon_start - epsilon_end) / episodes
+    stopping = EarlyStopping(patience, min_delta, target_fitness)
 
     # 各エピソードで学習
     for episode in range(episodes):
@@ -1272,6 +4652,7 @@ def q_learning(episodes=50, max_steps=20, use_llm=False):
                 best_fitness = next_individual.fitness
                 best_individual = Individual(next_individual.code)
                 best_individual.fitness = best_fitness
+                METRICS.set_gauge("best_fitness", best_fitness, optimizer="ql")
                 print(
                     f"  [ステップ {step + 1}] 🌟 最良個体更新! 行動: {action}, 適応度: {best_fitness:.2f}"
                 )
@@ -1286,16 +4667,21 @@ def q_learning(episodes=50, max_steps=20, use_llm=False):
 
         # 10エピソードごとに学習済みQ値の統計を表示
         if (episode + 1) % 10 == 0:
-            avg_q = (
-                sum(q_table.q_table.values()) / len(q_table.q_table)
-                if q_table.q_table
-                else 0.0
-            )
-            print(f"  学習済みQ値数: {len(q_table.q_table)}, 平均Q値: {avg_q:.2f}")
+            num_q, avg_q = q_table.stats()
+            print(f"  学習済みQ値数: {num_q}, 平均Q値: {avg_q:.2f}")
+
+        if stopping.update(best_fitness):
+            break
+
+    stopping.report("ql", "エピソード")
+    if q_table_path is not None:
+        save_q_table(q_table, q_table_path)
+        print(f"Q-tableを保存しました: {q_table_path}")
 
     print("\n" + "=" * 60)
     print("Q学習完了！")
     print(f"最良個体の適応度: {best_fitness:.2f}")
+    print(f"適応度キャッシュ: {FITNESS_CACHE.summary()}")
     print("=" * 60)
     print("最良個体のコード:")
     print("=" * 60)
@@ -1311,8 +4697,9 @@ def q_learning(episodes=50, max_steps=20, use_llm=False):
         evaluate_code_with_llm(original_code, improved_code)
 
     # コードを保存
-    mode_name = "Q-Learning+LLM" if use_llm else "Q-Learning"
-    save_generated_code(best_individual.code, mode_name, best_fitness)
+    if save:
+        mode_name = "Q-Learning+LLM" if use_llm else "Q-Learning"
+        save_generated_code(best_individual.code, mode_name, best_fitness)
 
     return best_individual
 
@@ -1322,111 +4709,396 @@ def q_learning(episodes=50, max_steps=20, use_llm=False):
 # ============================================================
 
 
-def save_generated_code(code, mode_name, fitness=None):
-    """生成されたコードをファイルに保存"""
-    # タイムスタンプ付きのファイル名を生成
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"code_{mode_name}_{timestamp}.py"
-    filepath = GENERATED_CODES_DIR / filename
+# 保存したコードの索引（SQLite）のファイル名（GENERATED_CODES_DIR に置く）
+CODE_INDEX_FILENAME = "index.sqlite3"
+
+# 保存したコードの本体（内容のSHA-256ごとに1つ、gzipで圧縮）を置くディレクトリ名（GENERATED_CODES_DIR の下）
+CODE_BLOBS_DIRNAME = "blobs"
+
+# 索引の表の形式のバージョン（PRAGMA user_version、表の形式を変えたら上げて _migrate で移行する）
+# 1: 本体を圧縮したブロブに置き、保存ごとの記録（runs）はブロブのハッシュを参照する
+CODE_INDEX_VERSION = 1
+
+# 索引の表と索引（CODE_INDEX_VERSION の形式、CodeIndex._migrate で1文ずつ実行する）
+_CODE_INDEX_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS blobs (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        stored_size INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        mode TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        fitness REAL,
+        size INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        filename TEXT UNIQUE  -- 以前の形式の .py ファイル（ブロブに保存したものは NULL）
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS runs_created_at ON runs (created_at)",
+    "CREATE INDEX IF NOT EXISTS runs_fitness ON runs (fitness)",
+    "CREATE INDEX IF NOT EXISTS runs_mode ON runs (mode, created_at)",
+    "CREATE INDEX IF NOT EXISTS runs_sha256 ON runs (sha256)",
+)
+
+# 保存したコードの一覧の並び順（list_saved_codes の sort）
+SAVED_CODE_ORDERS = {
+    "date": "created_at DESC, id DESC",  # 新しい順
+    "fitness": "fitness IS NULL, fitness DESC, created_at DESC",  # 適応度の高い順（適応度が無いものは最後）
+}
+
+
+def _parse_saved_code_header(filepath):
+    """保存されたファイルの先頭のメタデータ（モード・生成日時・適応度）だけを読み取る"""
+    mode_name, timestamp, fitness = None, None, None
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break  # メタデータの後の空行
+            if line.startswith("# モード:"):
+                mode_name = line.split(":", 1)[1].strip()
+            elif line.startswith("# 生成日時:"):
+                timestamp = line.split(":", 1)[1].strip()
+            elif line.startswith("# 適応度:"):
+                with contextlib.suppress(ValueError):
+                    fitness = float(line.split(":", 1)[1])
+    return mode_name, timestamp, fitness
 
-    # メタデータをコメントとして追加
+
+def format_saved_code(code, mode_name, created_at, fitness=None):
+    """メタデータのコメントを先頭に付けたコード（.py ファイルの内容）"""
     metadata = f"""# 生成コードメタデータ
 # モード: {mode_name}
-# 生成日時: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+# 生成日時: {created_at}
 """
     if fitness is not None:
         metadata += f"# 適応度: {fitness:.2f}\n"
     metadata += "# " + "=" * 58 + "\n\n"
+    return metadata + code
+
+
+class CodeIndex:
+    """保存したコードの格納先と、そのメタデータ（モード・生成日時・適応度・サイズ・ハッシュ）の索引
+
+    コードの本体は内容のSHA-256をファイル名にしたブロブ（blobs/<先頭2文字>/<ハッシュ>.py.gz）に1回だけ
+    圧縮して保存し、保存ごとの記録（runs の行）はそのハッシュを参照する。同じコードを何度保存しても
+    本体は1つで、ファイル名の衝突も無いので、並列に実行したジョブが同時に保存しても安全。
+    一覧の表示や並べ替え・絞り込みは索引だけで行い、コードを開く必要がない。
+
+    以前のバージョンで保存した code_*.py ファイルは、sync() で記録を取り込む（ファイルはそのまま使う）。
+    削除されたファイルの記録は取り除く（ファイル名の一覧だけを比べる）。
+    """
+
+    def __init__(self, directory=GENERATED_CODES_DIR):
+        self.directory = Path(directory)
+        self.path = self.directory / CODE_INDEX_FILENAME
+        self.blobs_directory = self.directory / CODE_BLOBS_DIRNAME
+        self._connection = None
+        self._synced = False
+
+    @property
+    def connection(self):
+        """SQLiteへの接続（初回の呼び出しで作成し、表が無ければ作る）"""
+        if self._connection is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30.0)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA journal_mode=WAL")  # 読み込み中も別のプロセスが書き込める
+            self._migrate()
+        return self._connection
+
+    def _migrate(self):
+        """表が無ければ作り、PRAGMA user_version を CODE_INDEX_VERSION にする
+
+        executescript は実行前にトランザクションを確定して BEGIN IMMEDIATE のロックを外してしまうので、
+        文は1つずつ execute で実行し、全体を1回だけ確定する。
+        """
+        connection = self._connection
+        if connection.execute("PRAGMA user_version").fetchone()[0] >= CODE_INDEX_VERSION:
+            return  # 作成済みなら書き込みのロックを取らない
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")  # 複数のプロセスが同時に移行しない
+            # ロックを待つ間に別のプロセスが表を作っていれば何もしない
+            if connection.execute("PRAGMA user_version").fetchone()[0] >= CODE_INDEX_VERSION:
+                return
+            for statement in _CODE_INDEX_SCHEMA:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {CODE_INDEX_VERSION}")
+
+    def blob_path(self, sha256):
+        """ハッシュに対応するブロブのパス"""
+        return self.blobs_directory / sha256[:2] / f"{sha256}.py.gz"
+
+    def _store_blob(self, code_bytes):
+        """コードをブロブとして保存し (ハッシュ, 新しく保存したか) を返す（既にあれば書かない）"""
+        sha256 = hashlib.sha256(code_bytes).hexdigest()
+        path = self.blob_path(sha256)
+        if path.exists():
+            return sha256, False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = gzip.compress(code_bytes, mtime=0)
+        temporary_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temporary_path.write_bytes(compressed)
+        os.replace(temporary_path, path)  # 同時に同じ内容を書いても、どちらかの完全なファイルが残る
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, size, stored_size) VALUES (?, ?, ?)",
+                (sha256, len(code_bytes), len(compressed)),
+            )
+        return sha256, True
+
+    def save(self, code, mode_name, created_at, fitness=None):
+        """コードを保存して記録を追加し、(記録の行, 新しくブロブを保存したか) を返す"""
+        code_bytes = code.encode("utf-8")
+        sha256, stored = self._store_blob(code_bytes)
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (mode, created_at, fitness, size, sha256) VALUES (?, ?, ?, ?, ?)",
+                (mode_name, created_at, fitness, len(code_bytes), sha256),
+            )
+        return self.get(cursor.lastrowid), stored
+
+    def add_file(self, filename, mode_name, created_at, fitness, code_bytes):
+        """以前の形式の .py ファイルの記録を追加（同じファイル名の記録は置き換える）"""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO runs (mode, created_at, fitness, size, sha256, filename)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (mode_name, created_at, fitness, len(code_bytes), hashlib.sha256(code_bytes).hexdigest(), filename),
+            )
 
-    # コードを保存
-    full_content = metadata + code
+    def read(self, row):
+        """記録のコード（メタデータを除いたもの）を読み込む"""
+        if row["filename"] is not None:
+            return read_saved_code(self.directory / row["filename"])
+        with open(self.blob_path(row["sha256"]), "rb") as f:
+            return gzip.decompress(f.read()).decode("utf-8")
+
+    def get(self, run_id):
+        """IDの記録（無ければ None）"""
+        return self.connection.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+
+    def find(self, key):
+        """ID またはハッシュの先頭（4文字以上）で記録を探す（ハッシュの場合は最新の記録）"""
+        if not self.directory.exists():
+            return None
+        if str(key).isdigit():
+            row = self.get(int(key))
+            if row is not None:
+                return row
+        if len(str(key)) >= 4:
+            return self.connection.execute(
+                "SELECT * FROM runs WHERE sha256 LIKE ? ORDER BY created_at DESC, id DESC LIMIT 1", (f"{key}%",)
+            ).fetchone()
+        return None
 
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(full_content)
+    def sync(self):
+        """ディレクトリの code_*.py と索引を比べ、索引に無いファイルを取り込み、無くなったファイルの記録を削除
+
+        プロセスごとに最初の1回だけ行う。取り込むファイル以外は開かない。
+        """
+        if self._synced:
+            return
+        self._synced = True
+        if not self.directory.exists():
+            return
+        on_disk = {
+            entry.name
+            for entry in os.scandir(self.directory)
+            if entry.name.startswith("code_") and entry.name.endswith(".py")
+        }
+        indexed = {
+            row[0] for row in self.connection.execute("SELECT filename FROM runs WHERE filename IS NOT NULL")
+        }
+        missing = sorted(on_disk - indexed)
+        if missing:
+            print(f"保存されたコードを索引に取り込んでいます（{len(missing)}件）...")
+        for filename in missing:
+            filepath = self.directory / filename
+            mode_name, timestamp, fitness = _parse_saved_code_header(filepath)
+            if timestamp is None:
+                timestamp = datetime.fromtimestamp(filepath.stat().st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+            self.add_file(filename, mode_name or "不明", timestamp, fitness, read_saved_code(filepath).encode("utf-8"))
+        removed = indexed - on_disk
+        if removed:
+            with self.connection:
+                self.connection.executemany("DELETE FROM runs WHERE filename = ?", [(name,) for name in removed])
+
+    def query(self, mode=None, sort="date", limit=20, offset=0):
+        """条件に合う記録を返す（mode で絞り込み、sort の順に offset 件目から limit 件）"""
+        if not self.directory.exists():
+            return []  # まだ何も保存していない（読むだけでディレクトリを作らない）
+        self.sync()
+        where, params = ("WHERE mode = ?", [mode]) if mode else ("", [])
+        return self.connection.execute(
+            f"SELECT * FROM runs {where} ORDER BY {SAVED_CODE_ORDERS[sort]} LIMIT ? OFFSET ?",
+            [*params, limit, offset],
+        ).fetchall()
+
+    def count(self, mode=None):
+        """条件に合う記録の件数"""
+        if not self.directory.exists():
+            return 0
+        self.sync()
+        if mode:
+            return self.connection.execute("SELECT COUNT(*) FROM runs WHERE mode = ?", (mode,)).fetchone()[0]
+        return self.connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def modes(self):
+        """モードごとの件数 [(モード, 件数), ...]"""
+        if not self.directory.exists():
+            return []
+        self.sync()
+        return self.connection.execute(
+            "SELECT mode, COUNT(*) FROM runs GROUP BY mode ORDER BY COUNT(*) DESC"
+        ).fetchall()
+
+    def storage_stats(self):
+        """(記録の数, ブロブの数, コードの合計サイズ, ブロブの合計サイズ)（ブロブに保存した記録のみ）"""
+        runs, total_size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM runs WHERE filename IS NULL"
+        ).fetchone()
+        blobs, stored_size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(stored_size), 0) FROM blobs"
+        ).fetchone()
+        return runs, blobs, total_size, stored_size
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+# 保存したコードの索引（最初に使うときに接続する）
+CODE_INDEX = CodeIndex()
+
+
+def save_generated_code(code, mode_name, fitness=None):
+    """生成されたコードを保存（内容ごとに1つの圧縮ブロブと、保存ごとの記録）し、記録のIDを返す"""
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    row, stored = CODE_INDEX.save(code, mode_name, created_at, fitness)
 
     print("\n" + "=" * 60)
     print("💾 生成されたコードを保存しました")
     print("=" * 60)
-    print(f"保存先: {filepath}")
+    print(f"ID: {row['id']}（ハッシュ: {row['sha256'][:12]}）")
+    if stored:
+        print(f"保存先: {CODE_INDEX.blob_path(row['sha256'])}")
+    else:
+        print("同じ内容のコードが保存済みのため、記録だけを追加しました")
     print("=" * 60)
 
-    return filepath
+    return row["id"]
 
 
-def list_saved_codes():
-    """保存されたコードの一覧を表示"""
-    code_files = sorted(GENERATED_CODES_DIR.glob("code_*.py"), key=lambda p: p.stat().st_mtime, reverse=True)
+def list_saved_codes(mode=None, sort="date", limit=20, offset=0):
+    """保存されたコードの一覧を表示（索引から読むので、コードは開かない）
 
-    if not code_files:
+    mode で絞り込み、sort（"date": 新しい順 / "fitness": 適応度の高い順）に並べた offset 件目から
+    limit 件を表示して、その記録のリストを返す。番号は並び順の通し番号（offset + 1 から）。
+    """
+    total = CODE_INDEX.count(mode)
+    if not total:
         print("\n保存されたコードはありません。")
         return []
+    rows = CODE_INDEX.query(mode, sort, limit=limit, offset=offset)
 
     print("\n" + "=" * 60)
     print("💾 保存されたコード一覧")
+    if mode:
+        print(f"モード: {mode}")
+    print(f"{offset + 1}-{offset + len(rows)}件目 / 全{total}件（{'適応度順' if sort == 'fitness' else '新しい順'}）")
     print("=" * 60)
 
-    for i, filepath in enumerate(code_files, 1):
-        # ファイルからメタデータを読み取る
-        with open(filepath, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-        # メタデータを抽出
-        mode_name = "不明"
-        timestamp = "不明"
-        fitness = "N/A"
-
-        for line in lines:
-            if line.startswith("# モード:"):
-                mode_name = line.split(":", 1)[1].strip()
-            elif line.startswith("# 生成日時:"):
-                timestamp = line.split(":", 1)[1].strip()
-            elif line.startswith("# 適応度:"):
-                fitness = line.split(":", 1)[1].strip()
-
-        print(f"{i}. {filepath.name}")
-        print(f"   モード: {mode_name}")
-        print(f"   生成日時: {timestamp}")
+    for i, row in enumerate(rows, offset + 1):
+        fitness = f"{row['fitness']:.2f}" if row["fitness"] is not None else "N/A"
+        print(f"{i}. ID {row['id']}" + (f"（{row['filename']}）" if row["filename"] else ""))
+        print(f"   モード: {row['mode']}")
+        print(f"   生成日時: {row['created_at']}")
         print(f"   適応度: {fitness}")
+        print(f"   サイズ: {row['size']}バイト, ハッシュ: {row['sha256'][:12]}")
         print()
 
     print("=" * 60)
-    return code_files
+    return rows
+
+
+def saved_code_entry(index, mode=None, sort="date"):
+    """一覧の index 番目（1から）の記録（無ければ None）"""
+    if index < 1:
+        return None
+    rows = CODE_INDEX.query(mode, sort, limit=1, offset=index - 1)
+    return rows[0] if rows else None
+
+
+def export_saved_code(key, output=None):
+    """保存したコード（ID またはハッシュの先頭で指定）を、メタデータ付きの実行できる .py ファイルに書き出す
+
+    output を省略した場合は、カレントディレクトリに code_<モード>_<ID>.py として書き出す。
+    書き出したパスを返す（見つからなければ None）。
+    """
+    row = CODE_INDEX.find(key)
+    if row is None:
+        return None
+    code = CODE_INDEX.read(row)
+    output = Path(output) if output is not None else Path(f"code_{row['mode']}_{row['id']}.py")
+    output.write_text(format_saved_code(code, row["mode"], row["created_at"], row["fitness"]), encoding="utf-8")
+    return output
+
 
+def read_saved_code(filepath):
+    """保存されたファイルからメタデータ部分を除いたコードを読み込む"""
+    with open(filepath, "r", encoding="utf-8") as f:
+        full_content = f.read()
+
+    # メタデータ部分を除去（最初の空行までをスキップ）
+    lines = full_content.split("\n")
+    code_start = 0
+    for i, line in enumerate(lines):
+        if not line.startswith("#") and line.strip() == "":
+            code_start = i + 1
+            break
 
-def load_saved_code():
-    """保存されたコードをロードして返す"""
-    code_files = list_saved_codes()
+    return "\n".join(lines[code_start:])
 
-    if not code_files:
+
+def load_saved_code(page_size=20):
+    """保存されたコードをロードして返す（一覧は page_size 件ずつ表示し、n / p でページを移動）"""
+    offset = 0
+    entries = list_saved_codes(limit=page_size, offset=offset)
+
+    if not entries:
         return None
 
     try:
-        choice = input("\nロードするコードの番号を入力してください (0: キャンセル): ")
+        total = CODE_INDEX.count()
+        while True:
+            choice = input("\nロードするコードの番号を入力してください (0: キャンセル, n: 次のページ, p: 前のページ): ")
+            if choice.strip().lower() in ("n", "p"):
+                step = page_size if choice.strip().lower() == "n" else -page_size
+                if 0 <= offset + step < total:
+                    offset += step
+                    list_saved_codes(limit=page_size, offset=offset)
+                else:
+                    print("これ以上ページはありません。")
+                continue
+            break
         choice_num = int(choice)
 
         if choice_num == 0:
             print("キャンセルしました。")
             return None
 
-        if 1 <= choice_num <= len(code_files):
-            selected_file = code_files[choice_num - 1]
-
-            # ファイルを読み込む
-            with open(selected_file, "r", encoding="utf-8") as f:
-                full_content = f.read()
-
-            # メタデータ部分を除去（最初の空行までをスキップ）
-            lines = full_content.split("\n")
-            code_start = 0
-            for i, line in enumerate(lines):
-                if not line.startswith("#") and line.strip() == "":
-                    code_start = i + 1
-                    break
-
-            code = "\n".join(lines[code_start:])
+        selected = saved_code_entry(choice_num)
+        if selected is not None:
+            code = CODE_INDEX.read(selected)
 
             print("\n" + "=" * 60)
-            print(f"✅ コードをロードしました: {selected_file.name}")
+            print(f"✅ コードをロードしました: ID {selected['id']}")
             print("=" * 60)
 
             return code
@@ -1447,8 +5119,45 @@ def load_saved_code():
 # ============================================================
 
 
-def hybrid_optimization(use_llm=False):
-    """ハイブリッド最適化: 遺伝的アルゴリズム → シミュレーテッドアニーリング → Q学習"""
+@METRICS.timed("optimizer_seconds", optimizer="hybrid")
+@uses_gene_pool
+def hybrid_optimization(
+    use_llm=False,
+    workers=1,
+    population_size=10,
+    generations=5,
+    mutation_rate=0.2,
+    elite_size=2,
+    tournament_size=3,
+    initial_temp=100.0,
+    cooling_rate=0.95,
+    min_temp=0.1,
+    sa_mutation_rate=0.3,
+    episodes=30,
+    max_steps=15,
+    learning_rate=0.1,
+    discount_factor=0.9,
+    epsilon_start=0.5,
+    epsilon_end=0.1,
+    save=True,
+    q_table_path=None,
+    warm_epsilon=None,
+    q_table_backend="auto",
+    ga_patience=None,
+    sa_patience=None,
+    ql_patience=None,
+    min_delta=0.0,
+    target_fitness=None,
+    min_diversity=None,
+):
+    """ハイブリッド最適化: 遺伝的アルゴリズム → シミュレーテッドアニーリング → Q学習
+
+    各フェーズのパラメータは単独の genetic_algorithm / simulated_annealing / q_learning と同じ意味。
+    Q学習は既に良い解から始めるので、単独の場合より短く、探索率も低めにしている。
+    q_table_path / warm_epsilon / q_table_backend は q_learning と同じ（Q学習フェーズの Q-table）。
+    早期終了はフェーズごとに判定し、patience はフェーズごとの単位（世代・反復・エピソード）で指定する。
+    min_delta / target_fitness は全フェーズ、min_diversity はGAフェーズで使う。
+    """
     print("=" * 60)
     print("ハイブリッド最適化を開始します")
     print("手法: 遺伝的アルゴリズム → シミュレーテッドアニーリング → Q学習")
@@ -1457,50 +5166,50 @@ def hybrid_optimization(use_llm=False):
     print("=" * 60)
 
     # フェーズ1: 遺伝的アルゴリズム（大域的探索）
+    METRICS.begin_phase("hybrid_ga")
     print("\n" + "🧬 " * 30)
     print("【フェーズ1: 遺伝的アルゴリズム】")
     print("目的: 多様なコード構造を生成し、大域的に探索")
     print("🧬 " * 30)
 
     # 初期個体群を生成
-    population_size = 10
-    generations = 5
-    population = [Individual() for _ in range(population_size)]
+    population = [Individual(code) for code in generate_codes(population_size)]
+    ga_stopping = EarlyStopping(ga_patience, min_delta, target_fitness, min_diversity)
 
-    # 各世代で進化
-    for generation in range(generations):
-        print(f"\n【GA 第{generation + 1}/{generations}世代】")
+    # 各世代で進化（並列評価用のプールは全世代で使い回す）
+    with create_evaluation_pool(workers) as executor:
+        for generation in range(generations):
+            print(f"\n【GA 第{generation + 1}/{generations}世代】")
 
-        # 適応度を評価
-        for individual in population:
-            individual.evaluate_fitness()
+            # 適応度を評価
+            evaluate_population(population, executor)
 
-        # 適応度でソート
-        population.sort(key=lambda ind: ind.fitness, reverse=True)
+            # 適応度でソート
+            population.sort(key=lambda ind: ind.fitness, reverse=True)
 
-        # 統計を表示
-        best_fitness = population[0].fitness
-        avg_fitness = sum(ind.fitness for ind in population) / len(population)
-        print(f"  最高適応度: {best_fitness:.2f}, 平均適応度: {avg_fitness:.2f}")
+            # 統計を表示
+            best_fitness = population[0].fitness
+            avg_fitness = sum(ind.fitness for ind in population) / len(population)
+            METRICS.set_gauge("best_fitness", best_fitness, optimizer="hybrid_ga")
+            METRICS.increment("generations_total", optimizer="hybrid_ga")
+            print(f"  最高適応度: {best_fitness:.2f}, 平均適応度: {avg_fitness:.2f}")
 
-        # 最終世代でなければ次世代を生成
-        if generation < generations - 1:
-            new_population = []
-            new_population.extend(population[:2])  # エリート保存
-
-            while len(new_population) < population_size:
-                parent1 = selection(population)
-                parent2 = selection(population)
-                child = crossover(parent1, parent2)
-                mutate(child)
-                new_population.append(child)
+            if ga_stopping.update(best_fitness, population):
+                break
 
-            population = new_population
+            # 最終世代でなければ次世代を生成
+            if generation < generations - 1:
+                population = next_generation(
+                    population, population_size, mutation_rate, elite_size, tournament_size
+                )
 
     ga_best = population[0]
+    ga_stopping.report("hybrid_ga", "世代")
+    METRICS.end_phase("hybrid_ga")
     print(f"\n✅ GA完了: 最良適応度 = {ga_best.fitness:.2f}")
 
     # フェーズ2: シミュレーテッドアニーリング（局所最適化）
+    METRICS.begin_phase("hybrid_sa")
     print("\n" + "🔥 " * 30)
     print("【フェーズ2: シミュレーテッドアニーリング】")
     print("目的: GAの最良個体を起点に局所最適化")
@@ -1512,11 +5221,9 @@ def hybrid_optimization(use_llm=False):
     best_individual = Individual(current_individual.code)
     best_individual.fitness = current_individual.fitness
 
-    initial_temp = 100.0
-    cooling_rate = 0.95
-    min_temp = 0.1
     temperature = initial_temp
     iteration = 0
+    sa_stopping = EarlyStopping(sa_patience, min_delta, target_fitness)
 
     print(f"\n初期解の適応度: {current_individual.fitness:.2f}")
 
@@ -1526,7 +5233,7 @@ def hybrid_optimization(use_llm=False):
 
         # 新しい解を生成（突然変異）
         new_individual = Individual(current_individual.code)
-        mutate(new_individual, mutation_rate=0.3)
+        mutate(new_individual, sa_mutation_rate)
         new_individual.evaluate_fitness()
 
         # 適応度の差分を計算
@@ -1545,31 +5252,35 @@ def hybrid_optimization(use_llm=False):
                     f"  [SA 反復 {iteration}] 🌟 最良解更新! 適応度: {best_individual.fitness:.2f}"
                 )
 
+        if sa_stopping.update(best_individual.fitness):
+            break
+
         # 温度を下げる
         temperature *= cooling_rate
 
     sa_best = best_individual
+    sa_stopping.report("hybrid_sa", "反復")
+    METRICS.end_phase("hybrid_sa")
+    METRICS.set_gauge("best_fitness", sa_best.fitness, optimizer="hybrid_sa")
     print(f"\n✅ SA完了: 最良適応度 = {sa_best.fitness:.2f} (改善: +{sa_best.fitness - ga_best.fitness:.2f})")
 
     # フェーズ3: Q学習（学習ベース微調整）
+    METRICS.begin_phase("hybrid_ql")
     print("\n" + "🧠 " * 30)
     print("【フェーズ3: Q学習】")
     print("目的: 経験から学習し、効果的な行動で微調整")
     print("🧠 " * 30)
 
-    # 行動空間の定義
-    actions = [
-        "add_function",
-        "remove_function",
-        "add_class",
-        "remove_class",
-        "modify_operator",
-        "mutate",
-        "no_action",
-    ]
-
-    # Q-tableの初期化
-    q_table = QTable(actions, learning_rate=0.1, discount_factor=0.9)
+    # Q-tableの初期化（行動空間は Q_ACTIONS、ファイルがあればウォームスタート）
+    q_table, epsilon_start = prepare_q_table(
+        q_table_path,
+        epsilon_start,
+        warm_epsilon,
+        learning_rate=learning_rate,
+        discount_factor=discount_factor,
+        backend=q_table_backend,
+        epsilon_end=epsilon_end,
+    )
 
     # SAの最良個体を初期解として使用
     best_individual_ql = Individual(sa_best.code)
@@ -1577,11 +5288,8 @@ def hybrid_optimization(use_llm=False):
     best_fitness_ql = best_individual_ql.fitness
 
     # ε-greedy用のパラメータ
-    episodes = 30  # ハイブリッドでは短めに
-    max_steps = 15
-    epsilon_start = 0.5  # 既に良い解があるので探索率は低め
-    epsilon_end = 0.1
     epsilon_decay = (epsilon_start - epsilon_end) / episodes
+    ql_stopping = EarlyStopping(ql_patience, min_delta, target_fitness)
 
     # 各エピソードで学習
     for episode in range(episodes):
@@ -1629,6 +5337,16 @@ def hybrid_optimization(use_llm=False):
         if (episode + 1) % 10 == 0:
             print(f"  [QL エピソード {episode + 1}/{episodes}] 現在の最良適応度: {best_fitness_ql:.2f}")
 
+        if ql_stopping.update(best_fitness_ql):
+            break
+
+    ql_stopping.report("hybrid_ql", "エピソード")
+    if q_table_path is not None:
+        save_q_table(q_table, q_table_path)
+        print(f"Q-tableを保存しました: {q_table_path}")
+
+    METRICS.end_phase("hybrid_ql")
+    METRICS.set_gauge("best_fitness", best_individual_ql.fitness, optimizer="hybrid_ql")
     print(f"\n✅ Q学習完了: 最良適応度 = {best_individual_ql.fitness:.2f} (改善: +{best_individual_ql.fitness - sa_best.fitness:.2f})")
 
     # 最終結果のサマリー
@@ -1639,6 +5357,10 @@ def hybrid_optimization(use_llm=False):
     print(f"SA最良適応度:     {sa_best.fitness:.2f} (+{sa_best.fitness - ga_best.fitness:.2f})")
     print(f"Q学習最良適応度:  {best_individual_ql.fitness:.2f} (+{best_individual_ql.fitness - sa_best.fitness:.2f})")
     print(f"総合改善:         +{best_individual_ql.fitness - ga_best.fitness:.2f}")
+    for phase, phase_stopping in (("GA", ga_stopping), ("SA", sa_stopping), ("Q学習", ql_stopping)):
+        if phase_stopping.stopped:
+            print(f"{phase}の早期終了: {phase_stopping.reason}（{phase_stopping.updates}回目）")
+    print(f"適応度キャッシュ: {FITNESS_CACHE.summary()}")
     print("=" * 60)
     print("最良個体のコード:")
     print("=" * 60)
@@ -1646,57 +5368,475 @@ def hybrid_optimization(use_llm=False):
 
     # LLMで改善する場合
     if use_llm:
+        METRICS.begin_phase("hybrid_llm")
         original_code = best_individual_ql.code
         improved_code = improve_code_with_llm(original_code)
 
         # メイン処理が欠落している場合は追加
-        if "# メイン処理" not in improved_code:
-            print("\n⚠️  LLM改善後にメイン処理が欠落していたため、追加します")
-            # 関数とクラスを抽出
-            import re
-            functions = re.findall(r'def\s+(\w+)\s*\(([^)]*)\)', improved_code)
-            classes = re.findall(r'class\s+(\w+)\s*:', improved_code)
-
-            main_code = '\n\n# メイン処理：生成された関数とクラスを実行\n'
-            main_code += 'print("=" * 40)\n'
-            main_code += 'print("プログラムを開始します")\n'
-            main_code += 'print("=" * 40)\n\n'
-
-            # 関数を呼び出す
-            for func_name, params in functions:
-                param_list = [p.strip() for p in params.split(',') if p.strip()]
-                args = ", ".join(["1" for _ in param_list])  # 簡単なデフォルト値
-                main_code += f'print("関数 {func_name} を実行中...")\n'
-                main_code += f'result = {func_name}({args})\n'
-                main_code += f'print(f"結果: {{result}}")\n'
-                main_code += 'print()\n'
-
-            # クラスを呼び出す
-            for class_name in classes:
-                main_code += f'print("クラス {class_name} をインスタンス化...")\n'
-                main_code += f'obj = {class_name}()\n'
-                main_code += 'print("処理完了")\n'
-                main_code += 'print()\n'
-
-            main_code += 'print("=" * 40)\n'
-            main_code += 'print("すべての処理が完了しました！")\n'
-            main_code += 'print("=" * 40)\n'
-
-            improved_code += main_code
-
+        improved_code = ensure_main_section(improved_code)
         best_individual_ql.code = improved_code
 
         # 改善されたコードを評価
         evaluate_code_with_llm(original_code, improved_code)
+        METRICS.end_phase("hybrid_llm")
 
     # コードを保存
-    mode_name = "Hybrid+LLM" if use_llm else "Hybrid"
-    save_generated_code(best_individual_ql.code, mode_name, best_individual_ql.fitness)
+    if save:
+        mode_name = "Hybrid+LLM" if use_llm else "Hybrid"
+        save_generated_code(best_individual_ql.code, mode_name, best_individual_ql.fitness)
 
     return best_individual_ql
 
 
-def main():
+# ============================================================
+# コマンドライン（非対話のバッチ実行）
+# ============================================================
+
+# サブコマンド -> (最適化関数, 保存時のモード名)
+OPTIMIZERS = {
+    "ga": (genetic_algorithm, "GA"),
+    "island": (island_genetic_algorithm, "GA-Island"),
+    "sa": (simulated_annealing, "SA"),
+    "pt": (parallel_tempering, "PT"),
+    "ql": (q_learning, "Q-Learning"),
+    "hybrid": (hybrid_optimization, "Hybrid"),
+}
+
+
+def _run_seeded_search(command, seed, params, quiet, collect_metrics=False):
+    """シード付きで最適化を1回実行し、(シード, 最良コード, 適応度, 計測値) を返す
+
+    ワーカープロセスから呼び出す場合は collect_metrics=True とし、この実行の計測値を返して親で合算する。
+    """
+    optimizer, _ = OPTIMIZERS[command]
+    random.seed(seed)
+    if collect_metrics:
+        METRICS.reset()
+        METRICS.enable()
+    redirect = contextlib.redirect_stdout(DiscardedOutput()) if quiet else contextlib.nullcontext()
+    with redirect:
+        best = optimizer(save=False, **params)
+    return seed, best.code, best.fitness, METRICS.snapshot() if collect_metrics else None
+
+
+def _init_search_worker(execution_settings, llm_settings, gene_pool_settings):
+    """探索のワーカープロセスに親の実行設定・LLM設定・事前生成プールの設定を引き継ぐ"""
+    EXECUTION_SETTINGS.update(execution_settings)
+    LLM_SETTINGS.update(llm_settings)
+    GENE_POOL_SETTINGS.update(gene_pool_settings)
+
+
+def run_independent_searches(command, params, runs=1, jobs=1, seed=None):
+    """独立したシード付きの探索を runs 回行い、最良の (シード, コード, 適応度) を返す
+
+    LLMでの改善（--llm）は run_command が最良の結果に1回だけ行うので、params の use_llm は False にする。
+
+    メトリクスが有効な場合、ワーカープロセスでの計測値は親の METRICS に合算する。
+
+    jobs > 1 の場合はプロセスプールで並列に実行する（0 ならCPUコア数）。
+    各実行のシードは seed, seed+1, ...（seed が None ならランダムに決めて表示する）。
+    複数回実行する場合、各実行の途中経過は表示せず、実行ごとの結果だけを表示する。
+    """
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+    seeds = [seed + i for i in range(runs)]
+    quiet = runs > 1
+    workers = min(jobs or os.cpu_count(), runs)
+
+    if workers <= 1:
+        results = (_run_seeded_search(command, s, params, quiet) for s in seeds)
+        executor = contextlib.nullcontext()
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_search_worker,
+            initargs=(dict(EXECUTION_SETTINGS), dict(LLM_SETTINGS), dict(GENE_POOL_SETTINGS)),
+        )
+
+    best = None
+    with executor:
+        if workers > 1:
+            results = executor.map(
+                _run_seeded_search,
+                [command] * runs,
+                seeds,
+                [params] * runs,
+                [quiet] * runs,
+                [METRICS.enabled] * runs,
+            )
+        for run_index, (run_seed, code, fitness, snapshot) in enumerate(results, 1):
+            if snapshot is not None:
+                METRICS.merge(snapshot)
+            if quiet:
+                print(f"[実行 {run_index}/{runs}] シード: {run_seed}, 最良適応度: {fitness:.2f}")
+            if best is None or fitness > best[2]:
+                best = (run_seed, code, fitness)
+    return best
+
+
+def build_argument_parser():
+    """コマンドライン引数のパーサーを構築"""
+    parser = argparse.ArgumentParser(
+        description="偶発的なコード生成と最適化（引数なしで実行すると対話メニューを表示）"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common_options(subparser):
+        subparser.add_argument("--llm", action="store_true", help="最良個体をLLMで改善する")
+        subparser.add_argument("--runs", type=int, default=1, help="独立した探索の回数（最良の結果を残す）")
+        subparser.add_argument("--jobs", type=int, default=1, help="並列に実行する探索の数（0: CPUコア数）")
+        subparser.add_argument("--seed", type=int, default=None, help="乱数シード（実行ごとに+1する）")
+        subparser.add_argument("--no-run", action="store_true", help="最良個体を実行しない")
+        subparser.add_argument("--no-save", action="store_true", help="最良個体を保存しない")
+        subparser.add_argument("--backend", choices=["inprocess", "sandbox"], help="候補コードの実行バックエンド")
+        subparser.add_argument("--timeout", type=float, help="1候補あたりの実行時間の上限（秒）")
+        subparser.add_argument(
+            "--output", choices=["passthrough", "capture", "discard"], help="適応度評価中の候補コードの出力"
+        )
+        subparser.add_argument(
+            "--cache-key", choices=["exact", "structural"],
+            help="適応度キャッシュのキー（structural: 識別子の名前だけが異なるプログラムを同じとみなす）",
+        )
+        subparser.add_argument("--metrics-json", type=Path, help="終了時に計測値のサマリーをJSONで書き出すファイル")
+        subparser.add_argument(
+            "--metrics-port", type=int, help="実行中に計測値をPrometheus形式で /metrics に公開するポート"
+        )
+        subparser.add_argument(
+            "--gene-pool-size", type=int,
+            help="バックグラウンドで事前に生成しておく関数・クラス・プログラムの数（種類ごと、0: 使わない）",
+        )
+        add_llm_options(subparser)
+
+    def add_llm_options(subparser):
+        subparser.add_argument("--llm-base-url", help="LLM APIの接続先（mock-llm のURLなど）")
+        subparser.add_argument("--llm-concurrency", type=int, help="LLMへの同時リクエスト数の上限")
+        subparser.add_argument("--llm-rpm", type=float, help="LLMへの1分あたりのリクエスト数の上限")
+        subparser.add_argument(
+            "--llm-stream", action="store_true",
+            help="LLMの応答をストリーミングで受け取り、使えないコードなら途中で打ち切る",
+        )
+        subparser.add_argument(
+            "--no-llm-cache", action="store_true", help="LLMの応答キャッシュを使わない（常にAPIを呼ぶ）"
+        )
+
+    def add_ga_options(subparser, prefix=""):
+        subparser.add_argument("--population-size", type=int, default=10, help="個体数")
+        subparser.add_argument("--generations", type=int, default=5, help="世代数")
+        subparser.add_argument(f"--{prefix}mutation-rate", type=float, default=0.2, help="突然変異率")
+        subparser.add_argument("--elite-size", type=int, default=2, help="エリート保存する個体数")
+        subparser.add_argument("--tournament-size", type=int, default=3, help="トーナメント選択の個体数")
+        subparser.add_argument("--workers", type=int, default=1, help="適応度の並列評価ワーカー数（0: CPUコア数）")
+
+    def add_sa_options(subparser, prefix=""):
+        subparser.add_argument("--initial-temp", type=float, default=100.0, help="初期温度")
+        subparser.add_argument("--cooling-rate", type=float, default=0.95, help="冷却率")
+        subparser.add_argument("--min-temp", type=float, default=0.1, help="最低温度")
+        subparser.add_argument(f"--{prefix}mutation-rate", type=float, default=0.3, help="突然変異率")
+
+    def add_stopping_options(subparser, patience_options, diversity=False):
+        for option, unit in patience_options:
+            subparser.add_argument(
+                option, type=int, default=None, help=f"最良適応度がこの{unit}数だけ改善しなければ打ち切る"
+            )
+        subparser.add_argument(
+            "--min-delta", type=float, default=0.0, help="改善とみなす最良適応度の最小の増分（早期終了の判定）"
+        )
+        subparser.add_argument("--target-fitness", type=float, default=None, help="この適応度に達したら打ち切る")
+        if diversity:
+            subparser.add_argument(
+                "--min-diversity", type=float, default=None,
+                help="個体群の構造の種類の割合（0.0-1.0）がこれを下回ったら打ち切る",
+            )
+
+    def add_ql_options(subparser, episodes, max_steps, epsilon_start):
+        subparser.add_argument("--episodes", type=int, default=episodes, help="エピソード数")
+        subparser.add_argument("--max-steps", type=int, default=max_steps, help="1エピソードの最大ステップ数")
+        subparser.add_argument("--learning-rate", type=float, default=0.1, help="学習率 α")
+        subparser.add_argument("--discount-factor", type=float, default=0.9, help="割引率 γ")
+        subparser.add_argument("--epsilon-start", type=float, default=epsilon_start, help="初期探索率")
+        subparser.add_argument("--epsilon-end", type=float, default=0.1, help="最終探索率")
+        subparser.add_argument(
+            "--q-table", dest="q_table_path", type=Path, default=None,
+            help="Q-tableファイル（あれば学習を再開し、終了時に学習結果を統合して保存）",
+        )
+        subparser.add_argument(
+            "--warm-epsilon", type=float, default=None,
+            help="Q-tableを読み込んだ場合の初期探索率（省略時は --epsilon-start、--epsilon-end 以上）",
+        )
+        subparser.add_argument(
+            "--q-table-backend", choices=Q_TABLE_BACKENDS, default="auto",
+            help="Q-tableの実装（auto: numpy があれば dense、dense: numpy が必要、dict: 辞書）",
+        )
+
+    ga_parser = subparsers.add_parser("ga", help="遺伝的アルゴリズム")
+    add_ga_options(ga_parser)
+    add_stopping_options(ga_parser, [("--patience", "世代")], diversity=True)
+    add_common_options(ga_parser)
+
+    island_parser = subparsers.add_parser("island", help="島モデルの遺伝的アルゴリズム（島ごとにプロセスで進化）")
+    island_parser.add_argument("--num-islands", type=int, default=4, help="島の数")
+    island_parser.add_argument("--island-size", type=int, default=10, help="島ごとの個体数")
+    island_parser.add_argument("--epochs", type=int, default=5, help="移住を行う周期の数")
+    island_parser.add_argument("--migration-interval", type=int, default=3, help="移住の間隔（世代数）")
+    island_parser.add_argument("--migration-size", type=int, default=2, help="1回に移住する上位個体の数")
+    island_parser.add_argument("--topology", choices=MIGRATION_TOPOLOGIES, default="ring", help="移住のトポロジー")
+    island_parser.add_argument("--mutation-rate", type=float, default=0.2, help="突然変異率")
+    island_parser.add_argument("--elite-size", type=int, default=2, help="エリート保存する個体数")
+    island_parser.add_argument("--tournament-size", type=int, default=3, help="トーナメント選択の個体数")
+    island_parser.add_argument("--workers", type=int, default=0, help="島を進化させるプロセス数（0: CPUコア数）")
+    add_common_options(island_parser)
+
+    sa_parser = subparsers.add_parser("sa", help="シミュレーテッドアニーリング")
+    add_sa_options(sa_parser)
+    add_stopping_options(sa_parser, [("--patience", "反復")])
+    add_common_options(sa_parser)
+
+    pt_parser = subparsers.add_parser("pt", help="レプリカ交換法（温度の異なるSAの連鎖を並列に実行）")
+    pt_parser.add_argument("--num-replicas", type=int, default=4, help="レプリカ（連鎖）の数")
+    pt_parser.add_argument("--min-temp", type=float, default=0.1, help="最も低いレプリカの温度")
+    pt_parser.add_argument("--max-temp", type=float, default=100.0, help="最も高いレプリカの温度")
+    pt_parser.add_argument("--exchange-interval", type=int, default=10, help="状態を交換する間隔（反復数）")
+    pt_parser.add_argument("--rounds", type=int, default=14, help="交換を行う回数")
+    pt_parser.add_argument("--mutation-rate", type=float, default=0.3, help="突然変異率")
+    pt_parser.add_argument("--workers", type=int, default=0, help="レプリカを進めるプロセス数（0: CPUコア数）")
+    add_common_options(pt_parser)
+
+    ql_parser = subparsers.add_parser("ql", help="Q学習")
+    add_ql_options(ql_parser, episodes=50, max_steps=20, epsilon_start=1.0)
+    add_stopping_options(ql_parser, [("--patience", "エピソード")])
+    add_common_options(ql_parser)
+
+    hybrid_parser = subparsers.add_parser("hybrid", help="ハイブリッド (GA+SA+Q学習)")
+    add_ga_options(hybrid_parser)
+    add_sa_options(hybrid_parser, prefix="sa-")
+    add_ql_options(hybrid_parser, episodes=30, max_steps=15, epsilon_start=0.5)
+    add_stopping_options(
+        hybrid_parser,
+        [("--ga-patience", "世代"), ("--sa-patience", "反復"), ("--ql-patience", "エピソード")],
+        diversity=True,
+    )
+    add_common_options(hybrid_parser)
+
+    normal_parser = subparsers.add_parser("normal", help="コードを1つ生成して実行")
+    normal_parser.add_argument("--llm", action="store_true", help="生成したコードをLLMで改善する")
+    normal_parser.add_argument("--seed", type=int, default=None, help="乱数シード")
+    add_llm_options(normal_parser)
+
+    export_parser = subparsers.add_parser("export", help="保存したコードを実行できる .py ファイルに書き出す")
+    export_parser.add_argument("key", help="保存したコードのID、またはハッシュの先頭（4文字以上）")
+    export_parser.add_argument("-o", "--output", type=Path, help="書き出すファイル（省略時: code_<モード>_<ID>.py）")
+
+    cache_parser = subparsers.add_parser("llm-cache", help="LLMの応答キャッシュの統計表示・削除")
+    cache_parser.add_argument("--clear", action="store_true", help="保存されている応答を全て削除")
+
+    mock_parser = subparsers.add_parser("mock-llm", help="用意した応答を返すLLM APIのモックサーバーを起動")
+    mock_parser.add_argument("--port", type=int, default=8765, help="待ち受けるポート")
+    mock_parser.add_argument("--responses", type=Path, help="応答ファイル（1行1つのJSON文字列または {\"text\": ...}）")
+    mock_parser.add_argument("--latency", type=float, default=0.0, help="応答までの遅延（秒）")
+    mock_parser.add_argument("--error-rate", type=float, default=0.0, help="ステータス529（過負荷）を返す割合")
+    mock_parser.add_argument("--chunk-delay", type=float, default=0.0, help="ストリーミングで16文字送るごとの遅延（秒）")
+
+    saved_parser = subparsers.add_parser("run-saved", help="保存されたコードを実行")
+    selection_group = saved_parser.add_mutually_exclusive_group()
+    selection_group.add_argument("--list", action="store_true", help="一覧を表示するだけで実行しない")
+    selection_group.add_argument("--index", type=int, default=1, help="一覧の番号（1: 並び順の先頭）")
+    selection_group.add_argument("--id", help="保存したコードのID、またはハッシュの先頭（4文字以上）")
+    selection_group.add_argument("--file", type=Path, help="実行するファイルのパス")
+    saved_parser.add_argument("--mode", help="モードで絞り込む（例: GA, Q-Learning+LLM）")
+    saved_parser.add_argument(
+        "--sort", choices=list(SAVED_CODE_ORDERS), default="date", help="並び順（date: 新しい順 / fitness: 適応度順）"
+    )
+    saved_parser.add_argument("--page", type=int, default=1, help="--list で表示するページ")
+    saved_parser.add_argument("--page-size", type=int, default=20, help="--list の1ページの件数")
+    saved_parser.add_argument("--sandbox", action="store_true", help="隔離したサブプロセスで実行する")
+
+    return parser
+
+
+# サブコマンドごとの最適化関数の引数（argparseの属性名と同じ）
+_OPTIMIZER_PARAMS = {
+    "ga": (
+        "population_size", "generations", "mutation_rate", "elite_size", "tournament_size", "workers",
+        "patience", "min_delta", "target_fitness", "min_diversity",
+    ),
+    "island": (
+        "num_islands", "island_size", "epochs", "migration_interval", "migration_size", "topology",
+        "mutation_rate", "elite_size", "tournament_size", "workers",
+    ),
+    "sa": ("initial_temp", "cooling_rate", "min_temp", "mutation_rate", "patience", "min_delta", "target_fitness"),
+    "pt": (
+        "num_replicas", "min_temp", "max_temp", "exchange_interval", "rounds", "mutation_rate", "workers",
+    ),
+    "ql": (
+        "episodes", "max_steps", "learning_rate", "discount_factor", "epsilon_start", "epsilon_end",
+        "q_table_path", "warm_epsilon", "q_table_backend", "patience", "min_delta", "target_fitness",
+    ),
+    "hybrid": (
+        "population_size", "generations", "mutation_rate", "elite_size", "tournament_size", "workers",
+        "initial_temp", "cooling_rate", "min_temp", "sa_mutation_rate",
+        "episodes", "max_steps", "learning_rate", "discount_factor", "epsilon_start", "epsilon_end",
+        "q_table_path", "warm_epsilon", "q_table_backend", "ga_patience", "sa_patience", "ql_patience",
+        "min_delta", "target_fitness", "min_diversity",
+    ),
+}
+
+
+def run_command(args):
+    """解析済みのコマンドライン引数に従って実行"""
+    if args.command == "run-saved":
+        if args.list:
+            list_saved_codes(args.mode, args.sort, limit=args.page_size, offset=(args.page - 1) * args.page_size)
+            return
+        if args.file is not None:
+            print(f"\n{args.file} を実行します:\n")
+            execute_generated_code(read_saved_code(args.file), max_retries=10, sandbox=args.sandbox)
+            return
+        if args.id is not None:
+            entry = CODE_INDEX.find(args.id)
+            if entry is None:
+                print(f"保存されたコードが見つかりません: {args.id}")
+                sys.exit(1)
+        else:
+            entry = saved_code_entry(args.index, args.mode, args.sort)
+            if entry is None:
+                print(f"無効な番号です: {args.index}")
+                sys.exit(1)
+        print(f"\nID {entry['id']}（{entry['mode']}, {entry['created_at']}）を実行します:\n")
+        execute_generated_code(CODE_INDEX.read(entry), max_retries=10, sandbox=args.sandbox)
+        return
+
+    if args.command == "export":
+        output = export_saved_code(args.key, args.output)
+        if output is None:
+            print(f"保存されたコードが見つかりません: {args.key}")
+            sys.exit(1)
+        print(f"書き出しました: {output}")
+        return
+
+    if args.command == "mock-llm":
+        responses = MockLLMServer.load_responses(args.responses) if args.responses else None
+        server = MockLLMServer(
+            responses, latency=args.latency, error_rate=args.error_rate, chunk_delay=args.chunk_delay
+        ).start(args.port)
+        print(f"LLMのモックサーバーを起動しました: {server.url}（Ctrl+Cで終了）")
+        print(f"使い方: python main.py <コマンド> --llm --llm-base-url {server.url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+            print(f"\n終了します（リクエスト数: {server.request_count}, エラー応答: {server.error_count}）")
+        return
+
+    if args.command == "llm-cache":
+        cache = LLMResponseCache(
+            LLM_SETTINGS["cache_dir"], max_bytes=LLM_SETTINGS["cache_max_bytes"], ttl=LLM_SETTINGS["cache_ttl"]
+        )
+        if args.clear:
+            cache.clear()
+            print(f"LLMの応答キャッシュを削除しました: {cache.directory}")
+        print(f"LLMの応答キャッシュ（{cache.directory}）: {cache.summary()}")
+        return
+
+    configure_llm(
+        **{
+            setting: getattr(args, option)
+            for option, setting in (
+                ("llm_base_url", "base_url"),
+                ("llm_concurrency", "max_concurrency"),
+                ("llm_rpm", "requests_per_minute"),
+            )
+            if getattr(args, option) is not None
+        }
+    )
+    if args.no_llm_cache:
+        configure_llm(use_cache=False)
+    if args.llm_stream:
+        configure_llm(stream=True)
+
+    if args.command == "normal":
+        if args.seed is not None:
+            random.seed(args.seed)
+        generated_code = generate_code()
+        print(generated_code)
+        if args.llm:
+            improved_code = improve_code_with_llm(generated_code)
+            evaluate_code_with_llm(generated_code, improved_code)
+            print_llm_cache_summary()
+            save_generated_code(improved_code, "LLM")
+            execute_generated_code(improved_code, max_retries=10)
+        else:
+            save_generated_code(generated_code, "Normal")
+            execute_generated_code(generated_code)
+        return
+
+    configure_execution(
+        **{
+            key: getattr(args, key)
+            for key in ("backend", "timeout", "output", "cache_key")
+            if getattr(args, key) is not None
+        }
+    )
+    if args.gene_pool_size is not None:
+        configure_gene_pool(buffer_size=args.gene_pool_size)
+    if getattr(args, "q_table_backend", None) == "dense" and import_numpy() is None:
+        print("--q-table-backend dense には numpy が必要です（uv sync --extra fast）")
+        sys.exit(1)
+    if getattr(args, "warm_epsilon", None) is not None and args.warm_epsilon < args.epsilon_end:
+        print(f"--warm-epsilon は --epsilon-end（{args.epsilon_end}）以上を指定してください")
+        sys.exit(1)
+    if args.metrics_json is not None or args.metrics_port is not None:
+        METRICS.enable()
+    if args.metrics_port is not None:
+        host, port = METRICS.serve(args.metrics_port).server_address[:2]
+        print(f"メトリクスを公開しています: http://{host}:{port}/metrics")
+
+    params = {name: getattr(args, name) for name in _OPTIMIZER_PARAMS[args.command]}
+    if "workers" in params:
+        params["workers"] = params["workers"] or None  # 0 はCPUコア数
+    # LLMでの改善は探索ごとには行わず、全ての探索が終わってから最良の結果に1回だけ行う
+    params["use_llm"] = False
+
+    try:
+        seed, code, fitness = run_independent_searches(
+            args.command, params, runs=args.runs, jobs=args.jobs, seed=args.seed
+        )
+    finally:
+        METRICS.stop()  # 探索が終わったら公開をやめる
+    print("\n" + "=" * 60)
+    print(f"最良の結果: シード {seed}, 適応度 {fitness:.2f}（{args.runs}回の探索）")
+    print("=" * 60)
+    if args.llm:
+        improved_code = improve_code_with_llm(code)
+        if args.command == "hybrid":
+            improved_code = ensure_main_section(improved_code)
+        evaluate_code_with_llm(code, improved_code)
+        code = improved_code
+        print_llm_cache_summary()
+    if args.metrics_json is not None:
+        METRICS.write_json(args.metrics_json)
+        print(f"計測値のサマリーを保存しました: {args.metrics_json}")
+
+    if not args.no_save:
+        mode_name = OPTIMIZERS[args.command][1] + ("+LLM" if args.llm else "")
+        save_generated_code(code, mode_name, fitness)
+    if not args.no_run:
+        print("\n最良個体を実行します:\n")
+        execute_generated_code(code, max_retries=10)
+
+
+def main(argv=None):
+    """エントリーポイント（引数なしなら対話メニュー、引数があればサブコマンドを実行）"""
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        run_command(build_argument_parser().parse_args(argv))
+    else:
+        interactive_menu()
+
+
+def interactive_menu():
+    """対話メニューでモードを選択して実行"""
     mode = input(
         "モードを選択してください\n"
         "1: 通常\n"
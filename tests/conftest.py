@@ -0,0 +1,42 @@
+"""テスト共通のフィクスチャ（モジュール全体で共有する設定とキャッシュをテストごとに元に戻す）"""
+
+import random
+
+import pytest
+
+import main
+
+_CACHES = (
+    main.FITNESS_CACHE,
+    main.STRUCTURE_HASH_CACHE,
+    main.GENE_FEATURE_CACHE,
+    main.GENOME_CACHE,
+    main.CODE_OBJECT_CACHE,
+)
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """実行設定・事前生成プールの設定・キャッシュ・乱数の状態をテストごとに独立させる"""
+    execution_settings = dict(main.EXECUTION_SETTINGS)
+    gene_pool_settings = dict(main.GENE_POOL_SETTINGS)
+    random_state = random.getstate()
+    for cache in _CACHES:
+        cache.clear()
+    # 候補コードの出力でテストの出力を乱さず、保存先も一時ディレクトリにする
+    main.configure_execution(output="discard")
+    monkeypatch.chdir(tmp_path)
+    yield
+    main.EXECUTION_SETTINGS.clear()
+    main.EXECUTION_SETTINGS.update(execution_settings)
+    main.GENE_POOL_SETTINGS.clear()
+    main.GENE_POOL_SETTINGS.update(gene_pool_settings)
+    random.setstate(random_state)
+    for cache in _CACHES:
+        cache.clear()
+
+
+@pytest.fixture
+def static_fitness_only(monkeypatch):
+    """適応度を静的評価だけにする（実行時間による加点が無いので、同じシードからは必ず同じ探索になる）"""
+    monkeypatch.setattr(main, "compute_fitness", main.incremental_static_fitness)
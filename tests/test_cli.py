@@ -0,0 +1,74 @@
+"""コマンドライン（引数の解析・独立した探索の実行と最良の結果の保存）のテスト"""
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.usefixtures("static_fitness_only")
+
+
+@pytest.fixture
+def code_index(tmp_path, monkeypatch):
+    index = main.CodeIndex(tmp_path / "generated_codes")
+    monkeypatch.setattr(main, "CODE_INDEX", index)
+    yield index
+    index.close()
+
+
+def run(argv):
+    main.run_command(main.build_argument_parser().parse_args(argv))
+
+
+def test_parser_reads_optimizer_and_common_options():
+    args = main.build_argument_parser().parse_args(
+        ["ga", "--population-size", "6", "--generations", "2", "--runs", "3", "--jobs", "0", "--seed", "5",
+         "--output", "capture", "--no-run"]
+    )
+    assert (args.command, args.population_size, args.generations) == ("ga", 6, 2)
+    assert (args.runs, args.jobs, args.seed, args.output) == (3, 0, 5, "capture")
+    assert (args.no_run, args.no_save, args.llm) == (True, False, False)
+    assert args.mutation_rate == 0.2  # 指定しなければ対話メニューと同じ既定値
+
+
+def test_parser_separates_hybrid_mutation_rates():
+    args = main.build_argument_parser().parse_args(["hybrid", "--mutation-rate", "0.1", "--sa-mutation-rate", "0.4"])
+    assert (args.mutation_rate, args.sa_mutation_rate) == (0.1, 0.4)
+
+
+@pytest.mark.parametrize("argv", [["ga", "--output", "print"], ["sa", "--backend", "docker"], ["unknown"]])
+def test_parser_rejects_invalid_arguments(argv, capsys):
+    with pytest.raises(SystemExit):
+        main.build_argument_parser().parse_args(argv)
+
+
+def test_run_command_saves_the_best_of_all_runs(code_index, capsys):
+    run(["ga", "--population-size", "4", "--generations", "1", "--runs", "3", "--seed", "3", "--no-run"])
+    out = capsys.readouterr().out
+    for run_index in (1, 2, 3):
+        assert f"[実行 {run_index}/3] シード: {2 + run_index}" in out
+    assert "最良の結果: シード" in out
+
+    seed, code, fitness = main.run_independent_searches(
+        "ga", {"population_size": 4, "generations": 1}, runs=3, seed=3
+    )
+    [row] = code_index.query()
+    assert (row["mode"], row["fitness"]) == ("GA", pytest.approx(fitness))
+    assert code_index.read(row) == code
+
+
+def test_llm_improves_only_the_winner(code_index, monkeypatch, capsys):
+    improved = []
+
+    def improve_code_with_llm(code):
+        improved.append(code)
+        return code + "\n# LLMで改善\n"
+
+    monkeypatch.setattr(main, "improve_code_with_llm", improve_code_with_llm)
+    monkeypatch.setattr(main, "evaluate_code_with_llm", lambda original, improved: None)
+    monkeypatch.setattr(main, "print_llm_cache_summary", lambda: None)
+
+    run(["sa", "--initial-temp", "10", "--cooling-rate", "0.5", "--runs", "3", "--seed", "1", "--llm", "--no-run"])
+    assert len(improved) == 1  # 探索ごとではなく、最良の結果に1回だけ
+    [row] = code_index.query()
+    assert row["mode"] == "SA+LLM"
+    assert code_index.read(row) == improved[0] + "\n# LLMで改善\n"
@@ -0,0 +1,111 @@
+"""保存したコードの索引（表の作成・ブロブの共有・以前の形式のファイルの取り込み）のテスト"""
+
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import main
+
+CODE = "def greet(name):\n    print(name)\n\n\ngreet('太郎')\n"
+
+
+@pytest.fixture
+def code_index(tmp_path):
+    index = main.CodeIndex(tmp_path / "generated_codes")
+    yield index
+    index.close()
+
+
+def save_codes(directory, worker, count):
+    """新しく開いた索引に、全員に共通のコードと自分だけのコードを count 件ずつ保存する"""
+    index = main.CodeIndex(directory)
+    try:
+        for number in range(count):
+            index.save(CODE, "共通", "2024-01-01 00:00:00")
+            index.save(f"print({worker}, {number})\n", f"ワーカー{worker}", "2024-01-01 00:00:00", float(number))
+    finally:
+        index.close()
+
+
+def test_new_index_has_current_schema_version(code_index):
+    code_index.save(CODE, "GA", "2024-01-01 00:00:00", 1.5)
+    with sqlite3.connect(code_index.path) as connection:
+        assert connection.execute("PRAGMA user_version").fetchone()[0] == main.CODE_INDEX_VERSION
+
+
+def test_concurrent_fresh_indexes_keep_all_saves(tmp_path):
+    directory = tmp_path / "generated_codes"
+    workers, count = 6, 5
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(save_codes, [directory] * workers, range(workers), [count] * workers))
+
+    index = main.CodeIndex(directory)
+    try:
+        assert index.count() == 2 * workers * count
+        assert index.count("共通") == workers * count
+        runs, blobs, _, _ = index.storage_stats()
+        assert (runs, blobs) == (2 * workers * count, 1 + workers * count)
+        assert index.connection.execute("PRAGMA user_version").fetchone()[0] == main.CODE_INDEX_VERSION
+    finally:
+        index.close()
+
+
+def test_same_code_is_stored_once(code_index):
+    first, stored_first = code_index.save(CODE, "GA", "2024-01-01 00:00:00", 1.0)
+    second, stored_second = code_index.save(CODE, "SA", "2024-01-02 00:00:00", 2.0)
+    assert (stored_first, stored_second) == (True, False)
+    assert first["sha256"] == second["sha256"]
+    assert code_index.storage_stats()[:2] == (2, 1)
+    assert code_index.read(second) == CODE
+
+
+def test_find_by_id_and_hash_prefix(code_index):
+    row, _ = code_index.save(CODE, "GA", "2024-01-01 00:00:00")
+    assert code_index.find(row["id"])["id"] == row["id"]
+    assert code_index.find(row["sha256"][:8])["id"] == row["id"]
+    assert code_index.find("abc") is None  # ハッシュの先頭は4文字以上
+
+
+def test_legacy_files_are_imported(code_index):
+    code_index.directory.mkdir(parents=True)
+    legacy = code_index.directory / "code_GA_20240101_000000.py"
+    legacy.write_text(main.format_saved_code(CODE, "遺伝的アルゴリズム", "2024-01-01 00:00:00", 12.5), encoding="utf-8")
+    (code_index.directory / "code_QL_20240102_000000.py").write_text("print(1)\n", encoding="utf-8")
+
+    rows = code_index.query(sort="fitness")
+    assert [row["filename"] for row in rows] == ["code_GA_20240101_000000.py", "code_QL_20240102_000000.py"]
+    imported = rows[0]
+    assert (imported["mode"], imported["created_at"], imported["fitness"]) == (
+        "遺伝的アルゴリズム",
+        "2024-01-01 00:00:00",
+        12.5,
+    )
+    assert code_index.read(imported) == CODE
+    assert rows[1]["mode"] == "不明"  # メタデータの無いファイル
+
+
+def test_removed_legacy_files_are_dropped(tmp_path):
+    directory = tmp_path / "generated_codes"
+    directory.mkdir()
+    legacy = directory / "code_GA_20240101_000000.py"
+    legacy.write_text(main.format_saved_code(CODE, "GA", "2024-01-01 00:00:00"), encoding="utf-8")
+    index = main.CodeIndex(directory)
+    assert index.count() == 1
+    index.close()
+
+    legacy.unlink()
+    index = main.CodeIndex(directory)  # 次の実行では、索引にあってディレクトリに無いファイルの記録を消す
+    try:
+        assert index.count() == 0
+    finally:
+        index.close()
+
+
+def test_exported_code_round_trips(code_index, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "CODE_INDEX", code_index)
+    row, _ = code_index.save(CODE, "GA", "2024-01-01 00:00:00", 3.0)
+    path = main.export_saved_code(row["id"], tmp_path / "exported.py")
+    assert main.read_saved_code(path) == CODE
+    assert main._parse_saved_code_header(path) == ("GA", "2024-01-01 00:00:00", 3.0)
+    assert main.export_saved_code(row["id"] + 1) is None
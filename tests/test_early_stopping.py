@@ -0,0 +1,94 @@
+"""早期終了（EarlyStopping）の判定のテスト"""
+
+import pytest
+
+import main
+
+
+def test_no_conditions_never_stops():
+    stopping = main.EarlyStopping()
+    assert not any(stopping.update(100.0) for _ in range(50))
+    assert stopping.reason is None
+
+
+def test_patience_counts_updates_without_improvement():
+    stopping = main.EarlyStopping(patience=3)
+    assert not stopping.update(10.0)
+    assert not stopping.update(10.0)
+    assert not stopping.update(12.0)  # 改善したので数え直す
+    assert not stopping.update(12.0)
+    assert not stopping.update(11.0)
+    assert stopping.update(12.0)
+    assert stopping.reason_kind == "plateau"
+    assert stopping.updates == 6
+
+
+def test_min_delta_treats_small_gains_as_stale():
+    stopping = main.EarlyStopping(patience=2, min_delta=5.0)
+    assert not stopping.update(100.0)
+    assert not stopping.update(104.0)
+    assert stopping.update(105.0)
+    assert stopping.reason_kind == "plateau"
+
+
+def test_target_fitness_stops_immediately():
+    stopping = main.EarlyStopping(target_fitness=1500)
+    assert not stopping.update(1499.0)
+    assert stopping.update(1500.0)
+    assert stopping.reason_kind == "target"
+
+
+def test_low_diversity_stops():
+    code, other = main.generate_codes(2, seed=5)
+    population = [main.Individual(code) for _ in range(4)] + [main.Individual(other)]
+    stopping = main.EarlyStopping(min_diversity=0.5)  # 構造の種類の割合は 2/5
+    assert stopping.update(1.0, population)
+    assert stopping.reason_kind == "diversity"
+
+    diverse = [main.Individual(code) for code in main.generate_codes(4, seed=6)]
+    assert not main.EarlyStopping(min_diversity=0.5).update(1.0, diverse)
+
+
+def test_stopped_state_is_sticky():
+    stopping = main.EarlyStopping(target_fitness=10)
+    assert stopping.update(10.0)
+    assert stopping.update(0.0)
+    assert stopping.updates == 1
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"patience": 0}, {"min_delta": -1.0}, {"min_diversity": 1.5}, {"min_diversity": -0.1}]
+)
+def test_invalid_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        main.EarlyStopping(**kwargs)
+
+
+@pytest.fixture
+def recorded_updates(monkeypatch):
+    """EarlyStopping.update に渡された最良適応度を記録する"""
+    updates = []
+    original_update = main.EarlyStopping.update
+
+    def update(self, best_fitness, population=None):
+        updates.append(best_fitness)
+        return original_update(self, best_fitness, population)
+
+    monkeypatch.setattr(main.EarlyStopping, "update", update)
+    return updates
+
+
+def test_genetic_algorithm_stops_at_target(static_fitness_only, recorded_updates):
+    best = main.genetic_algorithm(population_size=6, generations=30, save=False, target_fitness=0)
+    assert best.fitness >= 0
+    assert len(recorded_updates) == 1
+
+
+def test_simulated_annealing_stops_on_plateau(static_fitness_only, recorded_updates):
+    main.simulated_annealing(initial_temp=100.0, cooling_rate=0.9, save=False, patience=3, min_delta=1e9)
+    assert len(recorded_updates) == 4
+
+
+def test_q_learning_stops_on_plateau(static_fitness_only, recorded_updates):
+    main.q_learning(episodes=50, max_steps=3, save=False, patience=2, min_delta=1e9)
+    assert len(recorded_updates) == 3
@@ -0,0 +1,186 @@
+"""適応度の評価（並列評価・キャッシュ・静的評価・遺伝子単位の評価・ゲノム）のテスト"""
+
+import random
+
+import pytest
+
+import main
+from benchmark import build_action_chain, build_corpus, legacy_count_keywords, legacy_static_fitness
+
+
+@pytest.fixture
+def counted_fitness(monkeypatch):
+    """compute_fitness を呼ばれたコードを記録するものに置き換える"""
+    calls = []
+
+    def compute_fitness(code):
+        calls.append(code)
+        return len(code)
+
+    monkeypatch.setattr(main, "compute_fitness", compute_fitness)
+    return calls
+
+
+def test_parallel_evaluation_matches_serial(monkeypatch):
+    monkeypatch.setattr(main, "compute_fitness", len)  # 決定的で、ワーカープロセスにも渡せる評価
+    random.seed(6)
+    codes = [main.generate_code() for _ in range(8)]
+    codes += codes[:3]
+    population = [main.Individual(code) for code in codes]
+    with main.create_evaluation_pool(2) as pool:
+        fitnesses = main.evaluate_population(population, pool)
+    assert fitnesses == [len(code) for code in codes]
+    assert [individual.fitness for individual in population] == fitnesses
+    with main.create_evaluation_pool(1) as pool:
+        assert pool is None  # 1以下なら逐次評価
+
+
+def test_fitness_cache_evaluates_each_code_once(counted_fitness):
+    code = main.generate_code()
+    first = main.Individual(code).evaluate_fitness()
+    second = main.Individual(code).evaluate_fitness()
+    assert first == second
+    assert counted_fitness == [code]
+    assert main.FITNESS_CACHE.hits == 1
+
+
+def test_fitness_cache_distinguishes_different_code(counted_fitness):
+    codes = [main.generate_code() for _ in range(3)]
+    for code in codes:
+        main.Individual(code).evaluate_fitness()
+    assert counted_fitness == codes
+
+
+def test_structural_cache_key_shares_fitness_between_renamed_clones(counted_fitness):
+    code = "def greet(name):\n    print(name)\n\ngreet('太郎')\n"
+    renamed = "def hello(person):\n    print(person)\n\nhello('太郎')\n"
+
+    main.Individual(code).evaluate_fitness()
+    main.Individual(renamed).evaluate_fitness()
+    assert len(counted_fitness) == 2  # 既定（exact）ではコード文字列ごとに評価する
+
+    main.FITNESS_CACHE.clear()
+    counted_fitness.clear()
+    main.configure_execution(cache_key="structural")
+    main.Individual(code).evaluate_fitness()
+    main.Individual(renamed).evaluate_fitness()
+    assert counted_fitness == [code]
+
+
+@pytest.mark.parametrize("extra_genes", [0, 10])
+def test_static_fitness_matches_legacy_implementation(extra_genes):
+    for code in build_corpus(size=30, extra_genes=extra_genes):
+        assert main.static_fitness(code) == legacy_static_fitness(code)
+
+
+def test_count_keywords_matches_str_count():
+    for code in build_corpus(size=20, extra_genes=5):
+        counts = main.count_keywords(code)
+        for keyword in main.COUNTED_KEYWORDS:
+            assert counts.get(keyword, 0) == code.count(keyword)
+        for keyword in main.PRESENCE_KEYWORDS:
+            assert (keyword in counts) == (keyword in code)
+
+
+@pytest.mark.parametrize("size", [100, 500, main.KEYWORD_SCAN_MAX_LENGTH, 5000])
+def test_count_keywords_matches_each_keyword_scan(size):
+    for code in build_corpus(size=20, extra_genes=40):
+        assert main.count_keywords(code[:size]) == legacy_count_keywords(code[:size])
+
+
+def test_count_keywords_handles_overlapping_keywords():
+    # キーワードの断片をつなげて、一致が重なり合うテキストや先頭に空白のあるキーワード（' + "'）を含むテキストを作る
+    fragments = [keyword[:cut] for keyword in main.STATIC_KEYWORDS for cut in range(1, len(keyword) + 1)]
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = "".join(rng.choice(fragments) for _ in range(rng.randint(1, 12)))
+        assert main.count_keywords(text) == legacy_count_keywords(text)
+
+
+def test_incremental_static_fitness_matches_static_fitness():
+    for code in build_corpus(size=20, extra_genes=5) + build_action_chain(steps=80):
+        assert main.incremental_static_fitness(code) == main.static_fitness(code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "# 処理\n\ndef f():\n    print('a')\nprint('b')  # 物語\n\n\n# 昔々\n",
+        "print(1); print(2)\nprint(3)\n",  # 同じ行にある文
+        "@staticmethod\ndef f(): pass\nclass A: pass; x = 1\nprint(1)\nprint(2)\n",
+        "def f(:\n    print(1)\nprint(2)\n",  # 構文エラー
+        "print(1)\r\nprint(2)\r\n",
+        "",
+    ],
+)
+def test_incremental_static_fitness_handles_unusual_layouts(code):
+    assert main.incremental_static_fitness(code) == main.static_fitness(code)
+
+
+def test_incremental_static_fitness_caches_genome_genes():
+    code = main.generate_code()
+    main.incremental_static_fitness(code)
+    for gene in main.parse_genome(code).genes:
+        assert main.GENE_FEATURE_CACHE.get(gene.source) is not None
+
+
+def test_incremental_static_fitness_reuses_unchanged_genes():
+    chain = build_action_chain(steps=40)
+    main.incremental_static_fitness(chain[0])
+    main.GENE_FEATURE_CACHE.hits = main.GENE_FEATURE_CACHE.misses = 0
+    for code in chain[1:]:
+        main.incremental_static_fitness(code)
+    assert main.GENE_FEATURE_CACHE.hits > main.GENE_FEATURE_CACHE.misses
+
+
+def test_genome_round_trip():
+    random.seed(2)
+    for _ in range(20):
+        code = main.generate_code()
+        genome = main.Genome(code)
+        assert "\n".join(genome.lines) == code
+        assert len(genome.functions) == 3
+        assert len(genome.classes) == 2
+        for gene in genome.genes:
+            assert genome.replace(gene, gene.source) == code
+            assert gene.source == "\n".join(code.split("\n")[gene.start:gene.end])
+
+
+def test_genome_remove_drops_only_that_gene():
+    random.seed(3)
+    code = main.generate_code()
+    genome = main.Genome(code)
+    removed = main.Genome(genome.remove(genome.functions[0]))
+    assert [gene.name for gene in removed.functions] == [gene.name for gene in genome.functions[1:]]
+    assert [gene.source for gene in removed.classes] == [gene.source for gene in genome.classes]
+
+
+def test_operators_register_genomes_equal_to_full_parse():
+    derived = []
+
+    def check(code):
+        # 演算の直後にキャッシュにあるのは、変わった部分だけを解析して登録したゲノム
+        genome = main.GENOME_CACHE.get(main.code_hash(code))
+        if genome is not None:
+            full = main.Genome(code)
+            assert [vars(gene) | {"node": None} for gene in genome.genes] == [
+                vars(gene) | {"node": None} for gene in full.genes
+            ]
+            derived.append(code)
+
+    random.seed(8)
+    population = [main.Individual() for _ in range(6)]
+    for _ in range(60):
+        child = main.crossover(*random.sample(population, 2))
+        check(child.code)
+        main.mutate(child, mutation_rate=1.0)
+        check(child.code)
+        child = main.apply_action(child, random.choice(main.Q_ACTIONS))
+        check(child.code)
+        population[random.randrange(len(population))] = child
+    assert len(derived) > 60
+
+
+def test_parse_genome_returns_none_for_syntax_errors():
+    assert main.parse_genome("def broken(:\n    pass\n") is None
+    assert main.Individual("def broken(:\n    pass\n").genome is None
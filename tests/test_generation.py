@@ -0,0 +1,56 @@
+"""偶発的なコードの生成（generate_code と generate_codes の一致・シードによる再現性）のテスト"""
+
+import hashlib
+import itertools
+import random
+
+import pytest
+
+import main
+
+# 生成の実装を変える前の generate_code / generate_random_function / generate_random_class が
+# シード 0〜49 で生成したコードのハッシュ（乱数の使い方が変わっていないことを確かめる）
+GENERATED_CODE_DIGEST = "a2c5bb2e134553030e80ffc5e674231d21d75fc1d4501639a8d618244dbe41c3"
+
+
+def test_generators_produce_the_same_code_as_before():
+    digest = hashlib.sha256()
+    for seed in range(50):
+        random.seed(seed)
+        digest.update(main.generate_code().encode())
+        digest.update(main.generate_random_function().encode())
+        digest.update(main.generate_random_class().encode())
+    assert digest.hexdigest() == GENERATED_CODE_DIGEST
+
+
+@pytest.mark.parametrize("seed", [0, 1, 42])
+def test_generate_codes_matches_generate_code_after_seeding(seed):
+    random.seed(seed)
+    expected = [main.generate_code() for _ in range(5)]
+    assert list(main.generate_codes(5, seed=seed)) == expected
+    assert list(main.generate_codes(5, rng=random.Random(seed))) == expected
+
+
+def test_generate_codes_with_seed_leaves_global_random_untouched():
+    random.seed(3)
+    state = random.getstate()
+    list(main.generate_codes(3, seed=9))
+    assert random.getstate() == state
+
+
+def test_generate_codes_without_seed_uses_global_random():
+    random.seed(5)
+    expected = [main.generate_code(2, 1) for _ in range(3)]
+    random.seed(5)
+    assert list(main.generate_codes(3, num_functions=2, num_classes=1)) == expected
+
+
+def test_generate_codes_is_lazy():
+    codes = main.generate_codes(10**9, seed=1)
+    assert list(itertools.islice(codes, 2)) == list(main.generate_codes(2, seed=1))
+
+
+def test_generate_codes_honours_gene_counts():
+    for code in main.generate_codes(10, seed=4, num_functions=4, num_classes=1):
+        genome = main.Genome(code)
+        assert (len(genome.functions), len(genome.classes)) == (4, 1)
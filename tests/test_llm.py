@@ -0,0 +1,435 @@
+"""LLMゲートウェイ（レート制限・再試行・応答キャッシュ・ストリーミング応答の打ち切り）とモックサーバーのテスト（実際のAPIには接続しない）"""
+
+import json
+import os
+import time
+import types
+import urllib.error
+import urllib.request
+
+import pytest
+
+import main
+
+
+class StatusError(Exception):
+    """HTTPステータス付きのAPIエラー（anthropic の APIStatusError と同じ属性を持つ）"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        headers = {} if retry_after is None else {"retry-after": retry_after}
+        self.response = types.SimpleNamespace(headers=headers)
+
+
+class FakeMessages:
+    """outcomes の例外を順に送出し、最後に応答を返すクライアント"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return types.SimpleNamespace(content=[types.SimpleNamespace(text=outcome)])
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """再試行の待ち時間を実際には待たずに記録する"""
+    delays = []
+    monkeypatch.setattr(main.time, "sleep", delays.append)
+    return delays
+
+
+def fake_gateway(outcomes, **settings):
+    gateway = main.LLMGateway(api_key="test", **settings)
+    gateway._client = types.SimpleNamespace(messages=FakeMessages(outcomes))
+    return gateway
+
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def start(**options):
+        server = main.MockLLMServer(**options).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def post(url, payload):
+    request = urllib.request.Request(
+        url + "/v1/messages", data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.headers["Content-Type"], response.read().decode("utf-8")
+
+
+# ============================================================
+# レート制限
+# ============================================================
+
+
+def test_token_bucket_allows_burst_then_spaces_requests():
+    bucket = main.TokenBucket(rate=10.0, capacity=2)
+    assert [bucket.reserve(), bucket.reserve()] == [0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_refills_only_up_to_capacity():
+    bucket = main.TokenBucket(rate=10.0, capacity=2)
+    bucket.reserve()
+    bucket.reserve()
+    bucket.updated -= 60.0  # 1分経過しても capacity 個までしか貯まらない
+    assert [bucket.reserve(), bucket.reserve()] == [0.0, 0.0]
+    assert bucket.reserve() > 0.0
+
+
+def test_gateway_builds_rate_limiter_from_requests_per_minute():
+    assert main.LLMGateway(api_key="test").rate_limiter is None
+    limiter = main.LLMGateway(api_key="test", requests_per_minute=120, max_concurrency=3).rate_limiter
+    assert (limiter.rate, limiter.capacity) == (2.0, 3)
+
+
+def test_gateway_rejects_unknown_settings():
+    with pytest.raises(ValueError, match="max_retry"):
+        main.LLMGateway(api_key="test", max_retry=3)
+
+
+# ============================================================
+# 再試行
+# ============================================================
+
+
+def test_gateway_retries_transient_errors(sleeps):
+    gateway = fake_gateway([StatusError(529), ConnectionError(), StatusError(500), "改善したコード"])
+    assert gateway.complete("prompt") == "改善したコード"
+    assert len(gateway.client.messages.requests) == 4
+    assert len(sleeps) == 3
+
+
+def test_gateway_backoff_grows_exponentially_up_to_max(sleeps):
+    gateway = fake_gateway([StatusError(503)] * 6 + ["ok"], max_retries=6, backoff_base=0.5, backoff_max=4.0)
+    assert gateway.complete("prompt") == "ok"
+    for attempt, delay in enumerate(sleeps):
+        assert 0.0 <= delay <= min(4.0, 0.5 * 2**attempt)
+    assert all(gateway._backoff(attempt, StatusError(503)) <= 4.0 for attempt in range(20))
+
+
+def test_gateway_waits_at_least_retry_after(sleeps):
+    gateway = fake_gateway([StatusError(429, retry_after="3"), "ok"], backoff_base=0.01)
+    assert gateway.complete("prompt") == "ok"
+    assert sleeps == [3.0]
+
+
+def test_gateway_does_not_retry_client_errors(sleeps):
+    gateway = fake_gateway([StatusError(400), "ok"])
+    with pytest.raises(StatusError):
+        gateway.complete("prompt")
+    assert len(gateway.client.messages.requests) == 1
+    assert sleeps == []
+
+
+def test_gateway_gives_up_after_max_retries(sleeps):
+    gateway = fake_gateway([StatusError(529)] * 3 + ["ok"], max_retries=2)
+    with pytest.raises(StatusError):
+        gateway.complete("prompt")
+    assert len(gateway.client.messages.requests) == 3
+    assert len(sleeps) == 2
+
+
+# ============================================================
+# モックサーバー
+# ============================================================
+
+
+def test_mock_server_returns_responses_in_order(mock_server):
+    server = mock_server(responses=["first", "second"])
+    texts = []
+    for _ in range(3):
+        _, body = post(server.url, {"model": "m", "messages": [{"role": "user", "content": "hi"}]})
+        message = json.loads(body)
+        assert (message["type"], message["model"]) == ("message", "m")
+        texts.append(message["content"][0]["text"])
+    assert texts == ["first", "second", "first"]
+    assert server.request_count == 3
+
+
+def test_mock_server_injects_overloaded_errors(mock_server):
+    server = mock_server(error_rate=1.0)
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        post(server.url, {"messages": []})
+    assert excinfo.value.code == 529
+    assert json.loads(excinfo.value.read())["error"]["type"] == "overloaded_error"
+    assert (server.request_count, server.error_count) == (1, 1)
+
+
+def test_mock_server_rejects_unknown_paths(mock_server):
+    server = mock_server()
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        urllib.request.urlopen(urllib.request.Request(server.url + "/v1/other", data=b"{}"), timeout=5)
+    assert excinfo.value.code == 404
+
+
+def test_mock_server_loads_responses_file(tmp_path):
+    path = tmp_path / "responses.jsonl"
+    path.write_text('"first"\n\n{"text": "second"}\n', encoding="utf-8")
+    assert main.MockLLMServer.load_responses(path) == ["first", "second"]
+
+
+def test_gateway_retries_against_mock_server(mock_server):
+    pytest.importorskip("anthropic")
+    server = mock_server(responses=["first", "second"], error_rate=0.5, seed=1)
+    gateway = main.LLMGateway(api_key="mock", base_url=server.url, backoff_base=0.0, max_retries=10)
+    texts = [gateway.complete(f"prompt {index}") for index in range(4)]
+    assert server.error_count > 0
+    assert server.request_count == 4 + server.error_count
+    assert set(texts) == {"first", "second"}
+
+
+def test_complete_many_sends_prompts_concurrently(mock_server):
+    pytest.importorskip("anthropic")
+    server = mock_server(responses=["only"], latency=0.5)
+    gateway = main.LLMGateway(api_key="mock", base_url=server.url, max_concurrency=4)
+    start = time.perf_counter()
+    assert gateway.complete_many(["a", "b", "c", "d"]) == ["only"] * 4
+    assert time.perf_counter() - start < 4 * 0.5  # 順に送れば2秒以上かかる
+    assert server.request_count == 4
+
+
+def test_get_llm_gateway_uses_dummy_key_for_mock_server(mock_server, monkeypatch):
+    pytest.importorskip("anthropic")
+    server = mock_server(responses=["from mock"])
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "")  # .envファイルのキーも読み込まれない
+    monkeypatch.setitem(main.LLM_SETTINGS, "base_url", server.url)
+    monkeypatch.setattr(main, "_LLM_GATEWAY", None)
+    gateway = main.get_llm_gateway()
+    assert gateway.api_key == "mock"
+    assert gateway.complete("prompt") == "from mock"
+
+
+# ============================================================
+# 応答キャッシュ
+# ============================================================
+
+
+def entry_paths(cache):
+    return sorted(cache.directory.glob("*.json"))
+
+
+def test_response_cache_round_trip(tmp_path):
+    cache = main.LLMResponseCache(tmp_path / "cache")
+    key = main.LLMResponseCache.key({"model": "m", "messages": [{"role": "user", "content": "hi"}]})
+    assert key != main.LLMResponseCache.key({"model": "m", "messages": [{"role": "user", "content": "hello"}]})
+    assert cache.get(key) is None
+    cache.put(key, "応答", model="m")
+    assert cache.get(key) == "応答"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert main.LLMResponseCache(tmp_path / "cache").get(key) == "応答"  # 別のプロセスからも読める
+
+
+def test_response_cache_expires_old_entries(tmp_path):
+    cache = main.LLMResponseCache(tmp_path, ttl=60.0)
+    cache.put("old", "古い応答")
+    cache.put("new", "新しい応答")
+    [path] = [path for path in entry_paths(cache) if path.stem == "old"]
+    entry = json.loads(path.read_text(encoding="utf-8"))
+    entry["created"] -= 61.0
+    path.write_text(json.dumps(entry), encoding="utf-8")
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "新しい応答"
+    assert (cache.expired, cache.misses) == (1, 1)
+    assert not path.exists()  # 期限切れの応答は削除する
+    assert main.LLMResponseCache(tmp_path, ttl=None).get("new") == "新しい応答"
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    text = "x" * 1000
+    cache = main.LLMResponseCache(tmp_path, max_bytes=4000)
+    for index, key in enumerate(["a", "b", "c"]):
+        cache.put(key, text)
+        os.utime(tmp_path / f"{key}.json", (1000 + index, 1000 + index))
+    assert cache.get("a") == text  # 使った応答は最後に使われたものになる
+    cache.put("d", text)
+
+    assert sorted(path.stem for path in entry_paths(cache)) == ["a", "c", "d"]
+    assert cache.evictions == 1
+    assert sum(path.stat().st_size for path in entry_paths(cache)) <= 4000 * 0.9
+
+
+def test_response_cache_disabled_by_zero_size(tmp_path):
+    cache = main.LLMResponseCache(tmp_path / "cache", max_bytes=0)
+    cache.put("key", "応答")
+    assert cache.get("key") is None
+    assert not (tmp_path / "cache").exists()
+
+
+def test_gateway_reuses_cached_responses(tmp_path):
+    gateway = fake_gateway(["first", "second", "third"], cache_dir=tmp_path)
+    assert [gateway.complete("same"), gateway.complete("same"), gateway.complete("other")] == ["first", "first", "second"]
+    assert len(gateway.client.messages.requests) == 2
+
+    other = fake_gateway(["from mock"], cache_dir=tmp_path, base_url="http://127.0.0.1:1")
+    assert other.complete("same") == "from mock"  # 接続先が違えば別のリクエスト
+
+    uncached = fake_gateway(["a", "b"], cache_dir=tmp_path, use_cache=False)
+    assert [uncached.complete("same"), uncached.complete("same")] == ["a", "b"]
+
+
+def test_complete_many_sends_duplicate_prompts_once(mock_server):
+    pytest.importorskip("anthropic")
+    server = mock_server(responses=["only"])
+    gateway = main.LLMGateway(api_key="mock", base_url=server.url, use_cache=False)
+    assert gateway.complete_many(["a", "b", "a"]) == ["only"] * 3
+    assert server.request_count == 2
+
+
+# ============================================================
+# ストリーミング応答の検査
+# ============================================================
+
+GOOD_RESPONSE = main.MOCK_LLM_RESPONSE
+
+
+def feed_in_chunks(checker, text, size):
+    """size 文字ずつ渡し、打ち切る理由と、そこまでに渡した文字数を返す"""
+    for start in range(0, len(text), size):
+        reason = checker.feed(text[start:start + size])
+        if reason:
+            return reason, start + size
+    return checker.finish(), len(text)
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 10000])
+def test_streaming_checker_accepts_valid_code(size):
+    checker = main.StreamingCodeChecker()
+    assert feed_in_chunks(checker, GOOD_RESPONSE, size)[0] is None
+    assert checker.code == GOOD_RESPONSE.split("```python\n")[1].split("\n```")[0]
+
+
+@pytest.mark.parametrize(
+    "block, expected",
+    [
+        ("def f():\nprint('a')\nprint('b')\n", "インデントエラー"),
+        ("import numpy\nprint('a')\n", "標準ライブラリ以外のインポート（numpy）"),
+        ("from .story import hero\nprint(hero)\n", "標準ライブラリ以外のインポート（.story）"),
+        ("def f():\n    import requests\n    return 1\nprint(f())\n", "標準ライブラリ以外のインポート（requests）"),
+        ("print('a'))\nprint('b')\n", "構文エラー"),
+    ],
+)
+def test_streaming_checker_aborts_before_the_block_ends(block, expected):
+    response = "## 改善されたコード\n```python\n" + block + "print('まだ続きがある')\n" * 20 + "```\n"
+    reason, received = feed_in_chunks(main.StreamingCodeChecker(), response, 8)
+    assert reason.startswith(expected)
+    assert received < len(response) / 2
+
+
+@pytest.mark.parametrize(
+    "block",
+    [
+        "x = (\n1,\n2,\n)\nprint(x)\n",
+        'text = """\n昔々\n"""\nprint(text)\n',
+        "@staticmethod\ndef f():\n    pass\nprint(1)\n",
+        "try:\n    x = 1\nexcept Exception:\n    x = 2\nelse:\n    x = 3\nfinally:\n    print(x)\n",
+        "x = 1 + \\\n2\nprint(x)\n",
+        "import json\nfrom collections import Counter\nprint(json.dumps(Counter('ab')))\n",
+    ],
+)
+def test_streaming_checker_waits_for_statements_spanning_lines(block):
+    checker = main.StreamingCodeChecker()
+    assert feed_in_chunks(checker, "```python\n" + block + "```", 3)[0] is None
+    assert checker.code == block.rstrip("\n")
+
+
+def test_streaming_checker_compiles_closed_block():
+    reason, _ = feed_in_chunks(main.StreamingCodeChecker(), "```python\nreturn 1\n```\n", 5)
+    assert reason.startswith("構文エラー")
+
+
+def test_streaming_checker_reset_starts_over():
+    checker = main.StreamingCodeChecker()
+    checker.feed("```python\nimport numpy\n")
+    checker.reset()
+    assert feed_in_chunks(checker, GOOD_RESPONSE, 16)[0] is None
+
+
+class FakeStream:
+    """text_stream で chunks を順に返すストリーミング応答（何個読まれたかを記録）"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+def streaming_gateway(outcomes, tmp_path):
+    """outcomes の例外は接続時に送出し、文字列は16文字ずつのストリーミング応答として返すゲートウェイ"""
+    streams = []
+
+    def stream(**request):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        streams.append(FakeStream([outcome[start:start + 16] for start in range(0, len(outcome), 16)]))
+        return streams[-1]
+
+    gateway = main.LLMGateway(api_key="test", cache_dir=tmp_path)
+    gateway._client = types.SimpleNamespace(messages=types.SimpleNamespace(stream=stream))
+    return gateway, streams
+
+
+def test_gateway_stream_stops_reading_when_checker_aborts(tmp_path, sleeps):
+    bad = "```python\nimport numpy\n" + "print('続き')\n" * 50 + "```\n"
+    gateway, streams = streaming_gateway([StatusError(529), bad, GOOD_RESPONSE], tmp_path)
+    with pytest.raises(main.LLMStreamAborted) as excinfo:
+        gateway.stream("prompt", main.StreamingCodeChecker())
+    assert "numpy" in excinfo.value.reason
+    assert streams[0].read < len(streams[0].chunks) / 4  # 残りは受け取らない
+    assert excinfo.value.text == bad[:16 * streams[0].read]
+    assert len(sleeps) == 1  # 受信を始める前のエラーだけ再試行する
+
+    # 打ち切った応答はキャッシュしないので、同じプロンプトでもう一度リクエストする
+    assert gateway.stream("prompt", main.StreamingCodeChecker()) == GOOD_RESPONSE
+    assert gateway.stream("prompt", main.StreamingCodeChecker()) == GOOD_RESPONSE
+    assert len(streams) == 2
+
+
+def test_improve_code_with_llm_returns_original_code_when_stream_aborts(tmp_path, monkeypatch, capsys):
+    bad = "```python\ndef f():\nprint('a')\n" + "print('b')\n" * 50 + "```\n"
+    gateway, _ = streaming_gateway([bad], tmp_path)
+    monkeypatch.setattr(main, "get_llm_gateway", lambda: gateway)
+    assert main.improve_code_with_llm("print('元のコード')\n", stream=True) == "print('元のコード')\n"
+    assert "LLMの応答を打ち切りました: インデントエラー" in capsys.readouterr().out
+
+
+def test_mock_server_stream_is_cut_off_on_abort(mock_server):
+    pytest.importorskip("anthropic")
+    bad = "```python\nimport numpy\n" + "print('続き')\n" * 200 + "```\n"
+    server = mock_server(responses=[bad], chunk_size=8, chunk_delay=0.005)
+    gateway = main.LLMGateway(api_key="mock", base_url=server.url, use_cache=False)
+    start = time.perf_counter()
+    with pytest.raises(main.LLMStreamAborted) as excinfo:
+        gateway.stream("prompt", main.StreamingCodeChecker())
+    assert len(excinfo.value.text) < len(bad) / 4
+    assert time.perf_counter() - start < len(bad) / 8 * 0.005  # 最後まで待たない
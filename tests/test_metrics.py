@@ -0,0 +1,115 @@
+"""メトリクス（カウンタ・ゲージ・ヒストグラムの集計、Prometheus形式・JSONでの書き出し）のテスト"""
+
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def metrics():
+    metrics = main.Metrics(enabled=True, buckets=(0.1, 1.0))
+    yield metrics
+    metrics.stop()
+
+
+def record(metrics):
+    metrics.increment("actions_total", action="mutate")
+    metrics.increment("actions_total", 2, action="mutate")
+    metrics.increment("actions_total", action="add_class")
+    metrics.set_gauge("best_fitness", 120, optimizer="ga")
+    for seconds in (0.05, 0.5, 3.0):
+        metrics.observe("compile_seconds", seconds)
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = main.Metrics()
+    record(metrics)
+    with metrics.timer("operator_seconds"):
+        pass
+    metrics.begin_phase("search")
+    metrics.end_phase("search")
+    assert (metrics.counters, metrics.gauges, metrics.histograms, metrics.phases) == ({}, {}, {}, {})
+
+
+def test_to_prometheus_writes_counters_gauges_and_cumulative_buckets(metrics):
+    record(metrics)
+    lines = metrics.to_prometheus().splitlines()
+    assert lines.count("# TYPE jugemu_actions_total counter") == 1
+    assert 'jugemu_actions_total{action="add_class"} 1' in lines
+    assert 'jugemu_actions_total{action="mutate"} 3' in lines
+    assert "# TYPE jugemu_best_fitness gauge" in lines
+    assert 'jugemu_best_fitness{optimizer="ga"} 120' in lines
+    assert "# TYPE jugemu_compile_seconds histogram" in lines
+    assert 'jugemu_compile_seconds_bucket{le="0.1"} 1' in lines
+    assert 'jugemu_compile_seconds_bucket{le="1.0"} 2' in lines
+    assert 'jugemu_compile_seconds_bucket{le="+Inf"} 3' in lines
+    assert "jugemu_compile_seconds_sum 3.55" in lines
+    assert "jugemu_compile_seconds_count 3" in lines
+    assert any(line.startswith("jugemu_uptime_seconds ") for line in lines)
+
+
+def test_to_prometheus_escapes_label_values(metrics):
+    metrics.increment("errors_total", kind='say "hi"\\\n')
+    assert 'jugemu_errors_total{kind="say \\"hi\\"\\\\\\n"} 1' in metrics.to_prometheus().splitlines()
+
+
+def test_write_json_exports_summary(metrics, tmp_path):
+    record(metrics)
+    metrics.increment("evaluations_total", 10)
+    metrics.begin_phase("search")
+    metrics.end_phase("search")
+    metrics.write_json(tmp_path / "metrics.json")
+
+    data = json.loads((tmp_path / "metrics.json").read_text(encoding="utf-8"))
+    assert data["counters"] == {
+        "actions_total{action=add_class}": 1,
+        "actions_total{action=mutate}": 3,
+        "evaluations_total": 10,
+    }
+    assert data["gauges"] == {"best_fitness{optimizer=ga}": 120}
+    histogram = data["histograms"]["compile_seconds"]
+    assert (histogram["count"], histogram["sum"]) == (3, pytest.approx(3.55))
+    assert histogram["mean"] == pytest.approx(3.55 / 3)
+    assert histogram["buckets"] == {"0.1": 1, "1.0": 1, "inf": 1}
+    assert set(data["phases"]) == {"search"}
+    assert data["evaluations_per_second"] > 0
+
+
+def test_merge_adds_snapshot_from_another_process(metrics):
+    record(metrics)
+    worker = main.Metrics(enabled=True, buckets=(0.1, 1.0))
+    record(worker)
+    worker.set_gauge("best_fitness", 90, optimizer="ga")
+    metrics.merge(worker.snapshot())
+    assert metrics.counters[("actions_total", (("action", "mutate"),))] == 6
+    assert metrics.gauges[("best_fitness", (("optimizer", "ga"),))] == 120  # 大きい方を残す
+    assert metrics.histograms[("compile_seconds", ())] == [2, 2, 2, pytest.approx(7.1), 6]
+
+
+def test_timer_and_timed_record_histograms(metrics):
+    @metrics.timed("operator_seconds", operator="mutate")
+    def operator():
+        return "done"
+
+    assert operator() == "done"
+    with metrics.timer("compile_seconds"):
+        pass
+    assert metrics.histograms[("operator_seconds", (("operator", "mutate"),))][-1] == 1
+    assert metrics.histograms[("compile_seconds", ())][-1] == 1
+
+
+def test_serve_exposes_metrics_endpoint(metrics):
+    record(metrics)
+    host, port = metrics.serve(0).server_address[:2]
+    with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as response:
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert 'jugemu_actions_total{action="mutate"} 3' in response.read().decode("utf-8")
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        urllib.request.urlopen(f"http://{host}:{port}/other", timeout=5)
+    assert excinfo.value.code == 404
+    with pytest.raises(RuntimeError):
+        metrics.serve(0)
@@ -0,0 +1,111 @@
+"""Q-tableの保存・読み込み（並行して保存した学習結果の統合）のテスト"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import main
+
+STATE = (1, 2, 3, 4)
+NEXT_STATE = (0, 0, 0, 0)
+
+requires_numpy = pytest.mark.skipif(main.import_numpy() is None, reason="numpy が必要")
+BACKENDS = ["dict", pytest.param("dense", marks=requires_numpy)]
+
+
+def learn_and_save(path, worker, updates, backend="dict"):
+    """Q-tableを読み込み、共通の状態と自分だけの状態を updates 回ずつ更新して保存する"""
+    q_table = main.load_q_table(path, backend=backend)
+    time.sleep(0.2)  # 全てのワーカーが読み込んでから保存する
+    own_state = (worker, 0, 0, 0)
+    for _ in range(updates):
+        q_table.update_q_value(STATE, "mutate", 10.0, NEXT_STATE)
+        q_table.update_q_value(own_state, "add_class", float(worker), NEXT_STATE)
+    main.save_q_table(q_table, path)
+    return q_table.get_q_value(own_state, "add_class")
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "qtable.bin"
+    q_table = main.create_q_table(backend="dict")
+    q_table.update_q_value(STATE, "mutate", 5.0, NEXT_STATE)
+    main.save_q_table(q_table, path)
+    loaded = main.load_q_table(path, backend="dict")
+    assert loaded.q_table == q_table.q_table
+    assert loaded.visits == q_table.visits
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_concurrent_saves_keep_all_visits(tmp_path, backend):
+    path = tmp_path / "qtable.bin"
+    workers, updates = 4, 5
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        own_values = list(
+            executor.map(learn_and_save, [path] * workers, range(workers), [updates] * workers, [backend] * workers)
+        )
+
+    merged = main.load_q_table(path, backend="dict")
+    assert merged.visits[(STATE, "mutate")] == workers * updates
+    for worker, value in enumerate(own_values):
+        # 自分だけが更新したQ値はその実行の値のまま残る
+        assert merged.visits[((worker, 0, 0, 0), "add_class")] == updates
+        assert merged.get_q_value((worker, 0, 0, 0), "add_class") == pytest.approx(value)
+
+
+def test_repeated_saves_do_not_double_count(tmp_path):
+    path = tmp_path / "qtable.bin"
+    q_table = main.load_q_table(path, backend="dict")
+    q_table.update_q_value(STATE, "mutate", 1.0, NEXT_STATE)
+    main.save_q_table(q_table, path)
+    main.save_q_table(q_table, path)
+    assert main.load_q_table(path, backend="dict").visits[(STATE, "mutate")] == 1
+
+
+@requires_numpy
+def test_dense_backend_reads_the_same_file(tmp_path):
+    path = tmp_path / "qtable.bin"
+    learn_and_save(path, 1, 3)
+    dense = main.load_q_table(path, backend="dense")
+    sparse = main.load_q_table(path, backend="dict")
+    for (state, action), value in sparse.q_table.items():
+        assert dense.get_q_value(state, action) == pytest.approx(value)
+
+
+def test_dense_backend_requires_numpy(monkeypatch):
+    monkeypatch.setattr(main, "import_numpy", lambda: None)  # numpy が無い環境と同じにする
+    with pytest.raises(ImportError):
+        main.create_q_table(backend="dense")
+    assert isinstance(main.create_q_table(backend="auto"), main.QTable)
+    assert "numpy" in main.describe_q_table(main.create_q_table())
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        main.create_q_table(backend="sparse")
+
+
+def test_warm_epsilon_below_epsilon_end_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        main.prepare_q_table(tmp_path / "qtable.bin", 1.0, warm_epsilon=0.05, epsilon_end=0.1)
+    with pytest.raises(ValueError):
+        main.q_learning(episodes=1, max_steps=1, save=False, warm_epsilon=0.05, epsilon_end=0.1)
+
+
+def test_warm_epsilon_is_used_when_resuming(tmp_path, capsys):
+    path = tmp_path / "qtable.bin"
+    main.save_q_table(main.create_q_table(backend="dict"), path)
+    _, epsilon = main.prepare_q_table(path, 1.0, warm_epsilon=0.3, epsilon_end=0.1, backend="dict")
+    assert epsilon == 0.3
+
+
+@requires_numpy
+def test_dense_backend_loads_without_memory_map(tmp_path):
+    path = tmp_path / "qtable.bin"
+    learn_and_save(path, 1, 3)
+    dense = main.load_q_table(path, backend="dense")
+    np = main.import_numpy()
+    for array in (dense.values, dense.visits):
+        assert not isinstance(array, np.memmap) and array.flags.writeable
+    dense.update_q_value(STATE, "mutate", 1.0, NEXT_STATE)
+    assert main.load_q_table(path, backend="dict").visits[(STATE, "mutate")] == 3  # ファイルは変わらない
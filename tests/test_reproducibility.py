@@ -0,0 +1,107 @@
+"""同じシードからの探索の再現性（遺伝子の事前生成プール・並列実行の有無によらない）のテスト"""
+
+import random
+import threading
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.usefixtures("static_fitness_only")
+
+SEARCHES = {
+    "ga": lambda: main.genetic_algorithm(population_size=6, generations=3, save=False),
+    "sa": lambda: main.simulated_annealing(initial_temp=10.0, cooling_rate=0.7, min_temp=1.0, save=False),
+    "ql": lambda: main.q_learning(episodes=3, max_steps=5, save=False, q_table_backend="dict"),
+}
+
+
+def run_seeded(search, seed):
+    random.seed(seed)
+    best = SEARCHES[search]()
+    return best.code, best.fitness
+
+
+@pytest.mark.parametrize("buffer_size", [0, 16])
+@pytest.mark.parametrize("search", sorted(SEARCHES))
+def test_seeded_search_is_reproducible(search, buffer_size):
+    main.configure_gene_pool(buffer_size=buffer_size)
+    first = run_seeded(search, 7)
+    main.FITNESS_CACHE.clear()
+    assert run_seeded(search, 7) == first
+
+
+@pytest.mark.parametrize("search", sorted(SEARCHES))
+def test_gene_pool_buffer_size_does_not_change_result(search):
+    main.configure_gene_pool(buffer_size=1)
+    small = run_seeded(search, 11)
+    main.FITNESS_CACHE.clear()
+    main.configure_gene_pool(buffer_size=16)
+    assert run_seeded(search, 11) == small
+
+
+def test_gene_pool_sequence_depends_only_on_seed():
+    def take_all(buffer_size):
+        pool = main.GenePool(3, buffer_size).start()
+        try:
+            return [pool.take(kind) for kind in ["program", "function", "class", "function"] * 5]
+        finally:
+            pool.stop()
+
+    assert take_all(1) == take_all(32)
+    assert take_all(1) != [main.GenePool(4, 1).take(kind) for kind in ["program", "function", "class", "function"] * 5]
+
+
+def test_seeded_random_restores_callers_state():
+    random.seed(5)
+    expected = [random.random() for _ in range(3)]
+    random.seed(5)
+    with main.seeded_random(99):
+        inner = random.random()
+    assert [random.random() for _ in range(3)] == expected
+    with main.seeded_random(99):
+        assert random.random() == inner
+
+
+def test_island_model_is_independent_of_workers():
+    def run(workers):
+        random.seed(21)
+        best = main.island_genetic_algorithm(
+            num_islands=2, island_size=4, epochs=2, migration_interval=1, workers=workers, save=False
+        )
+        main.FITNESS_CACHE.clear()
+        return best.code, best.fitness
+
+    assert run(1) == run(2)
+
+
+def test_parallel_tempering_is_independent_of_workers():
+    def run(workers):
+        random.seed(21)
+        best = main.parallel_tempering(num_replicas=2, exchange_interval=3, rounds=2, workers=workers, save=False)
+        main.FITNESS_CACHE.clear()
+        return best.code, best.fitness
+
+    assert run(1) == run(2)
+
+
+def test_parallel_evaluation_does_not_fork_with_gene_pool_thread(monkeypatch):
+    evaluate_population = main.evaluate_population
+    threads_at_evaluation = []
+
+    def record_threads(population, executor=None):
+        if executor is not None:  # ワーカーは最初の評価で fork される
+            threads_at_evaluation.append({thread.name for thread in threading.enumerate()})
+        return evaluate_population(population, executor)
+
+    monkeypatch.setattr(main, "evaluate_population", record_threads)
+
+    def run(workers):
+        random.seed(13)
+        best = main.genetic_algorithm(population_size=6, generations=2, workers=workers, save=False)
+        main.FITNESS_CACHE.clear()
+        return best.code, best.fitness
+
+    assert run(1) == run(2)
+    assert threads_at_evaluation
+    assert not any("gene-pool" in names for names in threads_at_evaluation)
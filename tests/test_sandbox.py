@@ -0,0 +1,202 @@
+"""候補コードの実行（サンドボックスの制限・同一プロセスでの出力の取り込みと破棄）のテスト"""
+
+import contextlib
+import io
+import sys
+
+import pytest
+
+import main
+
+posix_only = pytest.mark.skipif(sys.platform == "win32", reason="rlimit は POSIX のみ")
+
+
+@pytest.fixture(autouse=True)
+def fresh_sandbox_worker():
+    """テストごとに常駐ワーカーを起動し直す（前のテストの制限を引き継がない）"""
+    main.close_sandbox_worker()
+    yield
+    main.close_sandbox_worker()
+
+
+def test_sandbox_runs_code_and_captures_output():
+    result = main.run_code_sandboxed("import sys\nprint('hello')\nprint('warn', file=sys.stderr)\n")
+    assert result.status == "ok"
+    assert result.stdout == "hello\n"
+    assert result.stderr == "warn\n"
+
+
+def test_sandbox_reports_exceptions_with_their_type():
+    result = main.run_code_sandboxed("1 / 0\n")
+    assert result.status == "error"
+    assert result.error_type == "ZeroDivisionError"
+    with pytest.raises(ZeroDivisionError):
+        result.raise_for_error()
+
+
+def test_sandbox_syntax_error_is_not_sent_to_worker():
+    result = main.run_code_sandboxed("def broken(:\n")
+    assert result.error_type == "SyntaxError"
+    assert main._SANDBOX_WORKER is None
+
+
+def forbid_compile(monkeypatch):
+    def compile(*args, **kwargs):
+        raise AssertionError("キャッシュ済みのコードを再コンパイルした")
+
+    monkeypatch.setattr(main, "compile", compile, raising=False)
+
+
+def test_compile_cached_reuses_code_object(monkeypatch):
+    code = "print('hello')\n"
+    compiled = main.compile_cached(code)
+    forbid_compile(monkeypatch)
+    assert main.compile_cached(code) is compiled
+    assert main.validate_code_syntax(code) == (True, None)
+    assert main.run_code_inprocess(code).status == "ok"
+    assert main.run_code_sandboxed(code).stdout == "hello\n"
+    assert main.CODE_OBJECT_CACHE.misses == 1
+
+
+def test_compile_cached_reraises_cached_syntax_error(monkeypatch):
+    code = "def broken(:\n    pass\n"
+    with pytest.raises(SyntaxError) as first:
+        main.compile_cached(code)
+    forbid_compile(monkeypatch)
+    with pytest.raises(SyntaxError) as second:
+        main.compile_cached(code)
+    assert (second.value.lineno, second.value.msg) == (first.value.lineno, first.value.msg)
+    assert main.validate_code_syntax(code) == (False, f"行{first.value.lineno}: {first.value.msg}")
+    assert main.run_code_sandboxed(code).error_type == "SyntaxError"
+    assert main.CODE_OBJECT_CACHE.misses == 1
+
+
+def test_sandbox_timeout_restarts_worker():
+    result = main.run_code_sandboxed("while True:\n    pass\n", timeout=0.5)
+    assert result.status == "timeout"
+    assert main.execution_score(result) == 0
+    assert main.run_code_sandboxed("print(1)\n").stdout == "1\n"
+
+
+@posix_only
+def test_sandbox_cpu_limit_kills_worker():
+    result = main.run_code_sandboxed("while True:\n    pass\n", timeout=30, cpu_limit=1)
+    assert result.status == "crash"
+    assert result.elapsed < 10
+
+
+@posix_only
+def test_sandbox_memory_limit():
+    result = main.run_code_sandboxed("data = 'x' * (1024 ** 3)\n", memory_limit=256 * 1024 * 1024)
+    assert result.status == "error"
+    assert result.error_type == "MemoryError"
+
+
+def test_sandbox_truncates_output():
+    result = main.run_code_sandboxed("print('x' * 100)\n", output_limit=10)
+    assert result.stdout == "x" * 10
+    assert result.truncated
+
+
+def test_sandbox_worker_exit_is_a_crash_and_worker_restarts():
+    result = main.run_code_sandboxed("import os\nos._exit(3)\n")
+    assert result.status == "crash"
+    assert "3" in result.error_message
+    assert main.run_code_sandboxed("print(2)\n").stdout == "2\n"
+
+
+def test_sandbox_candidates_do_not_share_state():
+    main.run_code_sandboxed("import builtins\nbuiltins.print = None\nleaked = 1\n", shared_namespace=True)
+    result = main.run_code_sandboxed("print('leaked' in globals())\n", shared_namespace=True)
+    assert result.stdout == "False\n"
+
+
+def test_sandbox_raw_writes_do_not_corrupt_protocol():
+    result = main.run_code_sandboxed("import os\nos.write(1, b'noise\\n')\nprint('ok')\n")
+    assert result.status == "ok"
+    assert result.stdout == "ok\n"
+
+
+def test_sandbox_worker_is_reused_and_recycled():
+    main.configure_execution(sandbox_max_tasks=3)
+    main.run_code_sandboxed("pass\n")
+    worker = main._SANDBOX_WORKER
+    main.run_code_sandboxed("pass\n")
+    main.run_code_sandboxed("pass\n")
+    assert main._SANDBOX_WORKER is worker
+    main.run_code_sandboxed("pass\n")
+    assert main._SANDBOX_WORKER is not worker
+    assert not worker.alive
+
+
+def test_inprocess_discard_drops_stdout_and_stderr():
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        result = main.run_code_inprocess("import sys\nprint('out')\nprint('err', file=sys.stderr)\n", "discard")
+    assert result.status == "ok"
+    assert output.getvalue() == ""
+
+
+CHATTY = "import sys\nprint('out' * 10)\nprint('err', file=sys.stderr)\n"
+
+
+def test_inprocess_capture_fills_result_without_printing():
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        result = main.run_code_inprocess(CHATTY, "capture")
+    assert output.getvalue() == ""
+    assert (result.stdout, result.stderr, result.truncated) == ("out" * 10 + "\n", "err\n", False)
+
+
+def test_inprocess_passthrough_prints_and_fills_result():
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = main.run_code_inprocess("print('hello')\n", "passthrough")
+    assert output.getvalue() == result.stdout == "hello\n"
+
+
+def test_capture_is_truncated_at_output_limit():
+    main.configure_execution(output_limit=5)
+    result = main.run_code_inprocess(CHATTY, "capture")
+    assert (result.stdout, result.stderr, result.truncated) == ("outou", "err\n", True)
+
+
+def test_both_backends_return_the_same_result_shape():
+    main.configure_execution(output="capture")
+    inprocess = main.run_candidate(CHATTY + "1 / 0\n")
+    main.configure_execution(backend="sandbox")
+    sandboxed = main.run_candidate(CHATTY + "1 / 0\n")
+    for result in (inprocess, sandboxed):
+        assert (result.status, result.error_type) == ("error", "ZeroDivisionError")
+        assert (result.stdout, result.stderr) == ("out" * 10 + "\n", "err\n")
+        assert "ZeroDivisionError" in result.traceback_text
+
+
+def test_unknown_output_mode_is_rejected():
+    with pytest.raises(ValueError):
+        main.configure_execution(output="print")
+
+
+def run_generated(code, capsys, monkeypatch, **kwargs):
+    """execute_generated_code をサンドボックスで実行し、(戻り値, 標準出力) を返す（再生成は記録する）"""
+    regenerated = []
+    monkeypatch.setattr(main, "generate_code", lambda: regenerated.append(1) or "print('再生成')\n")
+    succeeded = main.execute_generated_code(code, sandbox=True, **kwargs)
+    return succeeded, capsys.readouterr().out, regenerated
+
+
+def test_execute_generated_code_shows_sandbox_stderr_and_traceback(capsys, monkeypatch):
+    code = "import sys\nprint('警告', file=sys.stderr)\nraise RuntimeError('失敗')\n"
+    succeeded, out, regenerated = run_generated(code, capsys, monkeypatch, max_retries=1)
+    assert not succeeded
+    assert "警告" in out
+    assert "RuntimeError: 失敗" in out
+    assert 'line 3, in <module>' in out  # 親プロセスの raise_for_error ではなく、候補コードのトレースバック
+
+
+def test_execute_generated_code_stops_on_timeout(capsys, monkeypatch):
+    main.configure_execution(timeout=0.5)
+    succeeded, out, regenerated = run_generated("while True:\n    pass\n", capsys, monkeypatch)
+    assert not succeeded
+    assert "制限時間を超えました" in out
+    assert regenerated == []
@@ -0,0 +1,63 @@
+"""構造ハッシュ（識別子の名前とコメントを無視したコードの同一性）のテスト"""
+
+import re
+
+import main
+
+PROGRAM = '''# 挨拶をする
+class Greeter:
+    def __init__(self, name):
+        self.name = name
+
+    def greet(self):
+        message = f"こんにちは、{self.name}さん"
+        print(message)
+
+
+def run_greeter(who):
+    greeter = Greeter(who)  # インスタンスを作る
+    greeter.greet()
+    print("関数 run_greeter を実行中...")
+
+
+run_greeter("太郎")
+'''
+
+# 属性名（self.name や .greet()）は付け替えの対象外なので、変数・関数・クラスの名前だけを変える
+RENAMES = {"Greeter": "Speaker", "message": "text", "run_greeter": "start", "who": "person", "greeter": "speaker"}
+
+
+def rename(code, renames):
+    return re.sub(r"\b\w+\b", lambda match: renames.get(match.group(), match.group()), code)
+
+
+def test_renamed_clone_has_same_structural_hash():
+    clone = rename(PROGRAM, RENAMES)
+    assert clone != PROGRAM
+    assert main.structural_hash(clone) == main.structural_hash(PROGRAM)
+    assert main.canonicalize_code(clone) == main.canonicalize_code(PROGRAM)
+
+
+def test_comments_and_blank_lines_are_ignored():
+    stripped = "\n".join(line.split("  #")[0] for line in PROGRAM.splitlines() if not line.startswith("#"))
+    assert main.structural_hash(stripped.replace("\n\n\n", "\n")) == main.structural_hash(PROGRAM)
+
+
+def test_structural_changes_change_the_hash():
+    assert main.structural_hash(PROGRAM.replace('"太郎"', '"花子"')) != main.structural_hash(PROGRAM)
+    assert main.structural_hash(PROGRAM.replace("print(message)", "print(message, message)")) != (
+        main.structural_hash(PROGRAM)
+    )
+
+
+def test_builtins_and_attributes_are_not_renamed():
+    assert main.structural_hash("print(len(x))\n") != main.structural_hash("show(size(x))\n")
+    assert main.structural_hash("a.append(1)\n") != main.structural_hash("a.extend(1)\n")
+
+
+def test_generated_clones_are_deduplicated():
+    programs = list(main.generate_codes(5, seed=4))
+    clones = [rename(code, {name: f"{name}_copy" for name in re.findall(r"def (\w+)", code)}) for code in programs]
+    population = [main.Individual(code) for code in programs + clones]
+    unique = main.deduplicate_population(population)
+    assert [individual.code for individual in unique] == programs